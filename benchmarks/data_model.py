@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Measure report processing over a synthetic newman report.
+
+Processes a synthetic report with process_pm_collection_report, reads the
+host key of every item like the certificate consolidation does and reports
+the number of objects created, peak traced memory and processing time.
+Pass --compare-rev to measure the monitor.py of another git revision as well:
+
+    ./benchmarks/data_model.py --items 10000 --compare-rev HEAD~1
+"""
+
+import sys
+import gc
+import json
+import time
+import argparse
+import logging
+import subprocess
+import tempfile
+import tracemalloc
+import importlib.util
+
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parent.parent
+
+
+def build_report(items: int, distinct_urls: int) -> dict:
+    coll_items = []
+    executions = []
+    for i in range(items):
+        url = dict(
+            raw=f"https://bench{i % 50}.example.com/api/v1/resource/{i % distinct_urls}?page=1",
+            protocol="https",
+            host=[f"bench{i % 50}", "example", "com"],
+            path=["api", "v1", "resource", str(i % distinct_urls)],
+            query=[dict(key="page", value="1")],
+        )
+        request = dict(method="GET", url=url, header=[dict(key="Accept", value="*/*")])
+        coll_item = dict(id=f"item-{i}", name=f"item {i}", request=request, event=[], response=[])
+        coll_items.append(coll_item)
+        executions.append(
+            dict(
+                id=f"item-{i}",
+                cursor=dict(ref=f"ref-{i}", position=i, iteration=0),
+                item=json.loads(json.dumps(coll_item)),
+                request=json.loads(json.dumps(request)),
+                response=dict(
+                    id=f"rsp-{i}",
+                    status="OK",
+                    code=200,
+                    responseTime=42,
+                    responseSize=1024,
+                    header=[dict(key="Content-Type", value="application/json")],
+                    stream=None,
+                    cookie=[],
+                ),
+                assertions=[dict(assertion="Status code is 200", skipped=False)],
+            )
+        )
+    # group items in folders of 100 like a real collection
+    folders = [
+        dict(name=f"folder {n}", item=coll_items[n : n + 100])
+        for n in range(0, len(coll_items), 100)
+    ]
+    return dict(collection=dict(info={}, item=folders), run=dict(executions=executions, failures=[]))
+
+
+def measure(module_file: Path, items: int, distinct_urls: int, traced: bool):
+    spec = importlib.util.spec_from_file_location("monitor_bench", module_file)
+    monitor = importlib.util.module_from_spec(spec)
+    # dataclasses resolve string annotations through sys.modules
+    sys.modules[spec.name] = monitor
+    spec.loader.exec_module(monitor)
+    logging.getLogger().setLevel(logging.ERROR)
+
+    report = build_report(items, distinct_urls)
+    gc.collect()
+    objects_before = len(gc.get_objects())
+    if traced:
+        tracemalloc.start()
+    started = time.perf_counter()
+    datastore = monitor.process_pm_collection_report(report, 0)
+    host_keys = {doc.request.url.hostinfo_hashed for doc in datastore.values()}
+    duration = time.perf_counter() - started
+    peak = 0
+    if traced:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    gc.collect()
+    objects_created = len(gc.get_objects()) - objects_before
+    print(
+        json.dumps(
+            dict(
+                items=len(datastore),
+                hosts=len(host_keys),
+                seconds=duration,
+                peak_mib=peak / 2**20,
+                objects=objects_created,
+            )
+        )
+    )
+
+
+def run_measure(label: str, module_file: Path, args):
+    results = {}
+    # timing and memory tracing run in separate processes, tracing slows down processing
+    for traced in [False, True]:
+        cmd = [
+            sys.executable,
+            __file__,
+            "--measure",
+            str(module_file),
+            "--items",
+            str(args.items),
+            "--distinct-urls",
+            str(args.distinct_urls),
+        ]
+        if traced:
+            cmd.append("--traced")
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, encoding="utf-8", check=True)
+        results[traced] = json.loads(proc.stdout.strip().splitlines()[-1])
+    print(
+        "{label:>12}: {seconds:7.3f}s  peak {peak:7.1f} MiB  objects {objects:>8}".format(
+            label=label,
+            seconds=results[False]["seconds"],
+            peak=results[True]["peak_mib"],
+            objects=results[False]["objects"],
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--distinct-urls", type=int, default=500)
+    parser.add_argument("--compare-rev", help="Git revision of monitor.py to compare with.")
+    parser.add_argument("--measure", type=Path, help=argparse.SUPPRESS)
+    parser.add_argument("--traced", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.items, args.distinct_urls, args.traced)
+        return
+
+    print(f"{args.items} items, {args.distinct_urls} distinct urls")
+    if args.compare_rev:
+        with tempfile.TemporaryDirectory() as tempdir:
+            module_file = Path(tempdir) / "monitor.py"
+            module_file.write_text(
+                subprocess.run(
+                    ["git", "show", f"{args.compare_rev}:monitor.py"],
+                    cwd=repo_root,
+                    stdout=subprocess.PIPE,
+                    encoding="utf-8",
+                    check=True,
+                ).stdout
+            )
+            run_measure(args.compare_rev, module_file, args)
+    run_measure("working tree", repo_root / "monitor.py", args)
+
+
+if __name__ == "__main__":
+    main()
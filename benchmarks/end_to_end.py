@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""Time every stage of a check run against local stand-in servers.
+
+Generates a synthetic Postman collection of configurable size and folder
+depth. Its items target a local HTTP server and local HTTPS servers with
+self-signed and expired certificates, all with configurable response latency.
+Results are published to a fake ingestion endpoint instead of App Insights.
+Each stage is timed separately in a fresh process:
+
+    load     load_pm_collection and get_pm_item_table
+    run      run_pm_collection_test (or the worker or native engine, see --runner)
+    process  process_pm_collection_report
+    certs    retrieve_server_certificates
+    publish  publish_in_appinsights
+
+Results can be saved and compared with a later run or another git revision:
+
+    ./benchmarks/end_to_end.py --items 500 --output before.json
+    ./benchmarks/end_to_end.py --items 500 --baseline before.json
+    ./benchmarks/end_to_end.py --items 500 --compare-rev HEAD~1
+"""
+
+import sys
+import ssl
+import gzip
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import threading
+import importlib.util
+
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+repo_root = Path(__file__).resolve().parent.parent
+stages = ["load", "run", "process", "certs", "publish"]
+
+
+def write_self_signed_cert(directory: Path, name: str, expired: bool = False) -> Path:
+    key = ec.generate_private_key(ec.SECP256R1())
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.now(timezone.utc)
+    not_before, not_after = (
+        (now - timedelta(days=60), now - timedelta(days=30))
+        if expired
+        else (now - timedelta(days=1), now + timedelta(days=365))
+    )
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(not_before)
+        .not_valid_after(not_after)
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    pem_file = directory / f"{name}.pem"
+    pem_file.write_bytes(
+        cert.public_bytes(serialization.Encoding.PEM)
+        + key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    )
+    return pem_file
+
+
+def start_server(handler, pem_file: Path = None) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    if pem_file:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(pem_file)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_target_handler(latency_seconds: float):
+    class target_handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency_seconds)
+            body = b'{"status": "ok"}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return target_handler
+
+
+class ingestion_handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    received_items = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        items = len(json.loads(body))
+        with self.lock:
+            ingestion_handler.received_items += items
+        rsp = json.dumps(dict(itemsReceived=items, itemsAccepted=items, errors=[])).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(rsp)))
+        self.end_headers()
+        self.wfile.write(rsp)
+
+    def log_message(self, *args):
+        pass
+
+
+def nest_folders(items: list, depth: int, fanout: int, prefix: str = "folder") -> list:
+    if depth <= 0 or len(items) <= 1:
+        return items
+    size = -(-len(items) // fanout)
+    return [
+        dict(
+            name=f"{prefix} {n // size}",
+            item=nest_folders(items[n : n + size], depth - 1, fanout, f"{prefix} {n // size}"),
+        )
+        for n in range(0, len(items), size)
+    ]
+
+
+def build_collection(items: int, folder_depth: int, fanout: int, targets: list) -> dict:
+    leaves = []
+    for i in range(items):
+        target = targets[i % len(targets)]
+        leaves.append(
+            dict(
+                id=f"bench-item-{i}",
+                name=f"item {i}",
+                request=dict(method="GET", url=f"{target}/resource/{i}?page=1"),
+                response=[],
+            )
+        )
+    return dict(
+        info=dict(
+            name="benchmark",
+            schema="https://schema.getpostman.com/json/collection/v2.1.0/collection.json",
+        ),
+        item=nest_folders(leaves, folder_depth, fanout),
+    )
+
+
+def measure(module_file: Path, collection_file: Path, ingestion_url: str, runner: str):
+    spec = importlib.util.spec_from_file_location("monitor_bench", module_file)
+    monitor = importlib.util.module_from_spec(spec)
+    # dataclasses resolve string annotations through sys.modules
+    sys.modules[spec.name] = monitor
+    spec.loader.exec_module(monitor)
+    logging.getLogger().setLevel(logging.ERROR)
+
+    timings = {}
+    started = time.perf_counter()
+    data = monitor.load_pm_collection(str(collection_file))
+    item_table = None
+    if hasattr(monitor, "get_pm_item_table"):
+        item_table = monitor.get_pm_item_table(data)
+        data = item_table.data
+    timings["load"] = time.perf_counter() - started
+
+    if runner == "native" and not hasattr(monitor, "run_pm_collection_engines"):
+        raise SystemExit(f"{module_file} has no native engine, use --runner newman")
+    if runner == "worker" and not hasattr(monitor, "newman_worker"):
+        raise SystemExit(f"{module_file} has no newman worker, use --runner newman")
+    worker = None
+    if runner == "worker":
+        # a daemon starts the worker once, only later runs are measured
+        worker = monitor.newman_worker()
+        monitor.run_pm_collection_test(dict(info=dict(name="warm-up"), item=[]), nm_worker=worker)
+    started = time.perf_counter()
+    if runner == "native":
+        report, error_rc, _ = monitor.run_pm_collection_engines(data, engine=monitor.Engine.native)
+    elif worker:
+        report, error_rc, _ = monitor.run_pm_collection_test(data, nm_worker=worker)
+    else:
+        report, error_rc, _ = monitor.run_pm_collection_test(data)
+    timings["run"] = time.perf_counter() - started
+    if worker:
+        worker.close()
+
+    started = time.perf_counter()
+    if item_table:
+        datastore = monitor.process_pm_collection_report(report, error_rc, item_table=item_table)
+    else:
+        datastore = monitor.process_pm_collection_report(report, error_rc)
+    timings["process"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if item_table:
+        pm_url_list = item_table.get_urls()
+    else:
+        pm_url_list = monitor.pm_collection_extract_urls(data)
+    sslcert_report_data = monitor.retrieve_server_certificates(pm_url_list)
+    timings["certs"] = time.perf_counter() - started
+
+    # results are published as evaluated by a check run
+    for doc in datastore.values():
+        hostinfo_hashed = doc.request.url.hostinfo_hashed
+        if hostinfo_hashed in sslcert_report_data:
+            monitor.update_check_item_doc(check_item_doc=doc, sslcert_doc=sslcert_report_data[hostinfo_hashed])
+        doc.validate_certificate(self_signed_invalid=False)
+        doc.validate_test_report(include_ssl_test_results=True)
+
+    ikey = "00000000-0000-0000-0000-000000000000"
+    sender = None
+    if hasattr(monitor, "batched_telemetry_sender"):
+        sender = monitor.batched_telemetry_sender(endpoint=ingestion_url)
+        tc = monitor.create_telemetry_client(ikey, sender)
+    else:
+        from applicationinsights import TelemetryClient
+        from applicationinsights.channel import SynchronousQueue, SynchronousSender, TelemetryChannel
+
+        queue = SynchronousQueue(SynchronousSender(service_endpoint_uri=ingestion_url))
+        tc = TelemetryClient(ikey, telemetry_channel=TelemetryChannel(queue=queue))
+    started = time.perf_counter()
+    monitor.publish_in_appinsights(data=datastore, tc=tc, location="benchmark")
+    if sender:
+        sender.close(timeout=60)
+    timings["publish"] = time.perf_counter() - started
+
+    print(
+        json.dumps(
+            dict(
+                timings=timings,
+                items=len(datastore),
+                hosts=len(sslcert_report_data),
+                failed=sum(1 for doc in datastore.values() if not doc.test_success),
+            )
+        )
+    )
+
+
+def run_measure(label: str, module_file: Path, collection_file: Path, ingestion_url: str, args) -> dict:
+    runs = []
+    for _ in range(args.repeat):
+        ingestion_handler.received_items = 0
+        proc = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--measure",
+                str(module_file),
+                "--collection",
+                str(collection_file),
+                "--ingestion-url",
+                ingestion_url,
+                "--runner",
+                args.runner,
+            ],
+            stdout=subprocess.PIPE,
+            encoding="utf-8",
+            check=True,
+        )
+        run = json.loads(proc.stdout.strip().splitlines()[-1])
+        run["published"] = ingestion_handler.received_items
+        runs.append(run)
+    result = dict(
+        label=label,
+        items=runs[0]["items"],
+        hosts=runs[0]["hosts"],
+        failed=runs[0]["failed"],
+        published=runs[0]["published"],
+        stages={
+            stage: dict(
+                median=statistics.median(run["timings"][stage] for run in runs),
+                min=min(run["timings"][stage] for run in runs),
+                runs=[run["timings"][stage] for run in runs],
+            )
+            for stage in stages
+        },
+    )
+    print(
+        f"{label:>12}: "
+        + "  ".join(f"{stage} {result['stages'][stage]['median']:7.3f}s" for stage in stages)
+        + f"  ({result['items']} items, {result['failed']} failed, {result['published']} published)"
+    )
+    return result
+
+
+def print_comparison(baseline: dict, current: dict):
+    print(f"{'stage':>12}  {baseline['label']:>14}  {current['label']:>14}  change")
+    for stage in stages:
+        before = baseline["stages"][stage]["median"]
+        after = current["stages"][stage]["median"]
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"{stage:>12}  {before:13.3f}s  {after:13.3f}s  {change:+6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--folder-depth", type=int, default=2)
+    parser.add_argument("--folder-fanout", type=int, default=4)
+    parser.add_argument("--https-hosts", type=int, default=3, help="Number of HTTPS stand-ins with a valid self-signed certificate.")
+    parser.add_argument("--expired-hosts", type=int, default=1, help="Number of HTTPS stand-ins with an expired certificate.")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Response latency of the stand-in servers.")
+    parser.add_argument("--runner", choices=["auto", "newman", "worker", "native"], default="auto", help="Run stage engine, auto uses newman when installed. worker runs newman in a warm newman worker.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per revision, stage timings report the median.")
+    parser.add_argument("--output", type=Path, help="Save the results as json.")
+    parser.add_argument("--baseline", type=Path, help="Compare with results saved by --output.")
+    parser.add_argument("--compare-rev", help="Git revision of monitor.py to compare with.")
+    parser.add_argument("--measure", type=Path, help=argparse.SUPPRESS)
+    parser.add_argument("--collection", type=Path, help=argparse.SUPPRESS)
+    parser.add_argument("--ingestion-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.collection, args.ingestion_url, args.runner)
+        return
+
+    if args.runner == "auto":
+        args.runner = "newman" if shutil.which("newman") else "native"
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        tempdir = Path(tempdir)
+        handler = make_target_handler(args.latency_ms / 1000)
+        servers = [start_server(handler)]
+        for n in range(args.https_hosts):
+            servers.append(start_server(handler, write_self_signed_cert(tempdir, f"valid-{n}")))
+        for n in range(args.expired_hosts):
+            servers.append(start_server(handler, write_self_signed_cert(tempdir, f"expired-{n}", expired=True)))
+        ingestion = start_server(ingestion_handler)
+        ingestion_url = f"http://127.0.0.1:{ingestion.server_port}/v2/track"
+        targets = [f"http://127.0.0.1:{servers[0].server_port}"] + [
+            f"https://localhost:{server.server_port}" for server in servers[1:]
+        ]
+
+        collection_file = tempdir / "collection.json"
+        collection_file.write_text(
+            json.dumps(build_collection(args.items, args.folder_depth, args.folder_fanout, targets))
+        )
+        print(
+            f"{args.items} items in {args.folder_depth} folder levels, {len(targets)} hosts, "
+            f"{args.latency_ms}ms latency, {args.runner} runner"
+        )
+
+        results = dict(
+            created=datetime.now(timezone.utc).isoformat(),
+            python=platform.python_version(),
+            settings=dict(
+                items=args.items,
+                folder_depth=args.folder_depth,
+                folder_fanout=args.folder_fanout,
+                https_hosts=args.https_hosts,
+                expired_hosts=args.expired_hosts,
+                latency_ms=args.latency_ms,
+                runner=args.runner,
+                repeat=args.repeat,
+            ),
+            revisions=[],
+        )
+        if args.compare_rev:
+            module_file = tempdir / "monitor_rev.py"
+            module_file.write_text(
+                subprocess.run(
+                    ["git", "show", f"{args.compare_rev}:monitor.py"],
+                    cwd=repo_root,
+                    stdout=subprocess.PIPE,
+                    encoding="utf-8",
+                    check=True,
+                ).stdout
+            )
+            results["revisions"].append(
+                run_measure(args.compare_rev, module_file, collection_file, ingestion_url, args)
+            )
+        results["revisions"].append(
+            run_measure("working tree", repo_root / "monitor.py", collection_file, ingestion_url, args)
+        )
+        for server in servers + [ingestion]:
+            server.shutdown()
+
+    if args.compare_rev:
+        print_comparison(results["revisions"][0], results["revisions"][-1])
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if baseline.get("settings") != results["settings"]:
+            print(f"Note: baseline settings differ: {baseline.get('settings')}")
+        print_comparison(baseline["revisions"][-1] | dict(label="baseline"), results["revisions"][-1])
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Compare peak memory of newman report parsing with and without response bodies.
+
+Generates a synthetic newman JSON report and parses it in a fresh process per
+mode, reporting wall time and peak RSS:
+
+    ./benchmarks/report_memory.py --executions 200 --body-size 200000
+"""
+
+import sys
+import json
+import random
+import argparse
+import resource
+import subprocess
+import tempfile
+import time
+
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_root))
+
+
+def write_report(path: Path, executions: int, body_size: int):
+    with path.open(mode="w") as fp:
+        fp.write('{"collection": {"info": {}, "item": [')
+        fp.write(
+            ", ".join(
+                json.dumps(
+                    dict(
+                        id=f"item-{i}",
+                        name=f"item {i}",
+                        request=dict(method="GET", url=dict(raw=f"https://bench{i % 50}.local/{i}")),
+                        event=[],
+                        response=[],
+                    )
+                )
+                for i in range(executions)
+            )
+        )
+        fp.write(']}, "run": {"failures": [], "executions": [')
+        for i in range(executions):
+            if i:
+                fp.write(", ")
+            body = ", ".join(str(random.randint(0, 255)) for _ in range(body_size))
+            execution = dict(
+                id=f"item-{i}",
+                cursor=dict(ref=f"ref-{i}"),
+                item=dict(
+                    id=f"item-{i}",
+                    name=f"item {i}",
+                    request=dict(method="GET", url=dict(raw=f"https://bench{i % 50}.local/{i}")),
+                    event=[],
+                    response=[],
+                ),
+                request=dict(method="GET", url=dict(raw=f"https://bench{i % 50}.local/{i}")),
+                response=dict(
+                    id=f"rsp-{i}",
+                    status="OK",
+                    code=200,
+                    responseTime=42,
+                    responseSize=body_size,
+                    header=[dict(key="Content-Type", value="application/json")],
+                    stream="__STREAM__",
+                    cookie=[],
+                ),
+                assertions=[],
+            )
+            fp.write(
+                json.dumps(execution, indent=2).replace(
+                    '"__STREAM__"', '{"type": "Buffer", "data": [' + body + "]}"
+                )
+            )
+        fp.write("]}}")
+
+
+def measure(mode: str, report_file: Path):
+    import logging
+    import monitor
+
+    logging.getLogger().setLevel(logging.ERROR)
+    started = time.perf_counter()
+    with report_file.open(mode="r") as fp:
+        if mode == "json":
+            report_data = json.load(fp)
+        else:
+            report_data = monitor.load_pm_report(fp)
+    datastore = monitor.process_pm_collection_report(report_data, 0)
+    duration = time.perf_counter() - started
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps(dict(mode=mode, items=len(datastore), seconds=duration, peak_rss_kb=peak_rss_kb)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--executions", type=int, default=200)
+    parser.add_argument("--body-size", type=int, default=200000, help="Response body size in bytes.")
+    parser.add_argument("--measure", choices=["json", "stripped"], help=argparse.SUPPRESS)
+    parser.add_argument("--report-file", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.report_file)
+        return
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        report_file = Path(tempdir) / "report.json"
+        write_report(report_file, args.executions, args.body_size)
+        print(f"report: {report_file.stat().st_size / 2**20:.1f} MiB, {args.executions} executions")
+        for mode in ["json", "stripped"]:
+            proc = subprocess.run(
+                [sys.executable, __file__, "--measure", mode, "--report-file", str(report_file)],
+                stdout=subprocess.PIPE,
+                encoding="utf-8",
+                check=True,
+            )
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            print(
+                "{mode:>8}: {seconds:7.2f}s  peak RSS {rss:8.1f} MiB".format(
+                    mode=mode, seconds=result.get("seconds"), rss=result.get("peak_rss_kb") / 1024
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
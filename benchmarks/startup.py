@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Measure the import time of monitor.py and fail when it exceeds a budget.
+
+Imports monitor in a fresh process with python -X importtime, reports the
+median cumulative import time and the slowest modules it imports, and
+checks that heavy dependencies are not imported on startup:
+
+    ./benchmarks/startup.py
+    ./benchmarks/startup.py --budget-ms 100 --repeat 10
+
+Exits with 1 when the median exceeds --budget-ms or a module of --forbid is
+imported, so it can be used as a check before merging.
+"""
+
+import sys
+import argparse
+import statistics
+import subprocess
+
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parent.parent
+default_forbidden = "requests,cryptography,crl_checker,applicationinsights,urlpath,asyncio"
+
+
+def parse_importtime(output: str, module: str = "monitor") -> list:
+    """(name, level, self_us, cumulative_us) of module and everything it imported.
+
+    importtime lists a module after the modules it imports, nested modules are
+    indented two spaces per level.
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|", 2)
+        level = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        entries.append((name.strip(), level, int(self_us), int(cumulative_us)))
+    for index, (name, level, _, _) in enumerate(entries):
+        if name == module and level == 0:
+            start = index
+            while start > 0 and entries[start - 1][1] > 0:
+                start -= 1
+            return entries[start : index + 1]
+    raise RuntimeError(f"{module} not found in importtime output")
+
+
+def measure() -> list:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import monitor"],
+        cwd=repo_root,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        encoding="utf-8",
+    )
+    if proc.returncode:
+        raise RuntimeError(f"Importing monitor failed:\n{proc.stderr}")
+    return parse_importtime(proc.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Imports to measure, the median is reported.")
+    parser.add_argument("--budget-ms", type=float, default=150.0, help="Maximum median import time of monitor.")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest direct imports to list.")
+    parser.add_argument("--forbid", default=default_forbidden, help="Comma separated top level modules monitor must not import on startup.")
+    args = parser.parse_args()
+
+    # the first import compiles monitor.py, only measure warm imports
+    measure()
+    runs = [measure() for _ in range(args.repeat)]
+    totals_ms = [run[-1][3] / 1000 for run in runs]
+    median_ms = statistics.median(totals_ms)
+
+    direct = {}
+    for run in runs:
+        for name, level, _, cumulative_us in run:
+            if level == 1:
+                direct.setdefault(name, []).append(cumulative_us / 1000)
+    print(f"{'module':40} {'median ms':>10}")
+    slowest = sorted(direct.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for name, values in slowest[: args.top]:
+        print(f"{name:40} {statistics.median(values):10.1f}")
+    print(f"{'monitor':40} {median_ms:10.1f}  (min {min(totals_ms):.1f}, max {max(totals_ms):.1f})")
+
+    failed = False
+    forbidden = {name for name in args.forbid.split(",") if name}
+    imported = sorted({name.split(".")[0] for name, _, _, _ in runs[-1]} & forbidden)
+    if imported:
+        print(f"FAIL: monitor imports {', '.join(imported)} on startup")
+        failed = True
+    if median_ms > args.budget_ms:
+        print(f"FAIL: import time {median_ms:.1f}ms exceeds the budget of {args.budget_ms:.1f}ms")
+        failed = True
+    if not failed:
+        print(f"OK: import time within the budget of {args.budget_ms:.1f}ms")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,14 +9,10 @@ then
   _CMD_OPTS="${_CMD_OPTS} -vvvv"
 fi
 
-while true;
-do
-  sleep "${_SLEEP_TIMER_M}m" &
-  /runtime/monitor.py $_CMD_OPTS
-  if [ "${_SLEEP_TIMER_M}" -gt 0 ];
-  then
-    wait
-  else
-    break
-  fi
-done
+if [ "${_SLEEP_TIMER_M}" -gt 0 ];
+then
+  # keep one process alive, scheduling is handled by the monitor itself
+  _CMD_OPTS="${_CMD_OPTS} --daemon"
+fi
+
+exec /runtime/monitor.py $_CMD_OPTS
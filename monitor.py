@@ -22,12 +22,13 @@ __license__ = "Apache License 2.0"
 
 
 import sys
-assert sys.version_info >= (3, 7)
+assert sys.version_info >= (3, 10)
 
+import abc
 import hashlib
+import functools
 import dataclasses
 import typer
-import requests
 import json
 import subprocess
 import shutil
@@ -37,22 +38,76 @@ import ssl
 import re
 import socket
 import ipaddress
-import crl_checker
+import time
+import signal
+import threading
+import copy
+import uuid
+import random
+import gzip
+import collections
+import contextlib
+import cProfile
+import resource
+import urllib.parse
+import mmap
+import math
+import struct
+import array
+import queue
+import itertools
+import os
+import weakref
 
-from enum import IntEnum
-from typing import Any, Tuple, List
+from enum import Enum, IntEnum
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Any, Callable, Tuple, List
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
 from pprint import pprint as pp
 
-from cryptography import x509
-from applicationinsights import TelemetryClient
-from urlpath import URL
+# heavy dependencies are imported where they are used, so that starting up,
+# failing on bad settings or running without certificate checks does not pay
+# for them, see benchmarks/startup.py
+if TYPE_CHECKING:
+    import requests
+    from cryptography import x509
+    from applicationinsights import TelemetryClient
+    from urlpath import URL
 
 app = typer.Typer()
 testcmd = "newman"
 testcmd_opts = "run --insecure --reporters json"
+testcmd_opts_incremental = "run --insecure --reporters ndjson"
+newman_worker_script = Path(__file__).resolve().parent / "node" / "newman-worker.js"
 monitor_type = "azure-url-monitor"
+ai_ingestion_endpoint = "https://dc.services.visualstudio.com/v2/track"
+# collection, folder or item variable holding the check interval of its items
+pm_interval_variable = "monitor_interval_seconds"
+# result history file layout: header, then per item a slot header and arrays
+history_magic = b"URLMHIST"
+history_header = struct.Struct("<8sIII4x")  # magic, version, max items, window
+history_slot_header = struct.Struct("<16sII")  # item id hash, next index, count
+history_min_samples = 10
+# urlcheck settings which can differ per collection of a collection manifest
+collection_setting_names = (
+    "pm_collection_url",
+    "nm_timeout_collection",
+    "nm_timeout_request",
+    "nm_timeout_script",
+    "certificate_validation_check",
+    "certificate_ignore_self_signed",
+    "certificate_check_expiration",
+    "certificate_expiration_gracetime_days",
+    "rc_range",
+    "rc_list",
+    "shards",
+    "shard_mode",
+    "engine",
+    "native_concurrency",
+    "incremental",
+    "latency_regression_factor",
+)
 
 # logging setup
 format = "%(asctime)s - %(levelname)s - %(message)s"
@@ -67,7 +122,70 @@ class RC(IntEnum):
     OTHER = 127
 
 
-@dataclasses.dataclass
+class Engine(str, Enum):
+    newman = "newman"
+    native = "native"
+    auto = "auto"
+
+
+class ShardMode(str, Enum):
+    folder = "folder"
+    item = "item"
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class pm_parsed_url:
+    url_parsed: "URL" = None
+    url_hashed: str = None
+    hostinfo_hashed: str = None
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_pm_request_url(
+    raw: str, protocol: str, hostname: str, port: str, url_path: str, url_query: str
+) -> pm_parsed_url:
+    """Parse and hash url components once, identical urls share the result."""
+    from urlpath import URL
+
+    url_parsed = None
+    # try parsing url data
+    if len(raw) > 0:
+        url_parsed = URL(raw)
+    elif len(hostname) > 0:
+        reconstructed_url = "{schema}://{hostname}{port}{path}{query}".format(
+            schema=protocol,
+            hostname=hostname,
+            port=f":{port}" if port else "",
+            path=f"/{url_path}" if len(url_path) > 0 else "/",
+            query=f"?{url_query}" if len(url_query) > 0 else "",
+        )
+        url_parsed = URL(reconstructed_url)
+
+    if not url_parsed:
+        return pm_parsed_url()
+
+    # try populating fields from parsed url if missing
+    if not protocol:
+        protocol = url_parsed.scheme
+    if not port:
+        port = url_parsed.port
+    if not port and protocol.lower() == "https":
+        port = "443"
+
+    # adjust parsed url with new components
+    url_parsed = url_parsed.with_components(port=port)
+
+    # get a unique enough hash from parsed url
+    return pm_parsed_url(
+        url_parsed=url_parsed,
+        url_hashed=hashlib.sha1(url_parsed.as_uri().encode("utf-8")).hexdigest(),
+        hostinfo_hashed=hashlib.sha1(
+            str(url_parsed.hostinfo).encode("utf-8")
+        ).hexdigest(),
+    )
+
+
+@dataclasses.dataclass(slots=True)
 class pm_request_url:
     host: list = dataclasses.field(default_factory=list)
     protocol: str = None
@@ -75,67 +193,82 @@ class pm_request_url:
     raw: str = dataclasses.field(default_factory=str)
     query: list = dataclasses.field(default_factory=list)
     path: list = dataclasses.field(default_factory=list)
-    variable: list = dataclasses.field(default_factory=list)
-    url_parsed: URL = None
-    url_hashed: str = None
-    hostinfo_hashed: str = None
+    variable: dataclasses.InitVar[list] = None
+    parsed: pm_parsed_url = dataclasses.field(default=None, init=False, repr=False, compare=False)
 
-    def __post_init__(self):
-        # try parsing url data
-        if len(self.raw) > 0:
-            self.url_parsed = URL(self.raw)
-        elif len(self.host) > 0:
-            url_path = "/".join(self.path)
-            url_query = "&".join(
-                [
-                    "{0}={1}".format(item.get("key"), item.get("value"))
-                    for item in self.query
-                ]
-            )
-            reconstructed_url = "{schema}://{hostname}{port}{path}{query}".format(
-                schema=self.protocol,
-                hostname=".".join(self.host),
-                port=f":{self.port}" if self.port else "",
-                path=f"/{url_path}" if len(url_path) > 0 else "/",
-                query=f"?{url_query}" if len(url_query) > 0 else "",
+    def get_parsed(self) -> pm_parsed_url:
+        # parse lazily, most url objects are never looked at
+        if self.parsed is None:
+            url_path, url_query, hostname = "", "", ""
+            if len(self.raw) == 0 and len(self.host) > 0:
+                url_path = "/".join(self.path)
+                url_query = "&".join(
+                    [
+                        "{0}={1}".format(item.get("key"), item.get("value"))
+                        for item in self.query
+                    ]
+                )
+                hostname = ".".join(self.host)
+            self.parsed = parse_pm_request_url(
+                self.raw,
+                self.protocol,
+                hostname,
+                str(self.port) if self.port else None,
+                url_path,
+                url_query,
             )
-            self.url_parsed = URL(reconstructed_url)
+        return self.parsed
 
-        if self.url_parsed:
+    @property
+    def url_parsed(self) -> "URL":
+        return self.get_parsed().url_parsed
 
-            # try populating fields from parsed url if missing
-            if not self.protocol:
-                self.protocol = self.url_parsed.scheme
-            if not self.port:
-                self.port = self.url_parsed.port
-            if not self.port and self.protocol.lower() == "https":
-                self.port = "443"
+    @property
+    def url_hashed(self) -> str:
+        return self.get_parsed().url_hashed
 
-            # adjust parsed url with new components
-            self.url_parsed = self.url_parsed.with_components(port=self.port)
+    @property
+    def hostinfo_hashed(self) -> str:
+        return self.get_parsed().hostinfo_hashed
 
-            # get a unique enough hash from parsed url
-            self.url_hashed = hashlib.sha1(
-                self.url_parsed.as_uri().encode("utf-8")
-            ).hexdigest()
-            self.hostinfo_hashed = hashlib.sha1(
-                str(self.url_parsed.hostinfo).encode("utf-8")
-            ).hexdigest()
 
-
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class pm_request:
     method: str
     url: pm_request_url
-    body: dict = dataclasses.field(default_factory=dict)
-    header: list = dataclasses.field(default_factory=list)
-    auth: dict = dataclasses.field(default_factory=dict)
+    body: dataclasses.InitVar[dict] = None
+    header: dataclasses.InitVar[list] = None
+    auth: dataclasses.InitVar[dict] = None
 
-    def __post_init__(self):
-        self.url = pm_request_url(**self.url)
+    def __post_init__(self, body, header, auth):
+        if isinstance(self.url, str):
+            self.url = pm_request_url(raw=self.url)
+        else:
+            self.url = pm_request_url(**self.url)
 
 
-@dataclasses.dataclass
+def pm_timing_phases(timings: dict) -> dict:
+    """Request phase durations from newman request timings, like sdk.Response.timingPhases."""
+    offset = timings.get("offset") if isinstance(timings, dict) else None
+    if not offset:
+        return None
+    phases = dict(
+        prepare=offset.get("request"),
+        wait=offset.get("socket", 0) - offset.get("request", 0),
+        dns=offset.get("lookup", 0) - offset.get("socket", 0),
+        tcp=offset.get("connect", 0) - offset.get("lookup", 0),
+        firstByte=offset.get("response", 0) - offset.get("connect", 0),
+        download=offset.get("end", 0) - offset.get("response", 0),
+        process=offset.get("done", 0) - offset.get("end", 0),
+        total=offset.get("done"),
+    )
+    if offset.get("secureConnect"):
+        phases["secureHandshake"] = offset.get("secureConnect") - offset.get("connect", 0)
+        phases["firstByte"] = offset.get("response", 0) - offset.get("secureConnect")
+    return {phase: value for phase, value in phases.items() if value is not None}
+
+
+@dataclasses.dataclass(slots=True)
 class pm_response:
     id: str
     status: str
@@ -143,39 +276,45 @@ class pm_response:
     responseTime: int
     responseSize: int
     header: list = dataclasses.field(default_factory=list)
-    stream: dict = dataclasses.field(default_factory=dict)
-    cookie: list = dataclasses.field(default_factory=list)
+    timingPhases: dict = None
+    stream: dataclasses.InitVar[dict] = None
+    cookie: dataclasses.InitVar[list] = None
+    timings: dataclasses.InitVar[dict] = None
+
+    def __post_init__(self, stream, cookie, timings):
+        if self.timingPhases is None and timings:
+            self.timingPhases = pm_timing_phases(timings)
 
     def get_headers(self) -> dict:
         return dict([(hdr.get("key"), hdr.get("value")) for hdr in self.header])
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class pm_item:
     id: str
     name: str
     request: pm_request
-    event: Any
+    event: dataclasses.InitVar[Any]
     response: Any
 
-    def __post_init__(self):
+    def __post_init__(self, event):
         self.request = pm_request(**self.request)
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class pm_execution_result:
     id: str
-    item: pm_item
-    cursor: dict
-    request: Any = None
+    item: dataclasses.InitVar[dict]
+    cursor: dataclasses.InitVar[dict]
+    request: dataclasses.InitVar[dict] = None
     response: Any = None
     requestError: dict = dataclasses.field(default_factory=dict)
     assertions: list = dataclasses.field(default_factory=list)
+    # ms waited for the host limits, native engine only
+    queueTime: int = None
 
-    def __post_init__(self):
-        self.item = pm_item(**self.item)
-        if self.request:
-            self.request = pm_request(**self.request)
+    def __post_init__(self, item, cursor, request):
+        # item and request duplicate the collection item, only the results are kept
         if self.response:
             self.response = pm_response(**self.response)
         if self.assertions:
@@ -184,7 +323,7 @@ class pm_execution_result:
             ]
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class pm_assertion_test_error:
     name: str
     index: int
@@ -193,7 +332,7 @@ class pm_assertion_test_error:
     stack: str
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class pm_assertion:
     assertion: str
     skipped: bool
@@ -204,15 +343,15 @@ class pm_assertion:
             self.error = pm_assertion_test_error(**self.error)
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class pm_failure_result:
     source: pm_item
     error: dict
     at: str
-    parent: dict
-    cursor: dict
+    parent: dataclasses.InitVar[dict]
+    cursor: dataclasses.InitVar[dict]
 
-    def __post_init__(self):
+    def __post_init__(self, parent, cursor):
         self.source = pm_item(**self.source)
 
     def __str__(self):
@@ -225,10 +364,515 @@ class pm_failure_result:
         )
 
 
+def get_host_key(url: str) -> str:
+    """Host identity of a url, the hostinfo_hashed of pm_request_url."""
+    try:
+        return pm_request_url(raw=url).hostinfo_hashed
+    except ValueError:
+        return None
+
+
+@dataclasses.dataclass(slots=True)
+class host_limit:
+    semaphore: threading.BoundedSemaphore = None
+    tokens: float = 0.0
+    updated: float = 0.0
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+
+
+@dataclasses.dataclass(slots=True)
+class host_queue_stats:
+    """Requests that waited for the host limits and how long.
+
+    wait_seconds adds up the waits of concurrent requests, so it is not a
+    wall-clock duration.
+    """
+
+    queued: int = 0
+    wait_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def add(self, queued_seconds: float):
+        self.queued += 1
+        self.wait_seconds += queued_seconds
+        self.max_seconds = max(self.max_seconds, queued_seconds)
+
+
+@dataclasses.dataclass
+class host_limiter:
+    """Limits of the outbound requests per host, shared by all probes of a process.
+
+    Hosts are identified by their hostinfo_hashed, the same host:port identity
+    used for certificate checks. A host has at most max_in_flight requests at
+    a time and starts at most rate requests per second, with bursts of up to
+    burst requests. 0 disables either limit. Time spent waiting for a host is
+    counted in totals and the open windows, and not in the measured response
+    times.
+    """
+
+    max_in_flight: int = 0
+    rate: float = 0.0
+    burst: int = 1
+    hosts: dict = dataclasses.field(default_factory=dict)
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+    acquired: int = 0
+    totals: host_queue_stats = dataclasses.field(default_factory=host_queue_stats)
+    windows: list = dataclasses.field(default_factory=list)
+
+    def is_enabled(self) -> bool:
+        return self.max_in_flight > 0 or self.rate > 0
+
+    def get_limit(self, host_key: str) -> host_limit:
+        limit = self.hosts.get(host_key)
+        if limit:
+            return limit
+        with self.lock:
+            return self.hosts.setdefault(
+                host_key,
+                host_limit(
+                    semaphore=threading.BoundedSemaphore(self.max_in_flight)
+                    if self.max_in_flight > 0
+                    else None,
+                    tokens=max(1, self.burst),
+                    updated=time.monotonic(),
+                ),
+            )
+
+    def reserve(self, limit: host_limit) -> float:
+        """Take a token from the bucket of a host, returns the seconds to wait for it."""
+        if self.rate <= 0:
+            return 0.0
+        with limit.lock:
+            now = time.monotonic()
+            limit.tokens = min(
+                max(1, self.burst), limit.tokens + (now - limit.updated) * self.rate
+            )
+            limit.updated = now
+            # tokens go negative for requests waiting on the bucket, later
+            # requests queue up behind them
+            limit.tokens -= 1
+            return -limit.tokens / self.rate if limit.tokens < 0 else 0.0
+
+    def count(self, queued_seconds: float):
+        with self.lock:
+            self.acquired += 1
+            if queued_seconds > 0.001:
+                for stats in [self.totals, *self.windows]:
+                    stats.add(queued_seconds)
+
+    def open_window(self) -> host_queue_stats:
+        """Stats of the waits from now on, until the window is closed."""
+        window = host_queue_stats()
+        with self.lock:
+            self.windows.append(window)
+        return window
+
+    def close_window(self, window: host_queue_stats):
+        with self.lock:
+            self.windows.remove(window)
+
+    @contextlib.contextmanager
+    def acquire(self, host_key: str):
+        """Wait until a request to the host is allowed, blocking the thread.
+
+        Yields the seconds waited.
+        """
+        if not host_key or not self.is_enabled():
+            yield 0.0
+            return
+        started = time.perf_counter()
+        limit = self.get_limit(host_key)
+        delay = self.reserve(limit)
+        if delay:
+            time.sleep(delay)
+        if limit.semaphore:
+            limit.semaphore.acquire()
+        try:
+            queued_seconds = time.perf_counter() - started
+            self.count(queued_seconds)
+            yield queued_seconds
+        finally:
+            if limit.semaphore:
+                limit.semaphore.release()
+
+    @contextlib.asynccontextmanager
+    async def acquire_async(self, host_key: str, poll_interval: float = 0.01):
+        """acquire for asyncio, waiting without blocking a thread."""
+        import asyncio
+
+        if not host_key or not self.is_enabled():
+            yield 0.0
+            return
+        started = time.perf_counter()
+        limit = self.get_limit(host_key)
+        delay = self.reserve(limit)
+        if delay:
+            await asyncio.sleep(delay)
+        if limit.semaphore:
+            # the slots are shared with threads, so they are polled
+            while not limit.semaphore.acquire(blocking=False):
+                await asyncio.sleep(poll_interval)
+        try:
+            queued_seconds = time.perf_counter() - started
+            self.count(queued_seconds)
+            yield queued_seconds
+        finally:
+            if limit.semaphore:
+                limit.semaphore.release()
+
+
+default_host_limiter = host_limiter()
+
+
+@dataclasses.dataclass
+class crl_index_entry:
+    url: str
+    next_update: float
+    revoked: dict = dataclasses.field(default_factory=dict)
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.next_update
+
+
+@dataclasses.dataclass
+class ocsp_status_entry:
+    url: str
+    next_update: float
+    status: str
+    revocation_date: str = None
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.next_update
+
+
+def is_signed_by(
+    public_key: Any, signature: bytes, data: bytes, hash_algorithm: "hashes.HashAlgorithm"
+) -> bool:
+    """Whether signature over data verifies with public_key."""
+    from cryptography.exceptions import InvalidSignature, UnsupportedAlgorithm
+    from cryptography.hazmat.primitives.asymmetric import dsa, ec, ed448, ed25519, padding, rsa
+
+    try:
+        if isinstance(public_key, rsa.RSAPublicKey):
+            public_key.verify(signature, data, padding.PKCS1v15(), hash_algorithm)
+        elif isinstance(public_key, ec.EllipticCurvePublicKey):
+            public_key.verify(signature, data, ec.ECDSA(hash_algorithm))
+        elif isinstance(public_key, dsa.DSAPublicKey):
+            public_key.verify(signature, data, hash_algorithm)
+        elif isinstance(public_key, (ed25519.Ed25519PublicKey, ed448.Ed448PublicKey)):
+            public_key.verify(signature, data)
+        else:
+            return False
+    except (InvalidSignature, UnsupportedAlgorithm, TypeError, ValueError):
+        return False
+    return True
+
+
+def is_ocsp_response_signed(ocsp_rsp: "ocsp.OCSPResponse", issuer: "x509.Certificate") -> bool:
+    """Whether an OCSP response is signed by the issuer or a responder it delegated to.
+
+    Delegated responder certificates have to be included in the response,
+    signed by the issuer, currently valid and carry the OCSPSigning usage.
+    """
+    from cryptography import x509
+    from cryptography.exceptions import UnsupportedAlgorithm
+    from cryptography.x509.oid import ExtendedKeyUsageOID
+
+    signers = [issuer]
+    now = datetime.utcnow()
+    try:
+        for responder in ocsp_rsp.certificates:
+            try:
+                usage = responder.extensions.get_extension_for_class(x509.ExtendedKeyUsage).value
+            except x509.ExtensionNotFound:
+                continue
+            if (
+                ExtendedKeyUsageOID.OCSP_SIGNING in usage
+                and responder.issuer == issuer.subject
+                and responder.not_valid_before <= now <= responder.not_valid_after
+                and is_signed_by(
+                    issuer.public_key(),
+                    responder.signature,
+                    responder.tbs_certificate_bytes,
+                    responder.signature_hash_algorithm,
+                )
+            ):
+                signers.append(responder)
+        return any(
+            is_signed_by(
+                signer.public_key(),
+                ocsp_rsp.signature,
+                ocsp_rsp.tbs_response_bytes,
+                ocsp_rsp.signature_hash_algorithm,
+            )
+            for signer in signers
+        )
+    except (UnsupportedAlgorithm, ValueError):
+        return False
+
+
+@dataclasses.dataclass
+class crl_revocation_index:
+    """Revoked serial numbers per CRL distribution point and OCSP status per certificate.
+
+    Every distribution point is downloaded once and kept until the nextUpdate
+    time of the CRL. Revoked serials are kept as hex strings in a dict for O(1)
+    lookups and are stored in cache_dir, if given, to survive restarts. OCSP
+    responses are kept the same way until their nextUpdate time.
+    """
+
+    cache_dir: Path = None
+    fetch_timeout: float = 10.0
+    default_max_age_seconds: float = 86400
+    ocsp_default_max_age_seconds: float = 3600
+    entries: dict = dataclasses.field(default_factory=dict)
+    locks: dict = dataclasses.field(default_factory=dict)
+    locks_guard: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+    fetches: int = 0
+    fetch_seconds: float = 0.0
+    limiter: host_limiter = None
+
+    def __post_init__(self):
+        if self.cache_dir:
+            self.cache_dir = Path(self.cache_dir)
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def get_cache_file(self, url: str) -> Path:
+        return self.cache_dir / "{0}.json".format(
+            hashlib.sha1(url.encode("utf-8")).hexdigest()
+        )
+
+    def load_entry(self, url: str, entry_type: type = crl_index_entry) -> Any:
+        if not self.cache_dir or not self.get_cache_file(url).is_file():
+            return None
+        try:
+            with self.get_cache_file(url).open(mode="r") as fp:
+                return entry_type(**json.load(fp))
+        except (OSError, ValueError, TypeError) as ex:
+            logging.warning(f"Ignoring unreadable CRL cache for [{url}]: {ex}")
+            return None
+
+    def store_entry(self, entry: Any):
+        if not self.cache_dir:
+            return
+        cache_file = self.get_cache_file(entry.url)
+        tmp_file = cache_file.with_suffix(".tmp")
+        with tmp_file.open(mode="w") as fp:
+            json.dump(dataclasses.asdict(entry), fp)
+        tmp_file.replace(cache_file)
+
+    def fetch_entry(self, url: str) -> crl_index_entry:
+        import requests
+        import crl_checker
+        from cryptography import x509
+
+        logging.debug(f"Downloading CRL [{url}]")
+        try:
+            with (self.limiter or default_host_limiter).acquire(get_host_key(url)):
+                rsp = requests.get(url, timeout=self.fetch_timeout)
+        except requests.RequestException as ex:
+            raise crl_checker.CrlFetchFailure(ex) from None
+        if rsp.status_code != 200:
+            raise crl_checker.CrlFetchFailure(f"HTTP {rsp.status_code} for [{url}]")
+        try:
+            crl = x509.load_der_x509_crl(rsp.content)
+        except ValueError:
+            try:
+                crl = x509.load_pem_x509_crl(rsp.content)
+            except ValueError as ex:
+                raise crl_checker.CrlLoadError(ex) from None
+        if crl.next_update:
+            next_update = crl.next_update.replace(tzinfo=timezone.utc).timestamp()
+        else:
+            next_update = time.time() + self.default_max_age_seconds
+        return crl_index_entry(
+            url=url,
+            next_update=next_update,
+            revoked={
+                hex(revoked.serial_number): revoked.revocation_date.isoformat()
+                for revoked in crl
+            },
+        )
+
+    def fetch_ocsp_entry(
+        self, key: str, ocsp_url: str, cert: "x509.Certificate", issuer: "x509.Certificate"
+    ) -> ocsp_status_entry:
+        import requests
+        import crl_checker
+        from cryptography.exceptions import UnsupportedAlgorithm
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.x509 import ocsp
+
+        logging.debug(f"Requesting OCSP status from [{ocsp_url}]")
+        try:
+            ocsp_request = (
+                ocsp.OCSPRequestBuilder().add_certificate(cert, issuer, hashes.SHA1()).build()
+            )
+        except ValueError as ex:
+            raise crl_checker.CrlLoadError(ex) from None
+        try:
+            with (self.limiter or default_host_limiter).acquire(get_host_key(ocsp_url)):
+                rsp = requests.post(
+                    ocsp_url,
+                    data=ocsp_request.public_bytes(serialization.Encoding.DER),
+                    headers={"Content-Type": "application/ocsp-request"},
+                    timeout=self.fetch_timeout,
+                )
+        except requests.RequestException as ex:
+            raise crl_checker.CrlFetchFailure(ex) from None
+        if rsp.status_code != 200:
+            raise crl_checker.CrlFetchFailure(f"HTTP {rsp.status_code} for [{ocsp_url}]")
+        try:
+            ocsp_rsp = ocsp.load_der_ocsp_response(rsp.content)
+        except ValueError as ex:
+            raise crl_checker.CrlLoadError(ex) from None
+        if ocsp_rsp.response_status != ocsp.OCSPResponseStatus.SUCCESSFUL:
+            raise crl_checker.CrlLoadError(
+                f"OCSP responder [{ocsp_url}] answered {ocsp_rsp.response_status.name}"
+            )
+        # the response has to be about the certificate asked for
+        try:
+            expected = (
+                ocsp.OCSPRequestBuilder()
+                .add_certificate(cert, issuer, ocsp_rsp.hash_algorithm)
+                .build()
+            )
+        except (ValueError, UnsupportedAlgorithm) as ex:
+            raise crl_checker.CrlLoadError(ex) from None
+        if (
+            ocsp_rsp.serial_number != cert.serial_number
+            or ocsp_rsp.issuer_key_hash != expected.issuer_key_hash
+            or ocsp_rsp.issuer_name_hash != expected.issuer_name_hash
+        ):
+            raise crl_checker.CrlLoadError(
+                f"OCSP responder [{ocsp_url}] answered for another certificate"
+            )
+        # plain HTTP answers are only trusted with a valid signature
+        if not is_ocsp_response_signed(ocsp_rsp, issuer):
+            raise crl_checker.CrlLoadError(
+                f"OCSP response of [{ocsp_url}] is not signed by the issuer or its responder"
+            )
+        if ocsp_rsp.next_update:
+            next_update = ocsp_rsp.next_update.replace(tzinfo=timezone.utc).timestamp()
+        else:
+            next_update = time.time() + self.ocsp_default_max_age_seconds
+        return ocsp_status_entry(
+            url=key,
+            next_update=next_update,
+            status=ocsp_rsp.certificate_status.name.lower(),
+            revocation_date=ocsp_rsp.revocation_time.isoformat()
+            if ocsp_rsp.revocation_time
+            else None,
+        )
+
+    def get_entry(
+        self, url: str, fetch: Callable[[], Any] = None, entry_type: type = crl_index_entry
+    ) -> Any:
+        entry = self.entries.get(url)
+        if entry and entry.is_fresh():
+            return entry
+        with self.locks_guard:
+            url_lock = self.locks.setdefault(url, threading.Lock())
+        # only one thread downloads a CRL, the others wait for its result
+        with url_lock:
+            entry = self.entries.get(url)
+            if entry and entry.is_fresh():
+                return entry
+            entry = self.load_entry(url, entry_type)
+            if not entry or not entry.is_fresh():
+                started = time.perf_counter()
+                try:
+                    entry = fetch() if fetch else self.fetch_entry(url)
+                finally:
+                    with self.locks_guard:
+                        self.fetches += 1
+                        self.fetch_seconds += time.perf_counter() - started
+                self.store_entry(entry)
+            self.entries[url] = entry
+            return entry
+
+    def check_ocsp(self, cert: "x509.Certificate", issuer: "x509.Certificate") -> bool:
+        """Raise crl_checker.Revoked if the OCSP responder of cert reports it revoked.
+
+        Returns False if cert names no OCSP responder or its status is unknown.
+        """
+        import crl_checker
+        from cryptography import x509
+        from cryptography.x509.oid import AuthorityInformationAccessOID, ExtensionOID
+
+        try:
+            aia_ext = cert.extensions.get_extension_for_oid(
+                ExtensionOID.AUTHORITY_INFORMATION_ACCESS
+            )
+        except x509.ExtensionNotFound:
+            return False
+        ocsp_urls = [
+            desc.access_location.value
+            for desc in aia_ext.value
+            if desc.access_method == AuthorityInformationAccessOID.OCSP
+            and isinstance(desc.access_location, x509.UniformResourceIdentifier)
+        ]
+        if not ocsp_urls:
+            return False
+        key = f"ocsp:{ocsp_urls[0]}:{hex(cert.serial_number)}"
+        entry = self.get_entry(
+            key,
+            fetch=lambda: self.fetch_ocsp_entry(key, ocsp_urls[0], cert, issuer),
+            entry_type=ocsp_status_entry,
+        )
+        if entry.status == "revoked":
+            raise crl_checker.Revoked(
+                f"Certificate with serial: {cert.serial_number} is revoked since: {entry.revocation_date}"
+            )
+        return entry.status == "good"
+
+    def check_revoked(self, cert: "x509.Certificate", issuer: "x509.Certificate" = None) -> str:
+        """Raise crl_checker.Revoked if cert is revoked and return the source of its status.
+
+        OCSP is preferred if the issuer is known, CRLs are downloaded only if
+        the OCSP status is unavailable.
+        """
+        import crl_checker
+        from cryptography import x509
+        from cryptography.x509.oid import ExtensionOID
+
+        if issuer is not None:
+            try:
+                if self.check_ocsp(cert, issuer):
+                    return "ocsp"
+            except crl_checker.Revoked as revoked:
+                revoked.source = "ocsp"
+                raise
+            except crl_checker.Error as ex:
+                logging.debug(f"OCSP status unavailable, falling back to CRL: {ex!r}")
+        try:
+            crl_ext = cert.extensions.get_extension_for_oid(
+                ExtensionOID.CRL_DISTRIBUTION_POINTS
+            )
+        except x509.ExtensionNotFound:
+            raise crl_checker.CrlExtensionMissing() from None
+        serial = hex(cert.serial_number)
+        for dist_point in crl_ext.value:
+            for full_name in dist_point.full_name or []:
+                if not isinstance(full_name, x509.UniformResourceIdentifier):
+                    continue
+                revocation_date = self.get_entry(full_name.value).revoked.get(serial)
+                if revocation_date:
+                    revoked = crl_checker.Revoked(
+                        f"Certificate with serial: {cert.serial_number} is revoked since: {revocation_date}"
+                    )
+                    revoked.source = "crl"
+                    raise revoked
+        return "crl"
+
+
+default_crl_index = crl_revocation_index()
+
+
 @dataclasses.dataclass
 class sslcert_result_document:
     url: pm_request_url = None
-    host_cert: x509.Certificate = None
+    host_cert: "x509.Certificate" = None
     is_self_signed: bool = False
     is_revoked: bool = False
     crl_verification_failures: list = dataclasses.field(default_factory=list)
@@ -238,6 +882,16 @@ class sslcert_result_document:
     error_type: str = None
     error_code: int = 0
     error_msg_raw: str = None
+    handshake_latency_ms: float = None
+    cached: bool = False
+    chain: list = dataclasses.field(default_factory=list, repr=False, compare=False)
+    chain_expiry: datetime = None
+    chain_expiry_subject: str = None
+    chain_until_expired_days: int = None
+    revocation_source: str = None
+    crl_index: crl_revocation_index = dataclasses.field(
+        default=None, repr=False, compare=False
+    )
 
     def __post_init__(self):
         if not self.error_type and self.error_code == 0:
@@ -248,20 +902,39 @@ class sslcert_result_document:
             self.valid_until_today_days = (
                 dt_today - self.host_cert.not_valid_before
             ).days
+            if self.chain:
+                # the chain is only valid as long as its first expiring certificate
+                first_expiring = min(self.chain, key=lambda cert: cert.not_valid_after)
+                self.chain_expiry = first_expiring.not_valid_after
+                self.chain_expiry_subject = first_expiring.subject.rfc4514_string()
+            if self.chain_expiry:
+                self.chain_until_expired_days = (self.chain_expiry - dt_today).days
+            if self.cached:
+                # check results were restored from cache, only the dates move on
+                return
             self.is_self_signed = is_self_signed_cert(self.host_cert)
             if not self.is_self_signed:
+                import crl_checker
+
+                issuer = next(
+                    (cert for cert in self.chain if cert.subject == self.host_cert.issuer),
+                    None,
+                )
                 try:
-                    crl_checker.check_revoked_crypto_cert(self.host_cert)
+                    self.revocation_source = (self.crl_index or default_crl_index).check_revoked(
+                        self.host_cert, issuer
+                    )
                 except crl_checker.Revoked as revoked:
                     self.is_revoked = True
                     self.revoked_msg = revoked
+                    self.revocation_source = getattr(revoked, "source", None)
                 except crl_checker.Error as other:
                     self.crl_verification_failures.append(other)
                 else:
                     self.is_revoked = False
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class check_result_document(pm_item):
     assertions: list = dataclasses.field(default_factory=list)
     failure: pm_failure_result = None
@@ -269,12 +942,19 @@ class check_result_document(pm_item):
     test_ssl_success: bool = False
     test_success: bool = False
     test_messages: list = dataclasses.field(default_factory=list)
+    attempts: int = 1
+    history: dict = None
+    test_latency_success: bool = True
+    appinsights_name: str = None
+    host_key: str = None
+    queue_time: int = None
 
     def get_result_properties(self) -> dict:
         output = dict(
             item_id=self.id,
             item_name=self.name,
-            monitor_type = monitor_type
+            monitor_type = monitor_type,
+            attempts=self.attempts,
         )
         if self.response:
             rsp_output = dict(
@@ -285,6 +965,8 @@ class check_result_document(pm_item):
                 rsp_size=self.response.responseSize,
             )
             output.update(rsp_output)
+        if self.queue_time is not None:
+            output["host_queue_ms"] = self.queue_time
         if self.ssl and self.ssl.host_cert:
             # extend output with ssl info
             ssl_output = dict(
@@ -292,8 +974,21 @@ class check_result_document(pm_item):
                 ssl_subject=str(self.ssl.host_cert.subject),
                 ssl_valid_date=self.ssl.host_cert.not_valid_before.isoformat(),
                 ssl_expired_date=self.ssl.host_cert.not_valid_after.isoformat(),
+                ssl_handshake_ms=self.ssl.handshake_latency_ms,
+                ssl_chain_expired_date=self.ssl.chain_expiry.isoformat()
+                if self.ssl.chain_expiry
+                else None,
+                ssl_revocation_source=self.ssl.revocation_source,
             )
             output.update(ssl_output)
+        if self.history:
+            output.update(
+                hist_samples=self.history.get("samples"),
+                hist_p50_ms=self.history.get("p50"),
+                hist_p95_ms=self.history.get("p95"),
+                hist_p99_ms=self.history.get("p99"),
+                hist_success_ratio=self.history.get("success_ratio"),
+            )
         # output mods for appinsights
         for k in output:
             if isinstance(output.get(k), dict) or isinstance(output.get(k), list):
@@ -344,11 +1039,48 @@ class check_result_document(pm_item):
                 f"Certificate expiry [{self.ssl.host_cert.not_valid_after.isoformat()}] within {expiration_gracetime_days} days"
             )
             ssl_test_failed |= True
+        elif (
+            check_expiration
+            and self.ssl.chain_until_expired_days is not None
+            and self.ssl.chain_until_expired_days < 0
+        ):
+            logging.debug("Check SSL chain certificate already expired.")
+            self.test_messages.append(
+                f"Chain certificate [{self.ssl.chain_expiry_subject}] expired [{self.ssl.chain_expiry.isoformat()}]"
+            )
+            ssl_test_failed |= True
+        elif (
+            check_expiration
+            and self.ssl.chain_until_expired_days is not None
+            and self.ssl.chain_until_expired_days < expiration_gracetime_days
+        ):
+            logging.debug(
+                f"Check SSL chain certificate expiry shorter than grace time [{expiration_gracetime_days}] days."
+            )
+            self.test_messages.append(
+                f"Chain certificate [{self.ssl.chain_expiry_subject}] expiry [{self.ssl.chain_expiry.isoformat()}] within {expiration_gracetime_days} days"
+            )
+            ssl_test_failed |= True
 
         logging.debug("All SSL cert related checks finished.")
         self.test_ssl_success = not ssl_test_failed
         return self.test_ssl_success
 
+    def validate_latency(self, factor: float, min_samples: int = history_min_samples) -> bool:
+        logging.debug("Validating response time against history.")
+        self.test_latency_success = True
+        if not self.response or not self.history or factor <= 0:
+            return self.test_latency_success
+        p95 = self.history.get("p95")
+        if p95 is None or self.history.get("latency_samples", 0) < min_samples:
+            return self.test_latency_success
+        if self.response.responseTime > factor * p95:
+            self.test_latency_success = False
+            self.test_messages.append(
+                f"Latency regression: response time {self.response.responseTime} ms exceeds {factor} times the p95 of {p95} ms over the last {self.history.get('samples')} results"
+            )
+        return self.test_latency_success
+
     def validate_test_report(self, acceptable_response_codes: list[int] = [200], include_ssl_test_results: bool = True) -> bool:
         logging.debug("Validating test report data.")
         if self.failure:
@@ -369,6 +1101,8 @@ class check_result_document(pm_item):
             logging.debug("Evaluating SSL/TLS test result")
             self.test_success &= self.test_ssl_success
 
+        self.test_success &= self.test_latency_success
+
         if self.test_success:
             logging.info("Test passed")
             self.test_messages.append("Passed")
@@ -377,13 +1111,22 @@ class check_result_document(pm_item):
         return self.test_success
 
 
-def load_pm_collection_url(url: str, timeout: Any = 5) -> dict:
-    data = {}
+def request_pm_collection_url(
+    url: str, timeout: Any = 5, headers: dict = None, echo_errors: bool = True
+) -> "requests.Response":
+    """GET a collection url, raise typer.Exit if it fails.
+
+    The error is printed, or only logged without echo_errors, e.g. if a copy
+    loaded before can be used instead.
+    """
+    import requests
+
     rc, msg = 0, None
     try:
-        rsp = requests.get(url, allow_redirects=True, verify=True, timeout=timeout)
+        rsp = requests.get(
+            url, allow_redirects=True, verify=True, timeout=timeout, headers=headers
+        )
         rsp.raise_for_status()
-        data = rsp.json()
     except requests.URLRequired as e:
         msg = e
         rc = RC.BASIC
@@ -400,11 +1143,23 @@ def load_pm_collection_url(url: str, timeout: Any = 5) -> dict:
         msg = ex
         rc = RC.OTHER
     else:
-        return data
-    typer.echo(msg)
+        return rsp
+    if echo_errors:
+        typer.echo(msg)
+    else:
+        logging.warning(f"Loading collection [{url}] failed: {msg}")
     raise typer.Exit(rc)
 
 
+def load_pm_collection_url(url: str, timeout: Any = 5) -> dict:
+    rsp = request_pm_collection_url(url, timeout=timeout)
+    try:
+        return rsp.json()
+    except ValueError as ex:
+        typer.echo(ex)
+        raise typer.Exit(RC.OTHER)
+
+
 def load_pm_collection(ref: str) -> dict:
     ref_data = {}
     path_ref = Path(ref)
@@ -416,18 +1171,236 @@ def load_pm_collection(ref: str) -> dict:
     return ref_data
 
 
-def run_pm_collection_test(
-    data: dict,
+@dataclasses.dataclass
+class pm_collection_loader:
+    """Collection loader keeping the last good copy between runs.
+
+    Remote collections are revalidated with If-None-Match/If-Modified-Since,
+    local files by their modification time. As long as the source is unchanged
+    the parsed collection and its item table are reused. If the source is
+    unreachable the last good copy is used, from cache_dir after a restart.
+    """
+
+    cache_dir: Path = None
+    timeout: Any = 5
+    ref: str = None
+    data: dict = None
+    etag: str = None
+    last_modified: str = None
+    item_table: "pm_item_table" = None
+
+    def __post_init__(self):
+        if self.cache_dir:
+            self.cache_dir = Path(self.cache_dir)
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def get_cache_file(self, ref: str) -> Path:
+        return self.cache_dir / "{0}.json".format(
+            hashlib.sha1(ref.encode("utf-8")).hexdigest()
+        )
+
+    def set_data(self, ref: str, data: dict, etag: str = None, last_modified: str = None):
+        self.ref = ref
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.item_table = None
+
+    def restore(self, ref: str) -> bool:
+        if self.ref == ref and self.data is not None:
+            return True
+        if not self.cache_dir or not self.get_cache_file(ref).is_file():
+            return False
+        try:
+            with self.get_cache_file(ref).open(mode="r") as fp:
+                stored = json.load(fp)
+        except (OSError, ValueError) as ex:
+            logging.warning(f"Ignoring unreadable collection cache for [{ref}]: {ex}")
+            return False
+        self.set_data(
+            ref,
+            stored.get("data"),
+            etag=stored.get("etag"),
+            last_modified=stored.get("last_modified"),
+        )
+        return True
+
+    def store(self):
+        if not self.cache_dir:
+            return
+        cache_file = self.get_cache_file(self.ref)
+        tmp_file = cache_file.with_suffix(".tmp")
+        with tmp_file.open(mode="w") as fp:
+            json.dump(
+                dict(data=self.data, etag=self.etag, last_modified=self.last_modified),
+                fp,
+            )
+        tmp_file.replace(cache_file)
+
+    def load_file(self, path_ref: Path) -> dict:
+        mtime = str(path_ref.stat().st_mtime_ns)
+        if self.ref == str(path_ref) and self.last_modified == mtime:
+            return self.data
+        with path_ref.open(mode="r") as fp:
+            self.set_data(str(path_ref), json.load(fp), last_modified=mtime)
+        return self.data
+
+    def load_url(self, url: str) -> dict:
+        has_copy = self.restore(url)
+        headers = {}
+        if has_copy and self.etag:
+            headers["If-None-Match"] = self.etag
+        if has_copy and self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        try:
+            rsp = request_pm_collection_url(
+                url, timeout=self.timeout, headers=headers, echo_errors=not has_copy
+            )
+            if rsp.status_code == 304 and has_copy:
+                logging.debug(f"Collection [{url}] not modified, reusing loaded copy")
+                return self.data
+            data = rsp.json()
+        except (typer.Exit, ValueError) as ex:
+            if not has_copy:
+                if isinstance(ex, ValueError):
+                    typer.echo(ex)
+                    raise typer.Exit(RC.OTHER)
+                raise
+            if isinstance(ex, ValueError):
+                logging.warning(f"Collection [{url}] is not valid json: {ex}")
+            logging.warning(f"Collection [{url}] unavailable, using last good copy")
+            return self.data
+        self.set_data(
+            url,
+            data,
+            etag=rsp.headers.get("ETag"),
+            last_modified=rsp.headers.get("Last-Modified"),
+        )
+        self.store()
+        return self.data
+
+    def load(self, ref: str) -> dict:
+        path_ref = Path(ref)
+        if path_ref.is_file():
+            return self.load_file(path_ref)
+        return self.load_url(ref)
+
+    def get_item_table(self) -> "pm_item_table":
+        """Item table of the loaded collection, compiled once per version."""
+        if self.item_table is None:
+            self.item_table = get_pm_item_table(self.data)
+        return self.item_table
+
+
+pm_report_stream_key = re.compile(r'"stream"\s*:\s*')
+pm_report_stream_token = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\]]|"')
+pm_report_stream_scalar = re.compile(r'[^,}\]\s]*')
+
+
+def strip_pm_report_streams(chunks, carry_size: int = 64):
+    """Yield the text of a newman JSON report with all "stream" values replaced by null.
+
+    Response bodies are exported by newman as byte arrays of JSON integers. They
+    are skipped while reading, so they never end up as Python objects.
+    """
+    buf = ""
+    tail = ""
+    skipping = False
+    depth = 0
+    chunks = iter(chunks)
+    final = False
+    while not final:
+        chunk = next(chunks, None)
+        final = chunk is None
+        buf = buf + (chunk or "")
+        pos = 0
+        while True:
+            if not skipping:
+                m = pm_report_stream_key.search(buf, pos)
+                if not m:
+                    keep = 0 if final else carry_size
+                    cut = max(pos, len(buf) - keep)
+                    if cut > pos:
+                        tail = buf[pos:cut]
+                        yield tail
+                    buf = buf[cut:]
+                    break
+                if m.end() == len(buf) and not final:
+                    # whitespace may continue in the next chunk
+                    if m.start() > pos:
+                        tail = buf[pos:m.start()]
+                        yield tail
+                    buf = buf[m.start():]
+                    break
+                preceding = buf[pos:m.start()] or tail
+                backslashes = len(preceding) - len(preceding.rstrip("\\"))
+                if backslashes % 2 == 1:
+                    # escaped quote, not a key
+                    tail = buf[pos:m.end()]
+                    yield tail
+                    pos = m.end()
+                    continue
+                tail = buf[pos:m.start()] + '"stream":null'
+                yield tail
+                pos = m.end()
+                skipping = True
+                depth = 0
+            if skipping:
+                if depth == 0:
+                    if pos >= len(buf):
+                        buf = ""
+                        break
+                    if buf[pos] not in "{[":
+                        # scalar value
+                        if buf[pos] == '"':
+                            m = pm_report_stream_token.match(buf, pos)
+                            if m.group(0) == '"' and not final:
+                                buf = buf[pos:]
+                                break
+                        else:
+                            m = pm_report_stream_scalar.match(buf, pos)
+                            if m.end() == len(buf) and not final:
+                                buf = buf[pos:]
+                                break
+                        pos = m.end()
+                        skipping = False
+                        continue
+                partial_at = None
+                for m in pm_report_stream_token.finditer(buf, pos):
+                    token = m.group(0)
+                    if token in "{[":
+                        depth += 1
+                    elif token in "}]":
+                        depth -= 1
+                    elif token == '"':
+                        partial_at = m.start()
+                        break
+                    if depth == 0:
+                        skipping = False
+                        pos = m.end()
+                        break
+                if skipping:
+                    buf = buf[partial_at:] if partial_at is not None and not final else ""
+                    break
+
+
+def load_pm_report(fp, chunk_size: int = 1 << 20) -> dict:
+    """Parse a newman JSON report from a text file object without response bodies.
+
+    The bodies are stripped while the file is read in chunks, the rest of the
+    report is joined into one string and parsed at once.
+    """
+    return json.loads(
+        "".join(strip_pm_report_streams(iter(lambda: fp.read(chunk_size), "")))
+    )
+
+
+def get_newman_timeout_options(
     nm_timeout_collection: int = None,
     nm_timeout_request: int = None,
     nm_timeout_script: int = None,
     py_subproc_timeout: int = None,
 ) -> Tuple:
-    if not shutil.which(testcmd):
-        raise Exception(f"Could not find executable ({testcmd}) in $PATH")
-    report_data = None
-    error_rc = 0
-    error_raw = None
     # customize sub-command options
     timeout_overrides = ""
     if nm_timeout_collection:
@@ -439,276 +1412,3282 @@ def run_pm_collection_test(
         )
     if nm_timeout_script:
         timeout_overrides = f"{timeout_overrides} --timeout-script {nm_timeout_script}"
-    timeout_overrides = timeout_overrides.strip()
+    return (timeout_overrides.strip(), py_subproc_timeout)
 
-    with tempfile.TemporaryDirectory() as tempdir:
-        data_input_file = Path(f"{tempdir}/input_collection.json")
-        data_output_file = Path(f"{tempdir}/output_report.json")
-        with data_input_file.open(mode="w") as collection_fp:
-            json.dump(data, collection_fp)
-        cmd_base = f"{testcmd} {testcmd_opts} --reporter-json-export {data_output_file.absolute()} {timeout_overrides} {data_input_file.absolute()}".split()
-        proc = subprocess.run(
-            cmd_base,
+
+@dataclasses.dataclass
+class newman_worker:
+    """Long-running node process running collections with newman as a library.
+
+    Saves starting node and loading newman for every run. Jobs are written to
+    the worker as json lines and the records it writes back carry the job id,
+    so shards can run as concurrent jobs of one worker. The worker is started
+    on first use and again after it died. It is replaced after max_runs jobs
+    to limit leaked memory, the replaced worker exits once its jobs are done.
+    """
+
+    script: Path = newman_worker_script
+    max_runs: int = 50
+    abort_timeout: float = 5
+    proc: subprocess.Popen = None
+    runs: int = 0
+    jobs: dict = dataclasses.field(default_factory=dict)
+    job_ids: Any = dataclasses.field(default_factory=itertools.count)
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+
+    def start(self) -> subprocess.Popen:
+        if not shutil.which("node"):
+            raise Exception("Could not find executable (node) in $PATH")
+        proc = subprocess.Popen(
+            ["node", str(self.script)],
             shell=False,
-            stderr=subprocess.PIPE,
+            stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
             encoding="utf-8",
-            check=False,
-            timeout=py_subproc_timeout,
         )
-        if proc.returncode > 0:
-            logging.debug("handle test command error codes")
-            error_rc = proc.returncode
-            error_raw = "{0}\n{1}".format(proc.stderr, proc.stdout)
-            if not data_output_file.is_file():
-                logging.critical(f"RC:{error_rc} | RAW:{error_raw}")
-                raise RuntimeError("Test command failed without output report!")
-        if data_output_file.is_file():
-            with data_output_file.open(mode="r") as report_fp:
-                report_data = json.load(report_fp)
-    return (report_data, error_rc, error_raw)
+        threading.Thread(target=self.read_records, args=(proc,), daemon=True).start()
+        threading.Thread(target=self.read_errors, args=(proc,), daemon=True).start()
+        logging.info(f"Started newman worker [{proc.pid}]")
+        return proc
 
+    def read_records(self, proc: subprocess.Popen):
+        for line in proc.stdout:
+            try:
+                # the worker leaves out the response bodies
+                record = json.loads(line)
+            except ValueError:
+                logging.debug(f"Ignoring newman worker output: {line.strip()}")
+                continue
+            with self.lock:
+                job = self.jobs.get(str(record.get("job")))
+            if job:
+                job[1].put(record)
+        proc.wait()
+        if proc.returncode:
+            logging.error(f"Newman worker [{proc.pid}] exited with [{proc.returncode}]")
+        # jobs still waiting for records of this worker end without them
+        with self.lock:
+            for job_proc, job_queue in self.jobs.values():
+                if job_proc is proc:
+                    job_queue.put(None)
 
-def patch_report_collection_item_data(
-    collection_data: dict, parent_level_name: str = None
-):
-    data_store = []
-    if "item" not in collection_data:
-        # we found a leave
-        current_leave_item_name = collection_data.get("name")
-        new_leave_item_name = f"{parent_level_name} / {current_leave_item_name}"
-        collection_data.update(dict(name=new_leave_item_name))
-        return collection_data
-
-    if collection_data.get("name"):
-        # we are in a subfolder structure of the collection data
-        current_level_name = "[{0}]".format(collection_data.get("name", "/"))
-    else:
-        # this is likely root level of the collection
-        current_level_name = ""
-    if parent_level_name:
-        current_level_name = f"{parent_level_name} / {current_level_name}"
-    for coll_item in collection_data.get("item"):
-        patched = patch_report_collection_item_data(
-            collection_data=coll_item, parent_level_name=current_level_name
-        )
-        if isinstance(patched, dict):
-            data_store.append(patched)
-        elif isinstance(patched, list):
-            data_store.extend(patched)
-    return data_store
+    def read_errors(self, proc: subprocess.Popen):
+        for line in proc.stderr:
+            logging.warning(f"Newman worker [{proc.pid}]: {line.rstrip()}")
 
+    def submit(self, job: dict) -> queue.Queue:
+        job_queue = queue.Queue()
+        with self.lock:
+            if self.proc and self.proc.poll() is None and self.runs >= self.max_runs:
+                logging.info(f"Replacing newman worker [{self.proc.pid}] after [{self.runs}] runs")
+                self.proc.stdin.close()
+                self.proc = None
+            if not self.proc or self.proc.poll() is not None:
+                self.proc = self.start()
+                self.runs = 0
+            self.runs += 1
+            job["job"] = str(next(self.job_ids))
+            self.jobs[job["job"]] = (self.proc, job_queue)
+            try:
+                self.proc.stdin.write(json.dumps(job) + "\n")
+                self.proc.stdin.flush()
+            except OSError as ex:
+                logging.error(f"Could not hand job to newman worker [{self.proc.pid}]: {ex}")
+                job_queue.put(None)
+        return job_queue
 
-def update_check_item_doc(
-    check_item_doc: check_result_document,
-    pm_exec_doc: pm_execution_result = None,
-    pm_fail_doc: pm_failure_result = None,
-    sslcert_doc: sslcert_result_document = None,
+    def abort(self, job_id: str, job_queue: queue.Queue, timeout: float = None) -> bool:
+        """Stop a running job, other jobs of the worker keep running.
+
+        Returns False if the worker did not confirm the abort within timeout,
+        the worker is killed then as it no longer handles jobs. A worker that
+        could not stop the run gets no new jobs and exits once its other jobs
+        are done.
+        """
+        timeout = self.abort_timeout if timeout is None else timeout
+        with self.lock:
+            proc = self.jobs[job_id][0]
+        try:
+            proc.stdin.write(json.dumps(dict(type="abort", job=job_id)) + "\n")
+            proc.stdin.flush()
+            deadline = time.monotonic() + timeout
+            while True:
+                record = job_queue.get(timeout=max(0, deadline - time.monotonic()))
+                if record and record.get("recycle"):
+                    self.recycle(proc, f"could not abort job [{job_id}]")
+                if record is None or record.get("type") in ("done", "report"):
+                    return record is not None
+        except (OSError, ValueError, queue.Empty):
+            pass
+        logging.error(f"Newman worker [{proc.pid}] did not abort job [{job_id}], killing it")
+        with self.lock:
+            # the next job starts a new worker
+            if self.proc is proc:
+                self.proc = None
+        proc.kill()
+        return False
+
+    def recycle(self, proc: subprocess.Popen, reason: str):
+        """Hand no more jobs to proc, it exits once its running jobs are done."""
+        with self.lock:
+            if self.proc is not proc:
+                return
+            logging.info(f"Replacing newman worker [{proc.pid}], {reason}")
+            self.proc = None
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+    def run(self, data: dict, report: str, options: dict, timeout: float = None):
+        """Yield the records of a job until its last one.
+
+        Yields None if the worker died before, the job is aborted and
+        subprocess.TimeoutExpired raised if it runs longer than timeout.
+        """
+        job = dict(report=report, collection=data, options=options)
+        job_queue = self.submit(job)
+        deadline = time.monotonic() + timeout if timeout else None
+        try:
+            while True:
+                try:
+                    record = job_queue.get(
+                        timeout=max(0, deadline - time.monotonic()) if deadline else None
+                    )
+                except queue.Empty:
+                    self.abort(job["job"], job_queue)
+                    raise subprocess.TimeoutExpired(str(self.script), timeout) from None
+                yield record
+                if record is None or record.get("type") in ("done", "report"):
+                    return
+        finally:
+            with self.lock:
+                self.jobs.pop(job["job"], None)
+
+    def close(self, timeout: float = 10):
+        with self.lock:
+            proc, self.proc = self.proc, None
+        if not proc or proc.poll() is not None:
+            return
+        proc.stdin.close()
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def get_newman_worker_options(
+    nm_timeout_collection: int = None,
+    nm_timeout_request: int = None,
+    nm_timeout_script: int = None,
+    nm_verbose: bool = False,
+) -> dict:
+    """newman.run options of the command line options built by get_newman_timeout_options."""
+    options = dict(verbose=nm_verbose)
+    if nm_timeout_collection:
+        options["timeout"] = nm_timeout_collection
+    if nm_timeout_request:
+        options["timeoutRequest"] = nm_timeout_request
+    if nm_timeout_script:
+        options["timeoutScript"] = nm_timeout_script
+    return options
+
+
+@dataclasses.dataclass
+class child_process_usage:
+    """CPU time and peak RSS of the newman subprocesses of a check cycle.
+
+    Processes are reaped with os.wait4, so only their own usage is counted and
+    not that of other children running at the same time, e.g. for another
+    collection. Runs of the native engine and the worker are not counted.
+    """
+
+    processes: int = 0
+    cpu_seconds: float = 0.0
+    peak_rss_kib: int = 0
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+
+    def wait(self, proc: subprocess.Popen) -> int:
+        try:
+            _, status, usage = os.wait4(proc.pid, 0)
+        except ChildProcessError:
+            # already reaped elsewhere, its usage is unknown
+            return proc.wait()
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        with self.lock:
+            self.processes += 1
+            self.cpu_seconds += usage.ru_utime + usage.ru_stime
+            # ru_maxrss is in KiB on Linux
+            self.peak_rss_kib = max(self.peak_rss_kib, usage.ru_maxrss)
+        return proc.returncode
+
+
+def wait_child_process(
+    proc: subprocess.Popen, timeout: float = None, usage: child_process_usage = None
+) -> int:
+    """Wait for proc and count its usage, raise subprocess.TimeoutExpired if it was killed after timeout."""
+    timed_out = threading.Event()
+
+    def kill_on_timeout():
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(timeout, kill_on_timeout) if timeout else None
+    if timer:
+        timer.start()
+    try:
+        returncode = usage.wait(proc) if usage else proc.wait()
+    finally:
+        if timer:
+            timer.cancel()
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(proc.args, timeout)
+    return returncode
+
+
+def run_pm_collection_test(
+    data: dict,
+    nm_timeout_collection: int = None,
+    nm_timeout_request: int = None,
+    nm_timeout_script: int = None,
+    py_subproc_timeout: int = None,
+    nm_verbose: bool = False,
+    nm_worker: newman_worker = None,
+    usage: child_process_usage = None,
+) -> Tuple:
+    if nm_worker:
+        return run_pm_collection_test_worker(
+            data,
+            nm_worker,
+            nm_timeout_collection=nm_timeout_collection,
+            nm_timeout_request=nm_timeout_request,
+            nm_timeout_script=nm_timeout_script,
+            py_subproc_timeout=py_subproc_timeout,
+            nm_verbose=nm_verbose,
+        )
+    if not shutil.which(testcmd):
+        raise Exception(f"Could not find executable ({testcmd}) in $PATH")
+    report_data = None
+    error_rc = 0
+    error_raw = None
+    timeout_overrides, py_subproc_timeout = get_newman_timeout_options(
+        nm_timeout_collection=nm_timeout_collection,
+        nm_timeout_request=nm_timeout_request,
+        nm_timeout_script=nm_timeout_script,
+        py_subproc_timeout=py_subproc_timeout,
+    )
+    if nm_verbose:
+        # verbose runs record the request timings
+        timeout_overrides = f"--verbose {timeout_overrides}"
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        data_input_file = Path(f"{tempdir}/input_collection.json")
+        data_output_file = Path(f"{tempdir}/output_report.json")
+        with data_input_file.open(mode="w") as collection_fp:
+            json.dump(data, collection_fp)
+        cmd_base = f"{testcmd} {testcmd_opts} --reporter-json-export {data_output_file.absolute()} {timeout_overrides} {data_input_file.absolute()}".split()
+        with tempfile.TemporaryFile(
+            mode="w+", encoding="utf-8"
+        ) as stdout_fp, tempfile.TemporaryFile(mode="w+", encoding="utf-8") as stderr_fp:
+            proc = subprocess.Popen(
+                cmd_base,
+                shell=False,
+                stderr=stderr_fp,
+                stdout=stdout_fp,
+                encoding="utf-8",
+            )
+            wait_child_process(proc, timeout=py_subproc_timeout, usage=usage)
+            stdout_fp.seek(0)
+            stderr_fp.seek(0)
+            stdout_raw, stderr_raw = stdout_fp.read(), stderr_fp.read()
+        if proc.returncode > 0:
+            logging.debug("handle test command error codes")
+            error_rc = proc.returncode
+            error_raw = "{0}\n{1}".format(stderr_raw, stdout_raw)
+            if not data_output_file.is_file():
+                logging.critical(f"RC:{error_rc} | RAW:{error_raw}")
+                raise RuntimeError("Test command failed without output report!")
+        if data_output_file.is_file():
+            with data_output_file.open(mode="r") as report_fp:
+                report_data = load_pm_report(report_fp)
+    return (report_data, error_rc, error_raw)
+
+
+def run_pm_collection_test_worker(
+    data: dict,
+    nm_worker: newman_worker,
+    nm_timeout_collection: int = None,
+    nm_timeout_request: int = None,
+    nm_timeout_script: int = None,
+    py_subproc_timeout: int = None,
+    nm_verbose: bool = False,
+) -> Tuple:
+    """run_pm_collection_test on a newman worker instead of a newman process."""
+    _, py_subproc_timeout = get_newman_timeout_options(
+        nm_timeout_collection=nm_timeout_collection,
+        py_subproc_timeout=py_subproc_timeout,
+    )
+    options = get_newman_worker_options(
+        nm_timeout_collection=nm_timeout_collection,
+        nm_timeout_request=nm_timeout_request,
+        nm_timeout_script=nm_timeout_script,
+        nm_verbose=nm_verbose,
+    )
+    report_data = None
+    error_raw = None
+    for record in nm_worker.run(data, "json", options, timeout=py_subproc_timeout):
+        if record:
+            report_data = record.get("report")
+            error_raw = (record.get("error") or {}).get("stack")
+    if not report_data:
+        logging.critical(f"Newman worker failed without output report: {error_raw}")
+        raise RuntimeError("Test command failed without output report!")
+    # same exit code as the newman command line
+    error_rc = 1 if error_raw or report_data.get("run", {}).get("failures") else 0
+    return (report_data, error_rc, error_raw)
+
+
+def pm_item_display_name(folder_names: list, name: str) -> str:
+    """Item name prefixed with the names of its folders, e.g. "[folder] / [sub] / item"."""
+    level_name = ""
+    for folder_name in folder_names:
+        level_name = f"{level_name} / [{folder_name}]" if level_name else f"[{folder_name}]"
+    return f"{level_name} / {name}"
+
+
+def process_pm_execution_record(record: dict) -> check_result_document:
+    """Build a check result document from a record of the ndjson newman reporter."""
+    execution = dict(record.get("execution", {}))
+    coll_item = dict(execution.get("item", {}))
+    coll_item.setdefault("event", [])
+    coll_item.setdefault("response", [])
+    execution.update(item=coll_item)
+    check_item_doc = check_result_document(
+        **dict(
+            coll_item,
+            name=pm_item_display_name(record.get("path", []), coll_item.get("name")),
+        )
+    )
+    update_check_item_doc(
+        check_item_doc=check_item_doc,
+        pm_exec_doc=pm_execution_result(**execution),
+    )
+    for fail in record.get("failures", []):
+        fail_doc = pm_failure_result(**fail)
+        logging.warning(fail_doc)
+        update_check_item_doc(check_item_doc=check_item_doc, pm_fail_doc=fail_doc)
+    return check_item_doc
+
+
+def process_pm_timed_out_items(
+    data: dict, datastore: dict, on_result: Callable[[check_result_document], Any], timeout: float
+):
+    """Hand over a failed result for every item of data without a result after a timeout."""
+    for item_id, entry in get_pm_item_table(data).items.items():
+        if item_id in datastore:
+            continue
+        check_item_doc = entry.new_result_document()
+        fail_doc = pm_failure_result(
+            source=dict(entry.item, name=entry.display_name, event=[], response=[]),
+            error=dict(
+                name="TimeoutError",
+                message=f"Run timed out after [{timeout}]s before the item finished",
+                timestamp=round(time.time() * 1000),
+            ),
+            at="run",
+            parent={},
+            cursor={},
+        )
+        logging.warning(fail_doc)
+        update_check_item_doc(check_item_doc=check_item_doc, pm_fail_doc=fail_doc)
+        datastore[item_id] = check_item_doc
+        on_result(check_item_doc)
+
+
+def run_pm_collection_test_incremental(
+    data: dict,
+    on_result: Callable[[check_result_document], Any],
+    nm_timeout_collection: int = None,
+    nm_timeout_request: int = None,
+    nm_timeout_script: int = None,
+    py_subproc_timeout: int = None,
+    nm_verbose: bool = False,
+    nm_worker: newman_worker = None,
+    usage: child_process_usage = None,
+) -> Tuple:
+    """Run newman with the ndjson reporter and hand over every result as soon as it arrives.
+
+    Results finished before the subprocess timeout are kept and items left
+    get a failed result, the timeout is returned as RC.TIMER instead of raising.
+    """
+    if nm_worker:
+        return run_pm_collection_test_incremental_worker(
+            data,
+            on_result,
+            nm_worker,
+            nm_timeout_collection=nm_timeout_collection,
+            nm_timeout_request=nm_timeout_request,
+            nm_timeout_script=nm_timeout_script,
+            py_subproc_timeout=py_subproc_timeout,
+            nm_verbose=nm_verbose,
+        )
+    if not shutil.which(testcmd):
+        raise Exception(f"Could not find executable ({testcmd}) in $PATH")
+    datastore = {}
+    error_rc = 0
+    error_raw = None
+    timeout_overrides, py_subproc_timeout = get_newman_timeout_options(
+        nm_timeout_collection=nm_timeout_collection,
+        nm_timeout_request=nm_timeout_request,
+        nm_timeout_script=nm_timeout_script,
+        py_subproc_timeout=py_subproc_timeout,
+    )
+    if nm_verbose:
+        # verbose runs record the request timings
+        timeout_overrides = f"--verbose {timeout_overrides}"
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        data_input_file = Path(f"{tempdir}/input_collection.json")
+        with data_input_file.open(mode="w") as collection_fp:
+            json.dump(data, collection_fp)
+        cmd_base = f"{testcmd} {testcmd_opts_incremental} {timeout_overrides} {data_input_file.absolute()}".split()
+        with tempfile.TemporaryFile(mode="w+", encoding="utf-8") as stderr_fp:
+            proc = subprocess.Popen(
+                cmd_base,
+                shell=False,
+                stderr=stderr_fp,
+                stdout=subprocess.PIPE,
+                encoding="utf-8",
+            )
+            timed_out = threading.Event()
+
+            def kill_on_timeout():
+                timed_out.set()
+                proc.kill()
+
+            timer = None
+            if py_subproc_timeout:
+                timer = threading.Timer(py_subproc_timeout, kill_on_timeout)
+                timer.start()
+            try:
+                for line in proc.stdout:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        logging.debug(f"Ignoring test command output: {line.strip()}")
+                        continue
+                    if not isinstance(record, dict) or record.get("type") != "execution":
+                        continue
+                    check_item_doc = process_pm_execution_record(record)
+                    datastore[check_item_doc.id] = check_item_doc
+                    on_result(check_item_doc)
+            finally:
+                wait_child_process(proc, usage=usage)
+                if timer:
+                    timer.cancel()
+            stderr_fp.seek(0)
+            stderr_raw = stderr_fp.read()
+
+    if timed_out.is_set():
+        logging.error(
+            f"Test command timed out after [{py_subproc_timeout}]s, kept [{len(datastore)}] finished results"
+        )
+        process_pm_timed_out_items(data, datastore, on_result, py_subproc_timeout)
+        error_rc = RC.TIMER
+        error_raw = stderr_raw
+    elif proc.returncode > 0:
+        logging.debug("handle test command error codes")
+        error_rc = proc.returncode
+        error_raw = stderr_raw
+        if not datastore:
+            logging.critical(f"RC:{error_rc} | RAW:{error_raw}")
+            raise RuntimeError("Test command failed without output report!")
+    return (datastore, error_rc, error_raw)
+
+
+def run_pm_collection_test_incremental_worker(
+    data: dict,
+    on_result: Callable[[check_result_document], Any],
+    nm_worker: newman_worker,
+    nm_timeout_collection: int = None,
+    nm_timeout_request: int = None,
+    nm_timeout_script: int = None,
+    py_subproc_timeout: int = None,
+    nm_verbose: bool = False,
+) -> Tuple:
+    """run_pm_collection_test_incremental on a newman worker instead of a newman process."""
+    _, py_subproc_timeout = get_newman_timeout_options(
+        nm_timeout_collection=nm_timeout_collection,
+        py_subproc_timeout=py_subproc_timeout,
+    )
+    options = get_newman_worker_options(
+        nm_timeout_collection=nm_timeout_collection,
+        nm_timeout_request=nm_timeout_request,
+        nm_timeout_script=nm_timeout_script,
+        nm_verbose=nm_verbose,
+    )
+    datastore = {}
+    error_rc = 0
+    error_raw = None
+    done = None
+    try:
+        for record in nm_worker.run(data, "ndjson", options, timeout=py_subproc_timeout):
+            if record and record.get("type") == "execution":
+                check_item_doc = process_pm_execution_record(record)
+                datastore[check_item_doc.id] = check_item_doc
+                on_result(check_item_doc)
+            elif record:
+                done = record
+    except subprocess.TimeoutExpired:
+        logging.error(
+            f"Newman worker timed out after [{py_subproc_timeout}]s, kept [{len(datastore)}] finished results"
+        )
+        process_pm_timed_out_items(data, datastore, on_result, py_subproc_timeout)
+        return (datastore, RC.TIMER, None)
+    if not done:
+        error_rc, error_raw = 1, "Newman worker exited before the run was done"
+    elif done.get("error"):
+        error_rc, error_raw = 1, done.get("error").get("stack")
+    elif any(record.failure for record in datastore.values()):
+        error_rc = 1
+    if error_rc and not datastore:
+        logging.critical(f"RC:{error_rc} | RAW:{error_raw}")
+        raise RuntimeError("Test command failed without output report!")
+    return (datastore, error_rc, error_raw)
+
+
+def run_pm_collection_incremental(
+    data: dict,
+    on_result: Callable[[check_result_document], Any],
+    engine: Engine = Engine.newman,
+    native_concurrency: int = 20,
+    shards: int = 1,
+    shard_mode: ShardMode = ShardMode.folder,
+    limiter: host_limiter = None,
+    **test_kwargs,
+) -> Tuple:
+    """Incremental counterpart of run_pm_collection_engines.
+
+    on_result may be called from several threads at once.
+    """
+    native_items, newman_collection = split_pm_collection_engines(data, engine)
+    tasks = []
+    if native_items:
+        def run_native():
+            report_data, error_rc, error_raw = run_pm_collection_native(
+                data,
+                native_items,
+                nm_timeout_request=test_kwargs.get("nm_timeout_request"),
+                concurrency=native_concurrency,
+                limiter=limiter,
+            )
+            datastore = process_pm_collection_report(report_data, error_rc)
+            for check_item_doc in datastore.values():
+                on_result(check_item_doc)
+            return (datastore, error_rc, error_raw)
+
+        tasks.append(run_native)
+    if newman_collection:
+        sub_collections = [newman_collection]
+        if shards > 1:
+            sub_collections = split_pm_collection(newman_collection, shards, shard_mode)
+        for sub_collection in sub_collections:
+            tasks.append(
+                lambda sub_collection=sub_collection: run_pm_collection_test_incremental(
+                    sub_collection, on_result, **test_kwargs
+                )
+            )
+    datastore = {}
+    error_rc = 0
+    error_raws = []
+    with ThreadPoolExecutor(max_workers=max(1, len(tasks))) as pool:
+        for task_datastore, task_rc, task_raw in pool.map(lambda task: task(), tasks):
+            datastore.update(task_datastore)
+            error_rc = max(error_rc, task_rc)
+            if task_raw:
+                error_raws.append(task_raw)
+    return (datastore, error_rc, "\n".join(error_raws) or None)
+
+
+def pm_collection_iter_leaves(data: dict):
+    """Yield all request items of a collection tree, depth first."""
+    if "item" not in data:
+        yield data
+        return
+    for coll_item in data.get("item", []):
+        yield from pm_collection_iter_leaves(coll_item)
+
+
+def filter_pm_collection(data: dict, keep: Callable[[dict], bool]) -> dict:
+    """Return a copy of the collection tree holding only the leaves accepted by keep.
+
+    Folder level fields like auth, event and variable are kept on every folder
+    that still contains items, folders without remaining items are dropped.
+    """
+    if "item" not in data:
+        return data if keep(data) else None
+    filtered = {k: v for k, v in data.items() if k != "item"}
+    filtered["item"] = []
+    for coll_item in data.get("item", []):
+        filtered_item = filter_pm_collection(coll_item, keep)
+        if filtered_item is not None:
+            filtered["item"].append(filtered_item)
+    if not filtered["item"]:
+        return None
+    return filtered
+
+
+def map_pm_collection_leaves(data: dict, fn: Callable[[dict], dict]) -> dict:
+    """Return a copy of the collection tree with every leaf replaced by fn(leaf)."""
+    if "item" not in data:
+        return fn(data)
+    mapped = {k: v for k, v in data.items() if k != "item"}
+    mapped["item"] = [map_pm_collection_leaves(coll_item, fn) for coll_item in data.get("item", [])]
+    return mapped
+
+
+def get_pm_item_url(coll_item: dict) -> pm_request_url:
+    request_url = (coll_item.get("request") or {}).get("url")
+    if isinstance(request_url, dict):
+        return pm_request_url(**request_url)
+    if isinstance(request_url, str) and request_url:
+        return pm_request_url(raw=request_url)
+    return None
+
+
+def normalize_pm_request(request: Any) -> dict:
+    """Request of an item in the form newman reports it, a dict with a method."""
+    if isinstance(request, str):
+        return dict(method="GET", url=request)
+    if isinstance(request, dict) and not request.get("method"):
+        return dict(request, method="GET")
+    return request
+
+
+@dataclasses.dataclass(slots=True)
+class pm_item_entry:
+    id: str
+    folder_path: tuple
+    display_name: str
+    appinsights_name: str
+    url: pm_request_url
+    host_key: str
+    item: dict
+
+    def new_result_document(self) -> "check_result_document":
+        coll_item = dict(self.item, name=self.display_name)
+        coll_item.setdefault("event", [])
+        coll_item.setdefault("response", [])
+        check_item_doc = check_result_document(**coll_item)
+        check_item_doc.appinsights_name = self.appinsights_name
+        check_item_doc.host_key = self.host_key
+        return check_item_doc
+
+
+@dataclasses.dataclass
+class pm_item_table:
+    """Items of a collection compiled once and indexed by item id.
+
+    data is the collection with an id for every item, hosts holds one URL
+    document for every distinct host key (the hostinfo_hashed of the URL).
+    """
+
+    data: dict
+    content_hash: str = None
+    items: dict = dataclasses.field(default_factory=dict)
+    hosts: dict = dataclasses.field(default_factory=dict)
+
+    def get(self, item_id: str) -> pm_item_entry:
+        return self.items.get(item_id)
+
+    def get_urls(self) -> list:
+        return list(self.hosts.values())
+
+    def annotate(self, check_item_doc: "check_result_document"):
+        """Set the precomputed fields of a result document built elsewhere."""
+        entry = self.items.get(check_item_doc.id)
+        if entry:
+            check_item_doc.appinsights_name = entry.appinsights_name
+            check_item_doc.host_key = entry.host_key
+
+    def subset(self, data: dict, item_ids: set) -> "pm_item_table":
+        """Table of data, a sub-collection of this table like the ones of filter_pm_collection."""
+        table = pm_item_table(data=data)
+        for item_id, entry in self.items.items():
+            if item_id not in item_ids:
+                continue
+            table.items[item_id] = entry
+            if entry.host_key and entry.host_key not in table.hosts:
+                table.hosts[entry.host_key] = entry.url
+        return table
+
+
+def compile_pm_item_table(data: dict, content_hash: str = None) -> pm_item_table:
+    """Build the item table of a collection in a single pass over its tree.
+
+    Missing ids are derived from the position of the item in the collection,
+    so they stay the same between runs as long as the collection layout is
+    unchanged. Requests are normalized like newman does, plain url strings
+    and requests without a method become GET requests.
+    """
+    table = pm_item_table(data=None, content_hash=content_hash)
+
+    def visit(node: dict, path: str, folder_path: tuple) -> dict:
+        if "item" in node:
+            compiled = {k: v for k, v in node.items() if k != "item"}
+            if path and node.get("name"):
+                folder_path = folder_path + (node.get("name"),)
+            compiled["item"] = [
+                visit(coll_item, f"{path}/{index}:{coll_item.get('name', '')}", folder_path)
+                for index, coll_item in enumerate(node.get("item", []))
+            ]
+            return compiled
+        if not node.get("id"):
+            node = dict(node, id=str(uuid.uuid5(uuid.NAMESPACE_URL, path)))
+        request = normalize_pm_request(node.get("request"))
+        if request is not node.get("request"):
+            node = dict(node, request=request)
+        url = get_pm_item_url(node)
+        host_key = url.hostinfo_hashed if url else None
+        display_name = pm_item_display_name(folder_path, node.get("name"))
+        table.items[node["id"]] = pm_item_entry(
+            id=node["id"],
+            folder_path=folder_path,
+            display_name=display_name,
+            appinsights_name=get_appinsights_name(display_name),
+            url=url,
+            host_key=host_key,
+            item=node,
+        )
+        if host_key and host_key not in table.hosts:
+            table.hosts[host_key] = url
+        return node
+
+    table.data = visit(data, "", ())
+    return table
+
+
+# tables are kept as long as they are in use, e.g. by a collection_loader
+pm_item_table_cache = weakref.WeakValueDictionary()
+pm_item_table_cache_lock = threading.Lock()
+
+
+def get_pm_item_table(data: dict) -> pm_item_table:
+    """Item table of a collection, cached by the hash of the collection content."""
+    content_hash = hashlib.sha1(
+        json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+    with pm_item_table_cache_lock:
+        table = pm_item_table_cache.get(content_hash)
+        if table:
+            return table
+    table = compile_pm_item_table(data, content_hash=content_hash)
+    with pm_item_table_cache_lock:
+        return pm_item_table_cache.setdefault(content_hash, table)
+
+
+def assign_pm_item_ids(data: dict) -> dict:
+    """Return a copy of the collection tree where every leaf has an id."""
+    return get_pm_item_table(data).data
+
+
+@dataclasses.dataclass
+class pm_item_schedule:
+    """Due times of collection items with individual check intervals.
+
+    Items, folders and the collection take their interval from overrides by
+    id or name, else from their monitor_interval_seconds variable, else from
+    their parent. The collection defaults to default_interval_seconds.
+    Items without an id get one from assign_pm_item_ids, so they keep their
+    schedule as long as the collection layout is unchanged.
+    """
+
+    default_interval_seconds: float
+    jitter: float = 0.1
+    overrides: dict = dataclasses.field(default_factory=dict)
+    source: dict = None
+    table: pm_item_table = None
+    data: dict = None
+    intervals: dict = dataclasses.field(default_factory=dict)
+    next_due: dict = dataclasses.field(default_factory=dict)
+    # the last sub-collection returned by take_due and the ids of its items
+    taken: dict = None
+    due: set = dataclasses.field(default_factory=set)
+
+    def get_interval(self, node: dict, inherited: float) -> float:
+        for key in (node.get("id"), node.get("name")):
+            if key and key in self.overrides:
+                return float(self.overrides[key])
+        for var in node.get("variable", []) or []:
+            if (
+                isinstance(var, dict)
+                and var.get("key") == pm_interval_variable
+                and not var.get("disabled")
+                and var.get("value") not in (None, "")
+            ):
+                return float(var.get("value"))
+        return inherited
+
+    def assign(self, node: dict, inherited: float):
+        if "item" in node:
+            interval = self.get_interval(node, inherited)
+            for coll_item in node.get("item", []):
+                self.assign(coll_item, interval)
+            return
+        self.intervals[node["id"]] = self.get_interval(node, inherited)
+
+    def prepare(self, data: dict):
+        if data is self.source:
+            return
+        self.source = data
+        self.intervals = {}
+        # kept, so a collection_loader of the same version finds it in the cache
+        self.table = get_pm_item_table(data)
+        self.data = self.table.data
+        self.assign(self.data, self.default_interval_seconds)
+        # forget items removed from the collection
+        self.next_due = {k: v for k, v in self.next_due.items() if k in self.intervals}
+
+    def take_due(self, data: dict, now: float = None) -> dict:
+        """Sub-collection of the items due at now, None if no item is due.
+
+        Due items are rescheduled one interval, varied by jitter, after their
+        previous due time, or after now if they are overdue by a whole interval.
+        """
+        self.prepare(data)
+        if now is None:
+            now = time.monotonic()
+        due = set()
+        for item_id, interval in self.intervals.items():
+            next_due = self.next_due.get(item_id)
+            if next_due is not None and next_due > now:
+                continue
+            due.add(item_id)
+            if next_due is None or next_due + interval <= now:
+                next_due = now
+            self.next_due[item_id] = next_due + interval * (
+                1 + random.uniform(-self.jitter, self.jitter)
+            )
+        logging.debug(f"[{len(due)}] of [{len(self.intervals)}] items due")
+        self.due = due
+        self.taken = (
+            filter_pm_collection(self.data, lambda leaf: leaf.get("id") in due) if due else None
+        )
+        return self.taken
+
+
+def split_pm_collection(
+    data: dict, shards: int, shard_mode: ShardMode = ShardMode.folder
+) -> list:
+    """Split a collection into at most N sub-collections of similar size.
+
+    In folder mode top level folders are never split, so requests depending on
+    each other through folder scripts keep running in order within one shard.
+    """
+    assignment = {}
+    if shard_mode == ShardMode.item:
+        for counter, leaf in enumerate(pm_collection_iter_leaves(data)):
+            assignment[id(leaf)] = counter % shards
+    else:
+        # greedy assignment of the biggest folders to the least loaded shard
+        groups = [list(pm_collection_iter_leaves(top)) for top in data.get("item", [])]
+        shard_sizes = [0] * shards
+        for group in sorted(groups, key=len, reverse=True):
+            target = shard_sizes.index(min(shard_sizes))
+            shard_sizes[target] += len(group)
+            for leaf in group:
+                assignment[id(leaf)] = target
+    sub_collections = []
+    for shard in range(shards):
+        sub_collection = filter_pm_collection(
+            data, lambda leaf: assignment.get(id(leaf)) == shard
+        )
+        if sub_collection is not None:
+            sub_collections.append(sub_collection)
+    return sub_collections
+
+
+def merge_pm_collection_reports(reports: list) -> dict:
+    """Merge newman JSON reports of sub-collections into one report."""
+    merged = copy.copy(reports[0])
+    merged_collection = {
+        k: v for k, v in reports[0].get("collection", {}).items() if k != "item"
+    }
+    merged_collection["item"] = []
+    merged_run = {k: v for k, v in reports[0].get("run", {}).items()}
+    merged_run.update(executions=[], failures=[], stats={})
+    for report in reports:
+        merged_collection["item"].extend(report.get("collection", {}).get("item", []))
+        run = report.get("run", {})
+        merged_run["executions"].extend(run.get("executions", []))
+        merged_run["failures"].extend(run.get("failures", []))
+        for stat_name, stat_values in run.get("stats", {}).items():
+            merged_stat = merged_run["stats"].setdefault(stat_name, {})
+            for k, v in stat_values.items():
+                merged_stat[k] = merged_stat.get(k, 0) + v
+        timings = run.get("timings", {})
+        merged_timings = merged_run.setdefault("timings", {})
+        if "started" in timings:
+            merged_timings["started"] = min(
+                timings["started"], merged_timings.get("started", timings["started"])
+            )
+        if "completed" in timings:
+            merged_timings["completed"] = max(
+                timings["completed"],
+                merged_timings.get("completed", timings["completed"]),
+            )
+    merged.update(collection=merged_collection, run=merged_run)
+    return merged
+
+
+def run_pm_collection_test_sharded(
+    data: dict,
+    shards: int = 1,
+    shard_mode: ShardMode = ShardMode.folder,
+    **test_kwargs,
+) -> Tuple:
+    """Run the collection in up to N concurrent newman processes and merge the reports."""
+    sub_collections = split_pm_collection(data, shards, shard_mode) if shards > 1 else []
+    if len(sub_collections) <= 1:
+        return run_pm_collection_test(data, **test_kwargs)
+    logging.info(f"Running collection in [{len(sub_collections)}] shards")
+    with ThreadPoolExecutor(max_workers=len(sub_collections)) as pool:
+        shard_results = list(
+            pool.map(
+                lambda sub_collection: run_pm_collection_test(
+                    sub_collection, **test_kwargs
+                ),
+                sub_collections,
+            )
+        )
+    reports = [report for report, _, _ in shard_results if report]
+    error_rc = max(rc for _, rc, _ in shard_results)
+    error_raw = "\n".join(raw for _, _, raw in shard_results if raw) or None
+    return (merge_pm_collection_reports(reports), error_rc, error_raw)
+
+
+pm_variable_pattern = re.compile(r"\{\{([^{}]+)\}\}")
+
+
+def pm_resolve_variables(value: str, variables: dict) -> str:
+    """Replace {{name}} placeholders, raises KeyError on unknown variables."""
+    return pm_variable_pattern.sub(lambda m: str(variables[m.group(1).strip()]), value)
+
+
+def pm_item_native_request(item: dict, variables: dict) -> dict:
+    """Build requests arguments for an item, None if the item needs newman features."""
+    request = item.get("request")
+    if isinstance(request, str):
+        request = dict(method="GET", url=request)
+    if not isinstance(request, dict):
+        return None
+    if request.get("auth") and request.get("auth", {}).get("type") != "noauth":
+        return None
+    url = request.get("url")
+    url_raw = url.get("raw") if isinstance(url, dict) else url
+    body = request.get("body") or {}
+    if not url_raw or body.get("mode", "raw") != "raw":
+        return None
+    try:
+        headers = {
+            pm_resolve_variables(str(hdr.get("key", "")), variables): pm_resolve_variables(
+                str(hdr.get("value", "")), variables
+            )
+            for hdr in request.get("header", [])
+            if isinstance(hdr, dict) and not hdr.get("disabled")
+        }
+        return dict(
+            method=request.get("method", "GET").upper(),
+            url=pm_resolve_variables(url_raw, variables),
+            headers=headers,
+            data=pm_resolve_variables(body.get("raw"), variables).encode("utf-8")
+            if body.get("raw")
+            else None,
+        )
+    except KeyError as ex:
+        logging.debug(f"Unresolved variable {ex} in item [{item.get('name')}]")
+        return None
+
+
+def split_pm_collection_engines(data: dict, engine: Engine) -> Tuple:
+    """Separate items the native engine can run from items that need newman.
+
+    Returns a list of (item, request arguments) for the native engine and the
+    remaining sub-collection for newman, which is None if nothing is left.
+    The native engine runs nothing on newman, items it cannot run because of
+    scripts, auth settings or unresolved variables stop the run.
+    """
+    if engine == Engine.newman:
+        return ([], data)
+    variables = {
+        var.get("key"): var.get("value", "")
+        for var in data.get("variable", [])
+        if isinstance(var, dict) and not var.get("disabled")
+    }
+    native_items = {}
+    newman_items = []
+
+    def has_scripts(node: dict) -> bool:
+        for event in node.get("event", []) or []:
+            script = event.get("script") if isinstance(event, dict) else None
+            if not script or event.get("disabled"):
+                continue
+            lines = script.get("exec", []) if isinstance(script, dict) else script
+            if isinstance(lines, str):
+                lines = [lines]
+            if any(str(line).strip() for line in lines or []):
+                return True
+        return False
+
+    def has_auth(node: dict) -> bool:
+        return bool(node.get("auth")) and node.get("auth", {}).get("type") != "noauth"
+
+    def walk(node: dict, inherited_scripts: bool, inherited_auth: bool):
+        inherited_scripts |= has_scripts(node)
+        inherited_auth |= has_auth(node)
+        if "item" in node:
+            for coll_item in node.get("item", []):
+                walk(coll_item, inherited_scripts, inherited_auth)
+            return
+        # scripts and auth settings only work on newman
+        native_request = (
+            None if inherited_auth or inherited_scripts else pm_item_native_request(node, variables)
+        )
+        if native_request:
+            native_items[id(node)] = (node, native_request)
+        else:
+            newman_items.append(node.get("name"))
+
+    walk(data, inherited_scripts=False, inherited_auth=False)
+    if engine == Engine.native and newman_items:
+        typer.echo(
+            f"ENGINE=native cannot run [{len(newman_items)}] items with scripts, auth settings or unresolved variables, use ENGINE=auto to run them on newman: {newman_items[:5]}"
+        )
+        raise typer.Exit(RC.BASIC)
+    newman_collection = filter_pm_collection(
+        data, lambda leaf: id(leaf) not in native_items
+    )
+    return (list(native_items.values()), newman_collection)
+
+
+def run_native_request(
+    session: "requests.Session", item: dict, native_request: dict, timeout: float
+) -> Tuple:
+    """Run a single request and build newman compatible execution and failure records."""
+    import requests
+
+    item = dict(item)
+    item.setdefault("id", str(uuid.uuid4()))
+    item.setdefault("event", [])
+    item.setdefault("response", [])
+    item["request"] = dict(
+        method=native_request.get("method"),
+        url=dict(raw=native_request.get("url")),
+        header=[dict(key=k, value=v) for k, v in native_request.get("headers").items()],
+    )
+    execution = dict(
+        id=item.get("id"),
+        item=item,
+        cursor=dict(ref=str(uuid.uuid4())),
+        request=item.get("request"),
+    )
+    failure = None
+    started = time.perf_counter()
+    try:
+        rsp = session.request(
+            timeout=timeout, verify=False, allow_redirects=True, **native_request
+        )
+        execution["response"] = dict(
+            id=str(uuid.uuid4()),
+            status=rsp.reason,
+            code=rsp.status_code,
+            responseTime=round((time.perf_counter() - started) * 1000),
+            responseSize=len(rsp.content),
+            header=[dict(key=k, value=v) for k, v in rsp.headers.items()],
+        )
+    except requests.RequestException as ex:
+        error = dict(
+            name=type(ex).__name__,
+            message=str(ex),
+            timestamp=round(time.time() * 1000),
+        )
+        execution["requestError"] = error
+        failure = dict(error=error, at="request", source=item, parent={}, cursor=execution.get("cursor"))
+    return (execution, failure)
+
+
+async def run_native_requests(
+    native_items: list, timeout: float, concurrency: int = 20, limiter: host_limiter = None
+) -> list:
+    """Run requests with bounded concurrency on a shared keep-alive connection pool.
+
+    The requests library is blocking, so the requests themselves are handed to a
+    thread pool sized to the concurrency limit while asyncio does the scheduling.
+    Requests wait for the limits of their host before taking a pool slot, so a
+    throttled host does not hold up requests to other hosts.
+    """
+    import asyncio
+    import requests
+
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=concurrency, pool_maxsize=concurrency
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        async def bounded(item: dict, native_request: dict) -> Tuple:
+            host_key = get_host_key(native_request.get("url"))
+            host_limits = limiter or default_host_limiter
+            async with host_limits.acquire_async(host_key) as queued_seconds:
+                async with semaphore:
+                    execution, failure = await loop.run_in_executor(
+                        pool, run_native_request, session, item, native_request, timeout
+                    )
+            if host_limits.is_enabled():
+                execution["queueTime"] = round(queued_seconds * 1000)
+            return (execution, failure)
+
+        return await asyncio.gather(
+            *[bounded(item, native_request) for item, native_request in native_items]
+        )
+
+
+def run_pm_collection_native(
+    data: dict,
+    native_items: list,
+    nm_timeout_request: int = None,
+    concurrency: int = 20,
+    limiter: host_limiter = None,
+) -> Tuple:
+    """Run script-free items without newman and return a newman like report.
+
+    The report collection keeps the folder structure of data, reduced to the
+    items run natively.
+    """
+    import asyncio
+    import requests
+
+    requests.packages.urllib3.disable_warnings(
+        requests.packages.urllib3.exceptions.InsecureRequestWarning
+    )
+    timeout = nm_timeout_request / 1000 if nm_timeout_request else None
+    results = asyncio.run(run_native_requests(native_items, timeout, concurrency, limiter))
+    executions = [execution for execution, _ in results]
+    failures = [failure for _, failure in results if failure]
+    executed_items = {
+        id(item): execution.get("item")
+        for (item, _), (execution, _) in zip(native_items, results)
+    }
+    collection = map_pm_collection_leaves(
+        filter_pm_collection(data, lambda leaf: id(leaf) in executed_items),
+        lambda leaf: executed_items.get(id(leaf)),
+    )
+    report_data = dict(
+        collection=collection,
+        run=dict(
+            executions=executions,
+            failures=failures,
+            stats=dict(requests=dict(total=len(executions), failed=len(failures))),
+        ),
+    )
+    return (report_data, 1 if failures else 0, None)
+
+
+def run_pm_collection_engines(
+    data: dict,
+    engine: Engine = Engine.newman,
+    native_concurrency: int = 20,
+    limiter: host_limiter = None,
+    **test_kwargs,
+) -> Tuple:
+    """Run items on the selected engine and merge the results into one report."""
+    native_items, newman_collection = split_pm_collection_engines(data, engine)
+    if not native_items:
+        return run_pm_collection_test_sharded(data, **test_kwargs)
+    logging.info(f"Running [{len(native_items)}] items on the native engine")
+    results = [
+        run_pm_collection_native(
+            data,
+            native_items,
+            nm_timeout_request=test_kwargs.get("nm_timeout_request"),
+            concurrency=native_concurrency,
+            limiter=limiter,
+        )
+    ]
+    if newman_collection:
+        results.append(run_pm_collection_test_sharded(newman_collection, **test_kwargs))
+    reports = [report for report, _, _ in results if report]
+    error_rc = max(rc for _, rc, _ in results)
+    error_raw = "\n".join(raw for _, _, raw in results if raw) or None
+    return (merge_pm_collection_reports(reports), error_rc, error_raw)
+
+
+def update_check_item_doc(
+    check_item_doc: check_result_document,
+    pm_exec_doc: pm_execution_result = None,
+    pm_fail_doc: pm_failure_result = None,
+    sslcert_doc: sslcert_result_document = None,
+):
+    if check_item_doc is None:
+        raise RuntimeError("Item doc should not me null.")
+    if pm_exec_doc:
+        check_item_doc.response = pm_exec_doc.response
+        check_item_doc.assertions = pm_exec_doc.assertions
+        check_item_doc.queue_time = pm_exec_doc.queueTime
+    if pm_fail_doc:
+        check_item_doc.failure = pm_fail_doc
+    if sslcert_doc:
+        check_item_doc.ssl = sslcert_doc
+
+
+def process_pm_collection_report(
+    data: dict, report_error_rc: int, item_table: pm_item_table = None
+):
+    """Result documents by item id of a newman JSON report.
+
+    item_table is the table of the collection that was run, without it the
+    collection of the report is compiled.
+    """
+    datastore = {}
+    if "run" not in data:
+        raise ValueError("PM Report object does not contain 'run' information.")
+    elif "collection" not in data:
+        raise ValueError("PM Report object does not contain 'collection' information.")
+    # extract collection item data
+    if item_table is None:
+        item_table = compile_pm_item_table(data.get("collection", {}))
+    for item_id, entry in item_table.items.items():
+        datastore[item_id] = entry.new_result_document()
+    # handle failure output mixin
+    if report_error_rc > 0:
+        # TODO: determine special handling of report failures
+        logging.debug("extracting failures")
+        for fail in data.get("run", {}).get("failures", []):
+            fail_doc = pm_failure_result(**fail)
+            logging.warning(fail_doc)
+            if fail_doc.source.id in datastore:
+                update_check_item_doc(
+                    check_item_doc=datastore.get(fail_doc.source.id),
+                    pm_fail_doc=fail_doc,
+                )
+    # extract execution data
+    for exec_item in data.get("run", {}).get("executions", []):
+        pm_exec_result_doc = pm_execution_result(**exec_item)
+        if pm_exec_result_doc.id not in datastore:
+            logging.critical(
+                "This should not happen, no ITEM ID found in datastore for execution item."
+            )
+            raise typer.Exit(RC.BASIC)
+        else:
+            # merge in fields extracted from data
+            update_check_item_doc(
+                check_item_doc=datastore.get(pm_exec_result_doc.id),
+                pm_exec_doc=pm_exec_result_doc,
+            )
+    return datastore
+
+
+def pm_collection_extract_urls(data: dict) -> list:
+    collection = list()
+    if "item" in data:
+        for item in data.get("item", []):
+            collection.extend(pm_collection_extract_urls(item))
+    elif "request" in data:
+        url_doc = get_pm_item_url(data)
+        if url_doc:
+            collection.append(url_doc)
+    return collection
+
+
+def is_self_signed_cert(cert: "x509.Certificate") -> bool:
+    """Using heuristic check for self-signed certificates.
+    Details described in: https://www.rfc-editor.org/rfc/rfc3280#section-4.2.1.1
+    Implementation hint reference:
+    https://security.stackexchange.com/questions/93162/how-to-know-if-certificate-is-self-signed
+    """
+    from cryptography import x509
+
+    auth_key_id = None
+    subj_key_id = None
+    for ext in cert.extensions:
+        if isinstance(ext.value, x509.AuthorityKeyIdentifier):
+            auth_key_id = ext.value.key_identifier
+        if isinstance(ext.value, x509.SubjectKeyIdentifier):
+            subj_key_id = ext.value.key_identifier
+    if auth_key_id and subj_key_id:
+        return auth_key_id == subj_key_id
+    elif not auth_key_id:
+        # valid CAs need to provide AuthenticationKeyIdentifier, so this is self-signed
+        return True
+    else:
+        # anything else we don't cover yet
+        logging.warning("SSL check heuristic dead end. Check Implementation!")
+        raise typer.Exit(RC.OTHER)
+
+
+@dataclasses.dataclass
+class sslcert_cache:
+    """Certificate check results kept between runs.
+
+    Hosts map to the fingerprint of the certificate they presented, the check
+    results are stored per fingerprint, so hosts sharing a certificate share
+    the self-signed and revocation results. Error results expire after the
+    shorter error_ttl_seconds, so failing hosts are retried soon.
+    """
+
+    path: Path = None
+    ttl_seconds: float = 0
+    error_ttl_seconds: float = 300
+    hosts: dict = dataclasses.field(default_factory=dict)
+    certs: dict = dataclasses.field(default_factory=dict)
+
+    def __post_init__(self):
+        if self.path:
+            self.path = Path(self.path)
+        if self.path and self.path.is_file():
+            try:
+                with self.path.open(mode="r") as fp:
+                    stored = json.load(fp)
+                self.hosts = stored.get("hosts", {})
+                self.certs = stored.get("certs", {})
+            except (OSError, ValueError) as ex:
+                logging.warning(f"Ignoring unreadable certificate cache [{self.path}]: {ex}")
+
+    def get(self, url: pm_request_url) -> sslcert_result_document:
+        if self.ttl_seconds <= 0:
+            return None
+        entry = self.hosts.get(url.hostinfo_hashed)
+        if not entry:
+            return None
+        ttl = self.error_ttl_seconds if entry.get("error_type") else self.ttl_seconds
+        if time.time() - entry.get("fetched_at", 0) > ttl:
+            self.hosts.pop(url.hostinfo_hashed, None)
+            return None
+        if entry.get("error_type"):
+            return sslcert_result_document(
+                url=url,
+                error_type=entry.get("error_type"),
+                error_code=entry.get("error_code"),
+                error_msg_raw=entry.get("error_msg_raw"),
+                cached=True,
+            )
+        cert_entry = self.certs.get(entry.get("fingerprint"))
+        if not cert_entry:
+            return None
+        from cryptography import x509
+
+        return sslcert_result_document(
+            url=url,
+            host_cert=x509.load_pem_x509_certificate(cert_entry.get("pem").encode("utf-8")),
+            is_self_signed=cert_entry.get("is_self_signed"),
+            is_revoked=cert_entry.get("is_revoked"),
+            revoked_msg=cert_entry.get("revoked_msg"),
+            crl_verification_failures=cert_entry.get("crl_verification_failures", []),
+            chain_expiry=datetime.fromisoformat(cert_entry.get("chain_expiry"))
+            if cert_entry.get("chain_expiry")
+            else None,
+            chain_expiry_subject=cert_entry.get("chain_expiry_subject"),
+            revocation_source=cert_entry.get("revocation_source"),
+            cached=True,
+        )
+
+    def put(self, hostinfo_hashed: str, doc: sslcert_result_document):
+        if self.ttl_seconds <= 0 or doc.cached:
+            return
+        entry = dict(fetched_at=time.time())
+        if doc.host_cert:
+            from cryptography.hazmat.primitives import hashes, serialization
+
+            fingerprint = doc.host_cert.fingerprint(hashes.SHA256()).hex()
+            # no handshake took place for cached results, so its latency is not kept
+            entry.update(fingerprint=fingerprint)
+            self.certs[fingerprint] = dict(
+                pem=doc.host_cert.public_bytes(serialization.Encoding.PEM).decode("utf-8"),
+                is_self_signed=doc.is_self_signed,
+                is_revoked=doc.is_revoked,
+                revoked_msg=str(doc.revoked_msg) if doc.revoked_msg else None,
+                crl_verification_failures=[str(f) for f in doc.crl_verification_failures],
+                chain_expiry=doc.chain_expiry.isoformat() if doc.chain_expiry else None,
+                chain_expiry_subject=doc.chain_expiry_subject,
+                revocation_source=doc.revocation_source,
+            )
+        else:
+            entry.update(
+                error_type=doc.error_type,
+                error_code=int(doc.error_code),
+                error_msg_raw=doc.error_msg_raw,
+            )
+        self.hosts[hostinfo_hashed] = entry
+
+    def save(self):
+        if not self.path or self.ttl_seconds <= 0:
+            return
+        # drop certificates no host refers to anymore
+        fingerprints = {entry.get("fingerprint") for entry in self.hosts.values()}
+        self.certs = {k: v for k, v in self.certs.items() if k in fingerprints}
+        tmp_path = self.path.with_suffix(".tmp")
+        with tmp_path.open(mode="w") as fp:
+            json.dump(dict(hosts=self.hosts, certs=self.certs), fp)
+        tmp_path.replace(self.path)
+
+
+def get_server_certificate_chain(address: Tuple, timeout: float = 5.0) -> list:
+    """Certificates presented by the server, leaf first, from a single unverified handshake."""
+    from cryptography import x509
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    with socket.create_connection(address, timeout=timeout) as sock:
+        with context.wrap_socket(sock, server_hostname=address[0]) as sslsock:
+            if hasattr(sslsock, "get_unverified_chain"):
+                # public since Python 3.13, returns DER encoded certificates
+                chain_der = sslsock.get_unverified_chain() or []
+            elif hasattr(sslsock._sslobj, "get_unverified_chain"):
+                # Python 3.10 to 3.12 only have it on the private ssl object
+                chain_der = [
+                    cert.public_bytes(ssl._ssl.ENCODING_DER)
+                    for cert in sslsock._sslobj.get_unverified_chain() or []
+                ]
+            else:
+                # without the chain only the leaf is checked
+                chain_der = [sslsock.getpeercert(binary_form=True)]
+    return [x509.load_der_x509_certificate(cert_der) for cert_der in chain_der if cert_der]
+
+
+def retrieve_server_certificate(
+    url: pm_request_url,
+    ssl_timeout: float = 5.0,
+    crl_index: crl_revocation_index = None,
+    limiter: host_limiter = None,
+) -> sslcert_result_document:
+    # retrieve host cert without verification
+    address = (url.url_parsed.hostname, url.url_parsed.port)
+    try:
+        with (limiter or default_host_limiter).acquire(url.hostinfo_hashed):
+            started = time.perf_counter()
+            chain = get_server_certificate_chain(address, timeout=ssl_timeout)
+            handshake_latency_ms = (time.perf_counter() - started) * 1000
+        return sslcert_result_document(
+            url=url,
+            host_cert=chain[0],
+            chain=chain[1:],
+            handshake_latency_ms=handshake_latency_ms,
+            crl_index=crl_index,
+        )
+    except OSError as ex:
+        return sslcert_result_document(
+            url=url,
+            error_code=int(ex.errno) if ex.errno else RC.BASIC,
+            error_type=str(type(ex).__name__),
+            error_msg_raw=ex.strerror,
+        )
+    except Exception as ex:
+        return sslcert_result_document(
+            url=url,
+            error_code=RC.OTHER,
+            error_type=str(type(ex).__name__),
+            error_msg_raw=str(ex),
+        )
+
+
+@dataclasses.dataclass
+class sslcert_executor:
+    """Thread pool for certificate retrievals, kept between check cycles.
+
+    Retrievals still running after a stage deadline keep their thread, a host
+    is not retrieved again before its running retrieval ends. So hanging hosts
+    hold at most one of max_workers threads each instead of adding threads
+    every cycle.
+    """
+
+    max_workers: int = 16
+    pool: ThreadPoolExecutor = None
+    running: dict = dataclasses.field(default_factory=dict)
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+
+    def __post_init__(self):
+        if not self.pool:
+            self.pool = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="sslcert"
+            )
+
+    def submit(self, key: str, fn: Callable, *args) -> Future:
+        with self.lock:
+            future = self.running.get(key)
+            if future and not future.done():
+                logging.debug(f"Certificate retrieval [{key}] still running, waiting for it")
+                return future
+            future = self.running[key] = self.pool.submit(fn, *args)
+        future.add_done_callback(lambda done: self.discard(key, done))
+        return future
+
+    def discard(self, key: str, future: Future):
+        with self.lock:
+            if self.running.get(key) is future:
+                del self.running[key]
+
+    def close(self):
+        # don't wait for handshakes still hanging
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def retrieve_server_certificates(
+    urls: list,
+    ssl_timeout: float = 5.0,
+    concurrency: int = 16,
+    deadline: float = None,
+    cache: sslcert_cache = None,
+    crl_index: crl_revocation_index = None,
+    limiter: host_limiter = None,
+    executor: sslcert_executor = None,
+) -> dict:
+    """Retrieve and check certificates of all distinct hosts concurrently.
+
+    Hosts without a result when the stage deadline is reached get a timeout
+    error result instead of holding up the whole run. Without an executor
+    one is started for this call only.
+    """
+    results = {}
+    unique_urls = {}
+    for url in urls:
+        if url.hostinfo_hashed in unique_urls or url.hostinfo_hashed in results:
+            continue
+        cached_doc = cache.get(url) if cache else None
+        if cached_doc:
+            results[url.hostinfo_hashed] = cached_doc
+        else:
+            unique_urls[url.hostinfo_hashed] = url
+    if not unique_urls:
+        return results
+    own_executor = executor is None
+    if own_executor:
+        executor = sslcert_executor(max_workers=min(concurrency, len(unique_urls)))
+    futures = {
+        executor.submit(
+            hostinfo_hashed, retrieve_server_certificate, url, ssl_timeout, crl_index, limiter
+        ): hostinfo_hashed
+        for hostinfo_hashed, url in unique_urls.items()
+    }
+    done, not_done = wait(futures, timeout=deadline)
+    for future in done:
+        results[futures[future]] = future.result()
+    for future in not_done:
+        hostinfo_hashed = futures[future]
+        logging.warning(
+            f"Certificate retrieval for [{unique_urls[hostinfo_hashed].url_parsed.hostinfo}] exceeded stage deadline"
+        )
+        results[hostinfo_hashed] = sslcert_result_document(
+            url=unique_urls[hostinfo_hashed],
+            error_code=RC.TIMER,
+            error_type="TimeoutError",
+            error_msg_raw=f"Certificate stage deadline of {deadline}s exceeded",
+        )
+    if own_executor:
+        executor.close()
+    if cache:
+        for hostinfo_hashed in unique_urls:
+            cache.put(hostinfo_hashed, results[hostinfo_hashed])
+        cache.save()
+    return results
+
+
+def estimate_location(auto_location_test_hostinfo: str) -> str:
+    """Returns an IP-Address used to communicate to external endpoints."""
+
+    logging.info(
+        f"Determining location from test connection to [{auto_location_test_hostinfo}]"
+    )
+    host_info_parts = auto_location_test_hostinfo.split(":")
+    host, port, *_ = tuple(host_info_parts)
+    proto = "TCP"
+    if len(host_info_parts) > 2:
+        proto = host_info_parts[2].upper()
+    port = int(port)
+    ip = ipaddress.ip_address(host)
+
+    if isinstance(ip, ipaddress.IPv4Address):
+        sock_fam = socket.AF_INET
+    elif isinstance(ip, ipaddress.IPv6Address):
+        sock_fam = socket.AF_INET6
+    else:
+        raise ValueError("Require valid IP address in test hostinfo.")
+
+    if proto in ["UDP", "TCP"]:
+        sock_proto = socket.IPPROTO_UDP if proto == "UDP" else socket.IPPROTO_TCP
+        sock_type = socket.SOCK_DGRAM if proto == "UDP" else socket.SOCK_STREAM
+    else:
+        raise ValueError("Required protocol not found in test hostinfo.")
+
+    s = socket.socket(sock_fam, sock_type, sock_proto)
+    s.connect((str(ip), port))
+    socket_source_ip = ipaddress.ip_address(s.getsockname()[0])
+    return str(socket_source_ip)
+
+
+def get_appinsights_name(name: str) -> str:
+    """
+    Mitigate AppInsights submission restrictions:
+    name: 1-64, 0-1A-Za-z, hyphen, space, needs to start with char
+    """
+    name = str(name)
+    name = name.replace("/", "--")
+    name = re.sub(r"(?:[^a-zA-Z\d\ \-])", " ", name)
+    name = re.sub(r"(\ )+", r"\1", name)
+    name = re.sub(r"(\-\-)+", r"\1", name)
+    name = name.strip()
+    if re.match(r"^[^a-zA-Z]", name):
+        name = re.sub(r"^([^\w]+)(.+)", r"\2", name)
+    if len(name) > 64:
+        name = f"{name[:-3]}..."
+    return name
+
+
+def sanitize_appinsights(payload: dict) -> dict:
+    payload.update(dict(name=get_appinsights_name(payload.get("name"))))
+    return payload
+
+
+@dataclasses.dataclass
+class telemetry_spool:
+    """Append-only, size-capped on-disk spool of serialized telemetry envelopes.
+
+    Envelopes are appended as lines to segment files of up to segment_max_bytes.
+    The position of the oldest unsent envelope is kept in a checkpoint file, so
+    unsent telemetry survives restarts and is replayed with its original
+    timestamps. When the spool grows beyond max_bytes the oldest segments are
+    dropped.
+    """
+
+    path: Path
+    segment_max_bytes: int = 4 << 20
+    max_bytes: int = 256 << 20
+    segment_sizes: dict = dataclasses.field(default_factory=dict, init=False)
+    read_seq: int = dataclasses.field(default=0, init=False)
+    read_offset: int = dataclasses.field(default=0, init=False)
+    write_seq: int = dataclasses.field(default=0, init=False)
+    write_fp: Any = dataclasses.field(default=None, init=False, repr=False)
+    pending_items: int = dataclasses.field(default=0, init=False)
+    pending_bytes: int = dataclasses.field(default=0, init=False)
+    dropped_items: int = dataclasses.field(default=0, init=False)
+
+    def __post_init__(self):
+        self.path = Path(self.path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        for segment_file in self.path.glob("segment-*.ndjson"):
+            self.segment_sizes[int(segment_file.stem.split("-")[1])] = segment_file.stat().st_size
+        checkpoint_file = self.path / "checkpoint.json"
+        if checkpoint_file.is_file():
+            try:
+                with checkpoint_file.open(mode="r") as fp:
+                    checkpoint = json.load(fp)
+                self.read_seq = checkpoint.get("seq", 0)
+                self.read_offset = checkpoint.get("offset", 0)
+            except (OSError, ValueError) as ex:
+                logging.warning(f"Ignoring unreadable spool checkpoint: {ex}")
+        for seq in [seq for seq, size in self.segment_sizes.items() if seq < self.read_seq or not size]:
+            self.remove_segment(seq)
+        for seq in sorted(self.segment_sizes):
+            offset = self.read_offset if seq == self.read_seq else 0
+            items, size = self.count_lines(seq, offset)
+            self.pending_items += items
+            self.pending_bytes += size
+        if self.pending_items:
+            logging.info(f"Found [{self.pending_items}] spooled telemetry items to replay")
+        # always continue in a new segment, a crash may have left a partial line
+        self.write_seq = max(list(self.segment_sizes) + [self.read_seq]) + 1
+        self.open_segment()
+
+    def segment_file(self, seq: int) -> Path:
+        return self.path / f"segment-{seq:012d}.ndjson"
+
+    def count_lines(self, seq: int, offset: int = 0) -> Tuple:
+        items, size = 0, 0
+        with self.segment_file(seq).open(mode="rb") as fp:
+            fp.seek(offset)
+            for line in fp:
+                if line.endswith(b"\n"):
+                    items += 1
+                    size += len(line)
+        return (items, size)
+
+    def open_segment(self):
+        if self.write_fp:
+            self.write_fp.close()
+        self.write_fp = self.segment_file(self.write_seq).open(mode="ab")
+        self.segment_sizes[self.write_seq] = 0
+
+    def remove_segment(self, seq: int):
+        self.segment_sizes.pop(seq, None)
+        self.segment_file(seq).unlink(missing_ok=True)
+
+    def save_checkpoint(self):
+        checkpoint_file = self.path / "checkpoint.json"
+        tmp_file = checkpoint_file.with_suffix(".tmp")
+        with tmp_file.open(mode="w") as fp:
+            json.dump(dict(seq=self.read_seq, offset=self.read_offset), fp)
+        tmp_file.replace(checkpoint_file)
+
+    def append(self, payload: bytes):
+        line = payload + b"\n"
+        if self.segment_sizes[self.write_seq] and (
+            self.segment_sizes[self.write_seq] + len(line) > self.segment_max_bytes
+        ):
+            self.write_seq += 1
+            self.open_segment()
+        self.write_fp.write(line)
+        self.write_fp.flush()
+        self.segment_sizes[self.write_seq] += len(line)
+        self.pending_items += 1
+        self.pending_bytes += len(line)
+        # drop the oldest segments once the cap is reached
+        while sum(self.segment_sizes.values()) > self.max_bytes and len(self.segment_sizes) > 1:
+            oldest = min(self.segment_sizes)
+            items, size = self.count_lines(
+                oldest, self.read_offset if oldest == self.read_seq else 0
+            )
+            logging.warning(f"Telemetry spool full, dropping [{items}] oldest items")
+            self.remove_segment(oldest)
+            self.dropped_items += items
+            self.pending_items = max(0, self.pending_items - items)
+            self.pending_bytes = max(0, self.pending_bytes - size)
+            if oldest >= self.read_seq:
+                self.read_seq, self.read_offset = min(self.segment_sizes), 0
+                self.save_checkpoint()
+
+    def read_batch(self, max_items: int, max_bytes: int) -> Tuple:
+        """Return the oldest unsent payloads and the cursor to commit once they are sent."""
+        while True:
+            if self.read_seq not in self.segment_sizes:
+                following = [seq for seq in self.segment_sizes if seq > self.read_seq]
+                if not following:
+                    return ([], None)
+                self.read_seq, self.read_offset = min(following), 0
+            batch, batch_bytes = [], 0
+            offset = self.read_offset
+            with self.segment_file(self.read_seq).open(mode="rb") as fp:
+                fp.seek(offset)
+                for line in fp:
+                    if not line.endswith(b"\n"):
+                        break
+                    if batch and (
+                        len(batch) >= max_items or batch_bytes + len(line) > max_bytes
+                    ):
+                        break
+                    batch.append(line[:-1])
+                    batch_bytes += len(line)
+                    offset += len(line)
+            if batch:
+                return (batch, (self.read_seq, offset, len(batch), batch_bytes))
+            if self.read_seq == self.write_seq:
+                return ([], None)
+            # older segment fully sent
+            self.remove_segment(self.read_seq)
+            self.read_seq, self.read_offset = self.read_seq + 1, 0
+            self.save_checkpoint()
+
+    def commit(self, cursor: Tuple):
+        seq, offset, items, size = cursor
+        self.pending_items = max(0, self.pending_items - items)
+        self.pending_bytes = max(0, self.pending_bytes - size)
+        if seq in self.segment_sizes:
+            self.read_seq, self.read_offset = seq, offset
+            self.save_checkpoint()
+
+    def close(self):
+        if self.write_fp:
+            self.write_fp.close()
+            self.write_fp = None
+            if not self.segment_sizes.get(self.write_seq):
+                self.remove_segment(self.write_seq)
+
+
+@dataclasses.dataclass
+class batched_telemetry_sender:
+    """Background sender for telemetry envelopes.
+
+    Used as the queue of a TelemetryChannel. Envelopes are serialized when they
+    are tracked and sent by a background thread in gzip compressed batches,
+    limited by item count and payload bytes. Throttled or failed batches are
+    retried with exponential backoff, honoring Retry-After. flush() only wakes
+    the sender up, use drain() to wait for the queue to be sent.
+
+    With a spool, envelopes are written to disk first and only removed once
+    sent. Batches failing all retries stay in the spool and are replayed later,
+    at most max_replay_items_per_second.
+    """
+
+    endpoint: str = ai_ingestion_endpoint
+    max_batch_items: int = 500
+    max_batch_bytes: int = 1 << 20
+    max_linger_seconds: float = 1.0
+    max_queue_items: int = 50000
+    max_retries: int = 5
+    backoff_seconds: float = 1.0
+    timeout: float = 10.0
+    compress: bool = True
+    spool: telemetry_spool = None
+    max_replay_items_per_second: float = 500.0
+    retry_status_codes: tuple = (408, 429, 439, 500, 502, 503, 504)
+    pending: collections.deque = dataclasses.field(default_factory=collections.deque, init=False)
+    pending_bytes: int = dataclasses.field(default=0, init=False)
+    in_flight: int = dataclasses.field(default=0, init=False)
+    flush_requested: bool = dataclasses.field(default=False, init=False)
+    closed: bool = dataclasses.field(default=False, init=False)
+    condition: threading.Condition = dataclasses.field(default_factory=threading.Condition, init=False)
+    counters: dict = dataclasses.field(default_factory=dict, init=False)
+    session: "requests.Session" = dataclasses.field(default=None, init=False)
+    thread: threading.Thread = dataclasses.field(default=None, init=False)
+
+    def __post_init__(self):
+        self.counters = dict(
+            sent_items=0,
+            sent_batches=0,
+            dropped_items=0,
+            retries=0,
+            last_send_latency_ms=0.0,
+            total_send_latency_ms=0.0,
+        )
+        import requests
+
+        self.session = requests.Session()
+        self.thread = threading.Thread(
+            target=self.run, name="telemetry-sender", daemon=True
+        )
+        self.thread.start()
+
+    def queued_items(self) -> int:
+        return self.spool.pending_items if self.spool else len(self.pending)
+
+    def queued_bytes(self) -> int:
+        return self.spool.pending_bytes if self.spool else self.pending_bytes
+
+    def put(self, item):
+        if not item:
+            return
+        payload = json.dumps(item.write()).encode("utf-8")
+        with self.condition:
+            if self.spool:
+                self.spool.append(payload)
+            else:
+                if len(self.pending) >= self.max_queue_items:
+                    self.pending_bytes -= len(self.pending.popleft())
+                    self.counters["dropped_items"] += 1
+                self.pending.append(payload)
+                self.pending_bytes += len(payload)
+            if (
+                self.queued_items() >= self.max_batch_items
+                or self.queued_bytes() >= self.max_batch_bytes
+            ):
+                self.condition.notify_all()
+
+    def flush(self):
+        with self.condition:
+            self.flush_requested = True
+            self.condition.notify_all()
+
+    def drain(self, timeout: float = None) -> bool:
+        """Wait until all queued items are sent or dropped, False on timeout."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.condition:
+            self.flush_requested = True
+            self.condition.notify_all()
+            while self.queued_items() or self.in_flight:
+                remaining = deadline - time.monotonic() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+                self.flush_requested = True
+        return True
+
+    def close(self, timeout: float = None) -> bool:
+        drained = self.drain(timeout)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+            if self.spool:
+                self.spool.close()
+        if not drained and self.spool:
+            logging.warning(f"Telemetry sender closed, [{self.queued_items()}] unsent items kept in spool")
+        elif not drained:
+            logging.warning(f"Telemetry sender closed with [{self.queued_items()}] unsent items")
+        return drained
+
+    def get_stats(self) -> dict:
+        with self.condition:
+            # spooled items stay in the spool while they are in flight
+            queue_depth = self.queued_items() + (0 if self.spool else self.in_flight)
+            stats = dict(self.counters, queue_depth=queue_depth)
+            if self.spool:
+                stats["spool_bytes"] = self.spool.pending_bytes
+                stats["spool_dropped_items"] = self.spool.dropped_items
+        if stats.get("sent_batches"):
+            stats["avg_send_latency_ms"] = stats["total_send_latency_ms"] / stats["sent_batches"]
+        return stats
+
+    def take_batch(self) -> Tuple:
+        if self.spool:
+            return self.spool.read_batch(self.max_batch_items, self.max_batch_bytes)
+        batch, batch_bytes = [], 0
+        while self.pending and len(batch) < self.max_batch_items:
+            if batch and batch_bytes + len(self.pending[0]) > self.max_batch_bytes:
+                break
+            payload = self.pending.popleft()
+            self.pending_bytes -= len(payload)
+            batch_bytes += len(payload)
+            batch.append(payload)
+        return (batch, None)
+
+    def run(self):
+        while True:
+            with self.condition:
+                first_wait = time.monotonic()
+                while not self.closed:
+                    batch_full = (
+                        self.queued_items() >= self.max_batch_items
+                        or self.queued_bytes() >= self.max_batch_bytes
+                    )
+                    lingered = time.monotonic() - first_wait >= self.max_linger_seconds
+                    if self.queued_items() and (batch_full or self.flush_requested or lingered):
+                        break
+                    if not self.queued_items():
+                        self.flush_requested = False
+                        first_wait = time.monotonic()
+                        self.condition.notify_all()
+                    self.condition.wait(self.max_linger_seconds)
+                # spooled items are kept on disk for the next run
+                if self.closed and (self.spool or not self.queued_items()):
+                    return
+                batch, cursor = self.take_batch()
+                self.in_flight = len(batch)
+                # items spooled behind the batch, live items are taken all at once
+                backlog = self.spool.pending_items - len(batch) if self.spool else 0
+            delivered = True
+            started = time.monotonic()
+            try:
+                if batch:
+                    delivered = self.send(batch)
+            except Exception:
+                logging.exception("Telemetry batch submission failed")
+            finally:
+                with self.condition:
+                    self.in_flight = 0
+                    if self.spool and cursor and delivered:
+                        self.spool.commit(cursor)
+                    elif not self.spool and not delivered:
+                        self.counters["dropped_items"] += len(batch)
+                    self.condition.notify_all()
+            if self.spool and not delivered:
+                # keep the batch spooled and wait before replaying it
+                with self.condition:
+                    self.condition.wait(self.backoff_seconds * 2 ** self.max_retries)
+            elif backlog > 0 and batch:
+                # cap the replay rate so a backlog does not burst at the endpoint
+                min_duration = len(batch) / self.max_replay_items_per_second
+                time.sleep(max(0.0, min_duration - (time.monotonic() - started)))
+
+    def send(self, batch: list) -> bool:
+        """Send a batch, False if it should be kept for a later attempt."""
+        import requests
+
+        body = b"[" + b",".join(batch) + b"]"
+        headers = {"Content-Type": "application/json; charset=utf-8", "Accept": "application/json"}
+        if self.compress:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                rsp = self.session.post(self.endpoint, data=body, headers=headers, timeout=self.timeout)
+                status_code = rsp.status_code
+                retry_after = rsp.headers.get("Retry-After")
+            except requests.RequestException as ex:
+                logging.debug(f"Telemetry submission error: {ex}")
+                status_code = None
+            latency_ms = (time.perf_counter() - started) * 1000
+            with self.condition:
+                self.counters["last_send_latency_ms"] = latency_ms
+            if status_code is not None and 200 <= status_code < 300:
+                with self.condition:
+                    self.counters["sent_items"] += len(batch)
+                    self.counters["sent_batches"] += 1
+                    self.counters["total_send_latency_ms"] += latency_ms
+                return True
+            if status_code is not None and status_code not in self.retry_status_codes:
+                logging.warning(f"Telemetry batch rejected with HTTP [{status_code}], dropping [{len(batch)}] items")
+                with self.condition:
+                    self.counters["dropped_items"] += len(batch)
+                return True
+            if attempt < self.max_retries:
+                try:
+                    delay = float(retry_after)
+                except (TypeError, ValueError):
+                    delay = self.backoff_seconds * 2 ** attempt
+                logging.debug(f"Retrying telemetry batch in [{delay}]s after HTTP [{status_code}]")
+                with self.condition:
+                    self.counters["retries"] += 1
+                time.sleep(delay)
+        return False
+
+
+def create_telemetry_client(
+    instrumentation_key: str, sender: batched_telemetry_sender
+) -> "TelemetryClient":
+    from applicationinsights import TelemetryClient
+    from applicationinsights.channel import TelemetryChannel
+
+    return TelemetryClient(
+        instrumentation_key, telemetry_channel=TelemetryChannel(queue=sender)
+    )
+
+
+def get_check_result_payload(
+    report_doc: check_result_document, location: str = None, collection: str = None
+) -> dict:
+    payload = dict(
+        name=report_doc.appinsights_name or get_appinsights_name(report_doc.name),
+        duration=report_doc.response.responseTime if report_doc.response else 0,
+        success=report_doc.test_success,
+        run_location=location,
+        message=" ".join(report_doc.test_messages),
+        properties=report_doc.get_result_properties(),
+    )
+    if collection:
+        payload["properties"]["collection"] = collection
+    return payload
+
+
+def track_check_result(
+    report_doc: check_result_document,
+    tc: "TelemetryClient",
+    location: str = None,
+    collection: str = None,
 ):
-    if check_item_doc is None:
-        raise RuntimeError("Item doc should not me null.")
-    if pm_exec_doc:
-        check_item_doc.response = pm_exec_doc.response
-        check_item_doc.assertions = pm_exec_doc.assertions
-    if pm_fail_doc:
-        check_item_doc.failure = pm_fail_doc
-    if sslcert_doc:
-        check_item_doc.ssl = sslcert_doc
+    logging.debug(f"Preparing payload for document id: [{report_doc.id}]")
+    tc.context.operation.id = report_doc.id
+    payload = get_check_result_payload(report_doc, location=location, collection=collection)
+    logging.debug(f"Payload of document id [{report_doc.id}] follows:")
+    logging.debug(str(payload))
+    # send results
+    tc.track_availability(**payload)
+    if report_doc.response and report_doc.response.timingPhases:
+        metric_properties = dict(
+            item_id=report_doc.id,
+            item_name=report_doc.name,
+            run_location=location,
+            monitor_type=monitor_type,
+        )
+        if collection:
+            metric_properties["collection"] = collection
+        for phase, duration in report_doc.response.timingPhases.items():
+            tc.track_metric(f"timing_{phase}_ms", duration, properties=metric_properties)
+    logging.info(f"Report for document id [{report_doc.id}] submitted.")
+
+
+def publish_results(
+    data: dict, sinks: list, location: str = None, flush_size: int = 100, collection: str = None
+):
+    for counter, report_doc in enumerate(data.values(), start=1):
+        for sink in sinks:
+            sink.publish(report_doc, location=location, collection=collection)
+        if counter > 0 and counter % flush_size == 0:
+            # use a maximum batch size of flush_size items
+            logging.debug("Flush size reached, submitting queue now.")
+            for sink in sinks:
+                sink.flush()
+            logging.debug("Flush done. Moving on.")
+    logging.debug("Flush result sinks")
+    for sink in sinks:
+        sink.flush()
+    logging.debug("Flush done. End of batch submission.")
+
+
+def publish_in_appinsights(data: dict, tc: "TelemetryClient", location: str = None, flush_size: int = 100, collection: str = None):
+    publish_results(
+        data, [appinsights_sink(tc=tc)], location=location, flush_size=flush_size, collection=collection
+    )
+
+
+@dataclasses.dataclass
+class result_sink(abc.ABC):
+    """Destination of check results and metrics.
+
+    Implementations may buffer what they get, flush sends or writes it.
+    Callers serialize their calls with the publish lock of monitor_state.
+    """
+
+    @abc.abstractmethod
+    def publish(
+        self, report_doc: check_result_document, location: str = None, collection: str = None
+    ):
+        pass
+
+    def track_metrics(self, metrics: dict, properties: dict):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self, timeout: float = None):
+        self.flush()
+
+
+@dataclasses.dataclass
+class appinsights_sink(result_sink):
+    """Results as availability tests and metrics of Application Insights."""
+
+    instrumentation_key: str = None
+    sender: batched_telemetry_sender = None
+    tc: "TelemetryClient" = None
+
+    def __post_init__(self):
+        if not self.tc:
+            if not self.sender:
+                self.sender = batched_telemetry_sender()
+            self.tc = create_telemetry_client(self.instrumentation_key, self.sender)
+
+    def publish(
+        self, report_doc: check_result_document, location: str = None, collection: str = None
+    ):
+        track_check_result(report_doc, tc=self.tc, location=location, collection=collection)
+
+    def track_metrics(self, metrics: dict, properties: dict):
+        for name, value in metrics.items():
+            self.tc.track_metric(name, value, properties=properties)
+
+    def flush(self):
+        self.tc.flush()
+
+    def close(self, timeout: float = None):
+        self.tc.flush()
+        if self.sender:
+            self.sender.close(timeout=timeout)
+
+
+@dataclasses.dataclass
+class ndjson_sink(result_sink):
+    """Results and metrics as json lines on stdout or in a file.
+
+    Lines are buffered and written on flush or every buffer_lines lines. A
+    file is rotated before it grows beyond max_bytes: it is renamed to
+    <path>.1 and older files move up to <path>.<backups>, the oldest is
+    removed.
+    """
+
+    path: Path = None
+    max_bytes: int = 100 << 20
+    backups: int = 5
+    buffer_lines: int = 1000
+    lines: list = dataclasses.field(default_factory=list)
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+    fp: Any = None
+
+    def __post_init__(self):
+        if self.path:
+            self.path = Path(self.path)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def append(self, record: dict):
+        line = json.dumps(record, default=str)
+        with self.lock:
+            self.lines.append(line)
+            if len(self.lines) >= self.buffer_lines:
+                self.write()
+
+    def write(self):
+        if not self.lines:
+            return
+        data = ("\n".join(self.lines) + "\n").encode("utf-8")
+        self.lines = []
+        if not self.path:
+            sys.stdout.buffer.write(data)
+            sys.stdout.flush()
+            return
+        if self.fp is None:
+            self.fp = self.path.open(mode="ab")
+        if self.fp.tell() and self.fp.tell() + len(data) > self.max_bytes:
+            self.rotate()
+        self.fp.write(data)
+        self.fp.flush()
+
+    def rotate(self):
+        self.fp.close()
+        for index in range(self.backups - 1, 0, -1):
+            backup = self.path.with_name(f"{self.path.name}.{index}")
+            if backup.is_file():
+                backup.replace(self.path.with_name(f"{self.path.name}.{index + 1}"))
+        if self.backups > 0:
+            self.path.replace(self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+        self.fp = self.path.open(mode="ab")
+
+    def publish(
+        self, report_doc: check_result_document, location: str = None, collection: str = None
+    ):
+        record = dict(
+            type="result",
+            time=datetime.now(timezone.utc).isoformat(),
+            **get_check_result_payload(report_doc, location=location, collection=collection),
+        )
+        if report_doc.response and report_doc.response.timingPhases:
+            record["timing_phases_ms"] = report_doc.response.timingPhases
+        self.append(record)
+
+    def track_metrics(self, metrics: dict, properties: dict):
+        self.append(
+            dict(
+                type="metrics",
+                time=datetime.now(timezone.utc).isoformat(),
+                properties=properties,
+                metrics=metrics,
+            )
+        )
+
+    def flush(self):
+        with self.lock:
+            self.write()
+
+    def close(self, timeout: float = None):
+        with self.lock:
+            self.write()
+            if self.fp:
+                self.fp.close()
+                self.fp = None
+
+
+openmetrics_content_type = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+openmetrics_families = (
+    ("urlmonitor_check_success", "1 if the last check of the item passed, else 0."),
+    ("urlmonitor_response_status_code", "HTTP status code of the last response."),
+    ("urlmonitor_response_time_seconds", "Response time of the last request."),
+    ("urlmonitor_certificate_expiry_days", "Days until the certificate of the host expires."),
+)
+
+
+def get_openmetrics_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+@dataclasses.dataclass
+class openmetrics_sink(result_sink):
+    """Latest result of every item served for scrapers in the OpenMetrics text format.
+
+    /metrics is served on address:port by a background thread. Only the last
+    result per collection, location and item is kept, nothing is sent.
+    Results older than max_age_seconds are dropped, so items removed from a
+    collection disappear. 0 keeps them.
+    """
+
+    address: str = "0.0.0.0"
+    port: int = 9464
+    max_age_seconds: float = 0
+    results: dict = dataclasses.field(default_factory=dict)
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+    server: Any = None
+
+    def __post_init__(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        sink = self
+
+        class metrics_handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = sink.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", openmetrics_content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                logging.debug(f"OpenMetrics request: {fmt % args}")
+
+        self.server = ThreadingHTTPServer((self.address, self.port), metrics_handler)
+        self.server.daemon_threads = True
+        threading.Thread(
+            target=self.server.serve_forever, name="openmetrics", daemon=True
+        ).start()
+        logging.info(f"Serving OpenMetrics on [{self.address}:{self.server.server_port}/metrics]")
+
+    def publish(
+        self, report_doc: check_result_document, location: str = None, collection: str = None
+    ):
+        labels = dict(
+            collection=collection or "",
+            location=location or "",
+            item_id=report_doc.id,
+            item_name=report_doc.name,
+        )
+        values = dict(urlmonitor_check_success=1 if report_doc.test_success else 0)
+        if report_doc.response:
+            values["urlmonitor_response_status_code"] = report_doc.response.code
+            values["urlmonitor_response_time_seconds"] = report_doc.response.responseTime / 1000
+        if report_doc.ssl and report_doc.ssl.host_cert:
+            values["urlmonitor_certificate_expiry_days"] = report_doc.ssl.today_until_expired_days
+        label_text = ",".join(f'{k}="{get_openmetrics_label(v)}"' for k, v in labels.items())
+        with self.lock:
+            self.results[(labels["collection"], labels["location"], report_doc.id)] = (
+                label_text,
+                values,
+                time.monotonic(),
+            )
+
+    def prune(self):
+        if self.max_age_seconds <= 0:
+            return
+        oldest = time.monotonic() - self.max_age_seconds
+        with self.lock:
+            expired = [key for key, (_, _, published) in self.results.items() if published < oldest]
+            for key in expired:
+                del self.results[key]
+        if expired:
+            logging.debug(f"Dropped [{len(expired)}] expired OpenMetrics results")
+
+    def flush(self):
+        self.prune()
 
+    def render(self) -> str:
+        self.prune()
+        with self.lock:
+            results = list(self.results.values())
+        lines = []
+        for family, help_text in openmetrics_families:
+            lines.append(f"# TYPE {family} gauge")
+            lines.append(f"# HELP {family} {help_text}")
+            if family.endswith("_seconds"):
+                lines.append(f"# UNIT {family} seconds")
+            for label_text, values, _ in results:
+                if family in values:
+                    lines.append(f"{family}{{{label_text}}} {values[family]}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
 
-def process_pm_collection_report(data: dict, report_error_rc: int):
-    datastore = {}
-    if "run" not in data:
-        raise ValueError("PM Report object does not contain 'run' information.")
-    elif "collection" not in data:
-        raise ValueError("PM Report object does not contain 'collection' information.")
-    # extract collection item data
-    for coll_item in patch_report_collection_item_data(data.get("collection", {})):
-        check_item_doc = check_result_document(**coll_item)
-        datastore[check_item_doc.id] = check_item_doc
-    # handle failure output mixin
-    if report_error_rc > 0:
-        # TODO: determine special handling of report failures
-        logging.debug("extracting failures")
-        for fail in data.get("run", {}).get("failures", []):
-            fail_doc = pm_failure_result(**fail)
-            logging.warning(fail_doc)
-            if fail_doc.source.id in datastore:
-                update_check_item_doc(
-                    check_item_doc=datastore.get(fail_doc.source.id),
-                    pm_fail_doc=fail_doc,
+    def close(self, timeout: float = None):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+result_sink_names = ("appinsights", "ndjson", "openmetrics")
+
+
+def get_percentile(sorted_values: list, percentile: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    rank = max(1, math.ceil(percentile / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+@dataclasses.dataclass
+class item_history:
+    """Recent check results per item in a memory-mapped ring buffer file.
+
+    Every item takes a slot of window results, stored as arrays of
+    timestamps, response times, response codes and success flags, which is
+    found by the hash of the collection and item id. Collections sharing a
+    history keep apart results of items with the same id. Recording and reading the results of an
+    item does not depend on the number of items. Once all max_items slots are
+    taken, a new item takes over the slot of the item recorded longest ago, so
+    items removed from a collection give way to new ones. Slots are kept in
+    recording order for that, restored from the stored timestamps on start.
+    A file written with other dimensions is started over.
+    """
+
+    path: Path
+    window: int = 100
+    max_items: int = 10000
+    slots: collections.OrderedDict = dataclasses.field(default_factory=collections.OrderedDict)
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+    fp: Any = None
+    mm: mmap.mmap = None
+
+    def __post_init__(self):
+        self.path = Path(self.path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        size = history_header.size + self.max_items * self.slot_size
+        header = history_header.pack(history_magic, 1, self.max_items, self.window)
+        self.fp = self.path.open(mode="r+b" if self.path.is_file() else "w+b")
+        if self.fp.read(history_header.size) != header or self.path.stat().st_size != size:
+            logging.info(f"Starting result history [{self.path}] for [{self.max_items}] items of [{self.window}] results")
+            self.fp.truncate(0)
+            self.fp.truncate(size)
+            self.fp.seek(0)
+            self.fp.write(header)
+            self.fp.flush()
+        self.mm = mmap.mmap(self.fp.fileno(), size)
+        last_seen = []
+        for index in range(self.max_items):
+            key, position, count = history_slot_header.unpack_from(self.mm, self.get_offset(index))
+            if not count:
+                break
+            timestamp = struct.unpack_from(
+                "<d",
+                self.mm,
+                self.get_offset(index) + history_slot_header.size + (position - 1) % self.window * 8,
+            )[0]
+            last_seen.append((timestamp, index, key))
+        # slots are kept least recently recorded first
+        for _, index, key in sorted(last_seen):
+            self.slots[key] = index
+
+    @property
+    def slot_size(self) -> int:
+        # timestamps, response times, codes and success flags, 8 byte aligned
+        size = history_slot_header.size + self.window * (8 + 4 + 2 + 1)
+        return (size + 7) // 8 * 8
+
+    def get_offset(self, index: int) -> int:
+        return history_header.size + index * self.slot_size
+
+    def get_key(self, item_id: str, collection: str = None) -> bytes:
+        if collection:
+            item_id = f"{collection}\0{item_id}"
+        return hashlib.md5(item_id.encode("utf-8")).digest()
+
+    def read_array(self, typecode: str, offset: int) -> array.array:
+        values = array.array(typecode)
+        values.frombytes(self.mm[offset : offset + self.window * values.itemsize])
+        return values
+
+    def record(
+        self,
+        item_id: str,
+        code: int,
+        response_time: float,
+        success: bool,
+        timestamp: float = None,
+        collection: str = None,
+    ):
+        """Store a result, response_time is None for results without response."""
+        key = self.get_key(item_id, collection)
+        with self.lock:
+            index = self.slots.get(key)
+            if index is not None:
+                self.slots.move_to_end(key)
+            else:
+                if len(self.slots) >= self.max_items:
+                    _, index = self.slots.popitem(last=False)
+                    logging.debug(f"Result history is full, item [{item_id}] takes the slot of the item recorded longest ago")
+                else:
+                    index = len(self.slots)
+                self.slots[key] = index
+                history_slot_header.pack_into(self.mm, self.get_offset(index), key, 0, 0)
+            timestamp = timestamp or time.time()
+            offset = self.get_offset(index)
+            _, position, count = history_slot_header.unpack_from(self.mm, offset)
+            offset += history_slot_header.size
+            struct.pack_into("<d", self.mm, offset + position * 8, timestamp)
+            offset += self.window * 8
+            struct.pack_into("<f", self.mm, offset + position * 4, -1 if response_time is None else response_time)
+            offset += self.window * 4
+            struct.pack_into("<H", self.mm, offset + position * 2, code or 0)
+            offset += self.window * 2
+            struct.pack_into("<B", self.mm, offset + position, 1 if success else 0)
+            history_slot_header.pack_into(
+                self.mm,
+                self.get_offset(index),
+                key,
+                (position + 1) % self.window,
+                min(count + 1, self.window),
+            )
+
+    def get_stats(self, item_id: str, collection: str = None) -> dict:
+        """Response time percentiles and success ratio of the stored results of an item."""
+        with self.lock:
+            index = self.slots.get(self.get_key(item_id, collection))
+            if index is None:
+                return None
+            offset = self.get_offset(index)
+            _, _, count = history_slot_header.unpack_from(self.mm, offset)
+            offset += history_slot_header.size + self.window * 8
+            response_times = self.read_array("f", offset)[:count]
+            offset += self.window * (4 + 2)
+            successes = self.read_array("B", offset)[:count]
+        latencies = sorted(value for value in response_times if value >= 0)
+        stats = dict(
+            samples=count,
+            latency_samples=len(latencies),
+            success_ratio=sum(successes) / count,
+            p50=None,
+            p95=None,
+            p99=None,
+        )
+        if latencies:
+            for percentile in (50, 95, 99):
+                stats[f"p{percentile}"] = get_percentile(latencies, percentile)
+        return stats
+
+    def close(self):
+        with self.lock:
+            if self.mm:
+                self.mm.flush()
+                self.mm.close()
+                self.mm = None
+            if self.fp:
+                self.fp.close()
+                self.fp = None
+
+
+@dataclasses.dataclass
+class urlcheck_settings:
+    ai_instrumentation_key: str
+    pm_collection_url: str
+    nm_timeout_collection: int = 300000
+    nm_timeout_request: int = 5000
+    nm_timeout_script: int = 5000
+    certificate_validation_check: bool = True
+    certificate_ignore_self_signed: bool = False
+    certificate_check_expiration: bool = True
+    certificate_expiration_gracetime_days: int = 14
+    location: str = None
+    auto_location_test_hostinfo: str = "1.1.1.1:53:UDP"
+    verbosity: int = None
+    rc_range: Tuple[int, int] = (None, None)
+    rc_list: List[int] = dataclasses.field(default_factory=lambda: [200])
+    daemon: bool = False
+    test_frequency_minutes: int = 5
+    shards: int = 1
+    shard_mode: ShardMode = ShardMode.folder
+    engine: Engine = Engine.newman
+    native_concurrency: int = 20
+    certificate_concurrency: int = 16
+    certificate_stage_deadline: float = 120.0
+    certificate_cache_file: Path = None
+    certificate_cache_ttl_minutes: float = 0
+    certificate_cache_error_ttl_minutes: float = 5
+    crl_cache_dir: Path = None
+    collection_cache_dir: Path = None
+    incremental: bool = False
+    ai_ingestion_endpoint: str = ai_ingestion_endpoint
+    telemetry_drain_timeout: float = 60.0
+    telemetry_spool_dir: Path = None
+    telemetry_spool_max_mb: int = 256
+    telemetry_replay_rate: float = 500.0
+    profile: Path = None
+    collection_manifest: str = None
+    collection_concurrency: int = 4
+    schedule_tick_seconds: float = 0
+    schedule_jitter: float = 0.1
+    item_intervals_file: Path = None
+    timing_phases: bool = False
+    confirm_retries: int = 0
+    confirm_delay_seconds: float = 5.0
+    history_file: Path = None
+    history_window: int = 100
+    history_max_items: int = 10000
+    latency_regression_factor: float = 0
+    newman_worker: bool = False
+    newman_worker_max_runs: int = 50
+    host_max_in_flight: int = 0
+    host_rate_limit: float = 0
+    host_rate_burst: int = 1
+    sink: str = "appinsights"
+    ndjson_file: Path = None
+    ndjson_max_mb: int = 100
+    ndjson_backups: int = 5
+    openmetrics_address: str = "0.0.0.0"
+    openmetrics_port: int = 9464
+    openmetrics_max_age_seconds: float = 0
+
+    def get_sink_names(self) -> list:
+        return [name.strip().lower() for name in self.sink.split(",") if name.strip()]
+
+    def get_acceptable_response_codes(self) -> list:
+        rc_accept_list = []
+        (rc_range_start, rc_range_end) = self.rc_range
+        if rc_range_start and rc_range_end:
+            rc_accept_list = list(range(rc_range_start, rc_range_end))
+        if self.rc_list:
+            rc_accept_list.extend(self.rc_list)
+        return list(set(rc_accept_list))
+
+
+@dataclasses.dataclass
+class monitor_state:
+    """Long-lived objects kept warm between check cycles of one process."""
+
+    settings: urlcheck_settings
+    tc: "TelemetryClient" = None
+    location: str = None
+    cert_cache: sslcert_cache = None
+    crl_index: crl_revocation_index = None
+    collection_loader: pm_collection_loader = None
+    telemetry_sender: batched_telemetry_sender = None
+    publish_lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+    item_schedule: pm_item_schedule = None
+    history: item_history = None
+    worker: newman_worker = None
+    limiter: host_limiter = None
+    sinks: list = None
+    cert_executor: sslcert_executor = None
+
+    def __post_init__(self):
+        if not self.location:
+            self.location = self.settings.location
+        if not self.location:
+            self.location = estimate_location(self.settings.auto_location_test_hostinfo)
+        if not self.sinks:
+            self.sinks = self.create_sinks()
+        if not self.cert_cache:
+            self.cert_cache = sslcert_cache(
+                path=self.settings.certificate_cache_file,
+                ttl_seconds=self.settings.certificate_cache_ttl_minutes * 60,
+                error_ttl_seconds=self.settings.certificate_cache_error_ttl_minutes * 60,
+            )
+        if not self.limiter:
+            self.limiter = host_limiter(
+                max_in_flight=self.settings.host_max_in_flight,
+                rate=self.settings.host_rate_limit,
+                burst=self.settings.host_rate_burst,
+            )
+        if not self.cert_executor:
+            self.cert_executor = sslcert_executor(
+                max_workers=self.settings.certificate_concurrency
+            )
+        if not self.crl_index:
+            self.crl_index = crl_revocation_index(
+                cache_dir=self.settings.crl_cache_dir, limiter=self.limiter
+            )
+        if not self.collection_loader:
+            self.collection_loader = pm_collection_loader(
+                cache_dir=self.settings.collection_cache_dir
+            )
+        if not self.history and self.settings.history_file:
+            self.history = item_history(
+                path=self.settings.history_file,
+                window=self.settings.history_window,
+                max_items=self.settings.history_max_items,
+            )
+        if not self.worker and self.settings.newman_worker:
+            self.worker = newman_worker(max_runs=self.settings.newman_worker_max_runs)
+        if not self.item_schedule and self.settings.schedule_tick_seconds > 0:
+            overrides = {}
+            if self.settings.item_intervals_file:
+                with Path(self.settings.item_intervals_file).open(mode="r") as fp:
+                    overrides = json.load(fp)
+            self.item_schedule = pm_item_schedule(
+                default_interval_seconds=self.settings.test_frequency_minutes * 60,
+                jitter=self.settings.schedule_jitter,
+                overrides=overrides,
+            )
+
+    def create_sinks(self) -> list:
+        sink_names = self.settings.get_sink_names()
+        sinks = []
+        if "appinsights" in sink_names:
+            if not self.telemetry_sender:
+                self.telemetry_sender = batched_telemetry_sender(
+                    endpoint=self.settings.ai_ingestion_endpoint,
+                    spool=telemetry_spool(
+                        path=self.settings.telemetry_spool_dir,
+                        max_bytes=self.settings.telemetry_spool_max_mb << 20,
+                    )
+                    if self.settings.telemetry_spool_dir
+                    else None,
+                    max_replay_items_per_second=self.settings.telemetry_replay_rate,
+                )
+            if not self.tc:
+                self.tc = create_telemetry_client(
+                    self.settings.ai_instrumentation_key, self.telemetry_sender
+                )
+            sinks.append(appinsights_sink(sender=self.telemetry_sender, tc=self.tc))
+        if "ndjson" in sink_names:
+            sinks.append(
+                ndjson_sink(
+                    path=self.settings.ndjson_file,
+                    max_bytes=self.settings.ndjson_max_mb << 20,
+                    backups=self.settings.ndjson_backups,
                 )
-    # extract execution data
-    for exec_item in data.get("run", {}).get("executions", []):
-        pm_exec_result_doc = pm_execution_result(**exec_item)
-        if pm_exec_result_doc.id not in datastore:
-            logging.critical(
-                "This should not happen, no ITEM ID found in datastore for execution item."
             )
-            raise typer.Exit(RC.BASIC)
-        else:
-            # merge in fields extracted from data
+        if "openmetrics" in sink_names:
+            sinks.append(
+                openmetrics_sink(
+                    address=self.settings.openmetrics_address,
+                    port=self.settings.openmetrics_port,
+                    max_age_seconds=self.settings.openmetrics_max_age_seconds
+                    or 3 * self.settings.test_frequency_minutes * 60,
+                )
+            )
+        return sinks
+
+    def publish(self, report_doc: check_result_document, collection: str = None):
+        for sink in self.sinks:
+            sink.publish(report_doc, location=self.location, collection=collection)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def take_due(self, data: dict) -> dict:
+        """Sub-collection of the items due in this cycle, all items without a schedule."""
+        if not self.item_schedule:
+            return data
+        return self.item_schedule.take_due(data)
+
+    def get_item_table(self, data: dict) -> pm_item_table:
+        if data is self.collection_loader.data:
+            return self.collection_loader.get_item_table()
+        if self.item_schedule and data is self.item_schedule.taken:
+            # due items are looked up in the table of the whole collection
+            return self.collection_loader.get_item_table().subset(data, self.item_schedule.due)
+        return get_pm_item_table(data)
+
+    def for_collection(self, settings: urlcheck_settings) -> "monitor_state":
+        """State of another collection sharing the sinks, caches and location."""
+        return monitor_state(
+            settings=settings,
+            tc=self.tc,
+            location=self.location,
+            cert_cache=self.cert_cache,
+            crl_index=self.crl_index,
+            telemetry_sender=self.telemetry_sender,
+            publish_lock=self.publish_lock,
+            history=self.history,
+            worker=self.worker,
+            limiter=self.limiter,
+            sinks=self.sinks,
+            cert_executor=self.cert_executor,
+        )
+
+    def close(self, telemetry_drain_timeout: float = 60.0):
+        """Send the remaining telemetry and stop the helpers kept between cycles."""
+        if self.worker:
+            self.worker.close()
+        if self.cert_executor:
+            self.cert_executor.close()
+        if self.history:
+            self.history.close()
+        for sink in self.sinks:
+            sink.close(timeout=telemetry_drain_timeout)
+
+
+@dataclasses.dataclass
+class cycle_stats:
+    cycle: int
+    started: float
+    duration: float = 0.0
+    schedule_lag: float = 0.0
+    overrun: bool = False
+    skipped_cycles: int = 0
+    failed: bool = False
+
+
+@dataclasses.dataclass
+class cycle_metrics:
+    """Stage timings, item counts and resource usage of one check cycle."""
+
+    collection: str = None
+    location: str = None
+    stages: dict = dataclasses.field(default_factory=dict)
+    counts: dict = dataclasses.field(default_factory=dict)
+    resources: dict = dataclasses.field(default_factory=dict)
+    usage: child_process_usage = dataclasses.field(default_factory=child_process_usage)
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def track_child_usage(self):
+        """Add the usage of the newman subprocesses, if the cycle ran any."""
+        if not self.usage.processes:
+            return
+        self.resources["newman_processes"] = self.usage.processes
+        self.resources["newman_cpu_ms"] = self.usage.cpu_seconds * 1000
+        self.resources["newman_peak_rss_mib"] = self.usage.peak_rss_kib / 1024
+
+    def to_dict(self) -> dict:
+        return dict(
+            collection=self.collection,
+            location=self.location,
+            stages_ms={name: seconds * 1000 for name, seconds in self.stages.items()},
+            counts=self.counts,
+            resources=self.resources,
+        )
+
+
+def track_host_queue_stats(metrics: cycle_metrics, queue_stats: host_queue_stats):
+    """Counters of the time requests waited for the host limits, not spent on the host."""
+    metrics.counts["host_queued"] = queue_stats.queued
+    metrics.counts["host_queue_wait_ms_total"] = queue_stats.wait_seconds * 1000
+    metrics.counts["host_queue_max_ms"] = queue_stats.max_seconds * 1000
+
+
+def get_collection_label(ref: str) -> str:
+    """Collection reference without credentials or query string, used as metric tag."""
+    parsed = urllib.parse.urlsplit(ref)
+    if parsed.scheme in ("http", "https"):
+        return f"{parsed.scheme}://{parsed.hostname}{parsed.path}"
+    return ref
+
+
+def evaluate_check_result(
+    check_item_doc: check_result_document,
+    settings: urlcheck_settings,
+    sslcert_report_data: dict = None,
+    history: item_history = None,
+):
+    if settings.certificate_validation_check:
+        hostinfo_hashed = check_item_doc.host_key or check_item_doc.request.url.hostinfo_hashed
+        if sslcert_report_data and hostinfo_hashed in sslcert_report_data:
             update_check_item_doc(
-                check_item_doc=datastore.get(pm_exec_result_doc.id),
-                pm_exec_doc=pm_exec_result_doc,
+                check_item_doc=check_item_doc,
+                sslcert_doc=sslcert_report_data.get(hostinfo_hashed),
             )
-    return datastore
+        check_item_doc.validate_certificate(
+            self_signed_invalid=not settings.certificate_ignore_self_signed,
+            check_expiration=settings.certificate_check_expiration,
+            expiration_gracetime_days=settings.certificate_expiration_gracetime_days,
+        )
 
+    if history:
+        # items of collections with the same layout have the same ids
+        collection = get_collection_label(settings.pm_collection_url)
+        check_item_doc.history = history.get_stats(check_item_doc.id, collection=collection)
+        check_item_doc.validate_latency(factor=settings.latency_regression_factor)
 
-def pm_collection_extract_urls(data: dict) -> list:
-    collection = list()
-    if "item" in data:
-        for item in data.get("item", []):
-            collection.extend(pm_collection_extract_urls(item))
-    elif "request" in data:
-        request_url = data.get("request").get("url")
-        if not request_url:
-            return collection
-        if isinstance(request_url, dict):
-            url_doc = pm_request_url(**data.get("request").get("url"))
-        elif isinstance(request_url, str):
-            url_doc = pm_request_url(**dict(raw=request_url))
-        collection.append(url_doc)
-    return collection
+    check_item_doc.validate_test_report(
+        acceptable_response_codes=settings.get_acceptable_response_codes(),
+        include_ssl_test_results=settings.certificate_validation_check,
+    )
 
 
-def is_self_signed_cert(cert: x509.Certificate) -> bool:
-    """Using heuristic check for self-signed certificates.
-    Details described in: https://www.rfc-editor.org/rfc/rfc3280#section-4.2.1.1
-    Implementation hint reference:
-    https://security.stackexchange.com/questions/93162/how-to-know-if-certificate-is-self-signed
+def record_check_result(
+    check_item_doc: check_result_document,
+    settings: urlcheck_settings,
+    history: item_history = None,
+):
+    """Add the final result of an item in this cycle to its history.
+
+    Called once per item after confirmation, earlier attempts are not kept.
     """
-    auth_key_id = None
-    subj_key_id = None
-    for ext in cert.extensions:
-        if isinstance(ext.value, x509.AuthorityKeyIdentifier):
-            auth_key_id = ext.value.key_identifier
-        if isinstance(ext.value, x509.SubjectKeyIdentifier):
-            subj_key_id = ext.value.key_identifier
-    if auth_key_id and subj_key_id:
-        return auth_key_id == subj_key_id
-    elif not auth_key_id:
-        # valid CAs need to provide AuthenticationKeyIdentifier, so this is self-signed
-        return True
-    else:
-        # anything else we don't cover yet
-        logging.warning("SSL check heuristic dead end. Check Implementation!")
-        raise typer.Exit(RC.OTHER)
+    if not history:
+        return
+    history.record(
+        check_item_doc.id,
+        code=check_item_doc.response.code if check_item_doc.response else 0,
+        response_time=check_item_doc.response.responseTime
+        if check_item_doc.response
+        else None,
+        success=check_item_doc.test_success,
+        collection=get_collection_label(settings.pm_collection_url),
+    )
 
 
-def retrieve_server_certificates(urls: list, ssl_timeout: float = 5.0) -> dict:
-    results = {}
-    for url in urls:
-        if url.hostinfo_hashed in results:
-            continue
-        # retrieve host cert without verification
-        address = (url.url_parsed.hostname, url.url_parsed.port)
-        try:
-            host_pem = ssl.get_server_certificate(address, timeout=ssl_timeout)
-            host_cert = x509.load_pem_x509_certificate(host_pem.encode("utf-8"))
-            results[url.hostinfo_hashed] = sslcert_result_document(
-                url=url,
-                host_cert=host_cert,
+def confirm_failed_results(
+    datastore: dict,
+    data: dict,
+    settings: urlcheck_settings,
+    sslcert_report_data: dict,
+    run_kwargs: dict,
+    history: item_history = None,
+) -> dict:
+    """Run failed items again to confirm their failure before it is published.
+
+    Items that did not fail on their certificate are retried after
+    confirm_delay_seconds, up to confirm_retries times or until they succeed.
+    The result of the last attempt replaces the earlier one in the datastore.
+    The collection data must hold the item ids used in the datastore.
+    """
+    for attempt in range(2, settings.confirm_retries + 2):
+        failed_ids = {
+            doc.id
+            for doc in datastore.values()
+            if not doc.test_success
+            and (doc.test_ssl_success or not settings.certificate_validation_check)
+        }
+        if not failed_ids:
+            break
+        retry_data = filter_pm_collection(data, lambda leaf: leaf.get("id") in failed_ids)
+        if retry_data is None:
+            break
+        logging.info(f"Confirming [{len(failed_ids)}] failed items, attempt [{attempt}]")
+        time.sleep(settings.confirm_delay_seconds)
+        pm_test_results, error_rc, _ = run_pm_collection_engines(retry_data, **run_kwargs)
+        for check_item_doc in process_pm_collection_report(pm_test_results, error_rc).values():
+            if check_item_doc.id not in failed_ids:
+                continue
+            evaluate_check_result(check_item_doc, settings, sslcert_report_data, history)
+            check_item_doc.attempts = attempt
+            datastore[check_item_doc.id] = check_item_doc
+    return datastore
+
+
+def run_check_cycle(
+    state: monitor_state, data: dict = None, sslcert_report_data: dict = None
+) -> cycle_metrics:
+    """Run one check cycle of the collection of state.
+
+    The collection and certificate results are loaded and retrieved, unless
+    they are passed in, as done by run_check_cycles for several collections.
+    """
+    settings = state.settings
+    logging.info(f"Starting test run for collection url: [{settings.pm_collection_url}]")
+    metrics = cycle_metrics(
+        collection=get_collection_label(settings.pm_collection_url),
+        location=state.location,
+    )
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    crl_fetches_before = (state.crl_index.fetches, state.crl_index.fetch_seconds)
+    queue_stats = state.limiter.open_window()
+    try:
+        if data is None:
+            with metrics.stage("collection_load"):
+                data = state.take_due(state.collection_loader.load(settings.pm_collection_url))
+            if data is None:
+                logging.info("No items due in this cycle")
+                return metrics
+        with metrics.stage("compile"):
+            # items without an id get a fixed one, so confirmation runs and
+            # the history find them again
+            item_table = state.get_item_table(data)
+            data = item_table.data
+        if sslcert_report_data is None and settings.certificate_validation_check:
+            with metrics.stage("certificates"):
+                pm_url_list = item_table.get_urls()
+                sslcert_report_data = retrieve_server_certificates(
+                    pm_url_list,
+                    concurrency=settings.certificate_concurrency,
+                    deadline=settings.certificate_stage_deadline,
+                    cache=state.cert_cache,
+                    crl_index=state.crl_index,
+                    limiter=state.limiter,
+                    executor=state.cert_executor,
+                )
+            metrics.counts["hosts"] = len(sslcert_report_data)
+            metrics.counts["crl_fetches"] = state.crl_index.fetches - crl_fetches_before[0]
+            metrics.stages["crl_fetch"] = state.crl_index.fetch_seconds - crl_fetches_before[1]
+        sslcert_report_data = sslcert_report_data or {}
+
+        run_kwargs = dict(
+            engine=settings.engine,
+            native_concurrency=settings.native_concurrency,
+            shards=settings.shards,
+            shard_mode=settings.shard_mode,
+            nm_timeout_collection=settings.nm_timeout_collection,
+            nm_timeout_request=settings.nm_timeout_request,
+            nm_timeout_script=settings.nm_timeout_script,
+            nm_verbose=settings.timing_phases,
+            nm_worker=state.worker,
+            limiter=state.limiter,
+            usage=metrics.usage,
+        )
+        if settings.incremental:
+            # evaluate and publish every result as soon as it is available,
+            # failures waiting for confirmation are published after the run
+            published = []
+            failed = []
+            unconfirmed = {}
+
+            def publish_result(check_item_doc: check_result_document):
+                record_check_result(check_item_doc, settings, state.history)
+                state.publish(check_item_doc, collection=metrics.collection)
+                published.append(check_item_doc.id)
+                if not check_item_doc.test_success:
+                    failed.append(check_item_doc.id)
+                if len(published) % 100 == 0:
+                    state.flush()
+
+            def on_result(check_item_doc: check_result_document):
+                item_table.annotate(check_item_doc)
+                with state.publish_lock:
+                    evaluate_check_result(
+                        check_item_doc, settings, sslcert_report_data, state.history
+                    )
+                    if settings.confirm_retries > 0 and not check_item_doc.test_success:
+                        unconfirmed[check_item_doc.id] = check_item_doc
+                    else:
+                        publish_result(check_item_doc)
+
+            with metrics.stage("test_run"):
+                run_pm_collection_incremental(data, on_result, **run_kwargs)
+            if unconfirmed:
+                with metrics.stage("confirmation"):
+                    confirm_failed_results(
+                        unconfirmed,
+                        data,
+                        settings,
+                        sslcert_report_data,
+                        run_kwargs,
+                        history=state.history,
+                    )
+            with metrics.stage("publish"), state.publish_lock:
+                for check_item_doc in unconfirmed.values():
+                    publish_result(check_item_doc)
+                state.flush()
+            metrics.counts["items"] = len(published)
+            metrics.counts["failed_items"] = len(failed)
+            metrics.counts["retried_items"] = sum(
+                1 for doc in unconfirmed.values() if doc.attempts > 1
             )
-        except OSError as ex:
-            results[url.hostinfo_hashed] = sslcert_result_document(
-                error_code=int(ex.errno) if ex.errno else RC.BASIC,
-                error_type=str(type(ex).__name__),
-                error_msg_raw=ex.strerror,
+        else:
+            with metrics.stage("test_run"):
+                pm_test_results, error_rc, _ = run_pm_collection_engines(data, **run_kwargs)
+            with metrics.stage("report_processing"):
+                pm_report_data = process_pm_collection_report(
+                    pm_test_results, error_rc, item_table=item_table
+                )
+
+            # evaluate report data
+            with metrics.stage("evaluation"):
+                for test_report_doc in pm_report_data.values():
+                    evaluate_check_result(
+                        test_report_doc, settings, sslcert_report_data, state.history
+                    )
+            if settings.confirm_retries > 0:
+                with metrics.stage("confirmation"):
+                    confirm_failed_results(
+                        pm_report_data,
+                        data,
+                        settings,
+                        sslcert_report_data,
+                        run_kwargs,
+                        history=state.history,
+                    )
+
+            for test_report_doc in pm_report_data.values():
+                record_check_result(test_report_doc, settings, state.history)
+
+            # publish report data
+            with metrics.stage("publish"), state.publish_lock:
+                publish_results(
+                    data=pm_report_data,
+                    sinks=state.sinks,
+                    location=state.location,
+                    collection=metrics.collection,
+                )
+            metrics.counts["items"] = len(pm_report_data)
+            metrics.counts["failed_items"] = sum(
+                1 for doc in pm_report_data.values() if not doc.test_success
             )
-        except Exception as ex:
-            results[url.hostinfo_hashed] = sslcert_result_document(
-                error_code=RC.OTHER,
-                error_type=str(type(ex).__name__),
-                error_msg_raw=str(ex),
+            metrics.counts["retried_items"] = sum(
+                1 for doc in pm_report_data.values() if doc.attempts > 1
             )
-    return results
+        logging.info(f"Reached end of run for collection url: [{settings.pm_collection_url}]")
+    finally:
+        state.limiter.close_window(queue_stats)
+        if state.limiter.is_enabled():
+            track_host_queue_stats(metrics, queue_stats)
+        usage_after = resource.getrusage(resource.RUSAGE_SELF)
+        metrics.resources["cycle_cpu_ms"] = (
+            (usage_after.ru_utime - usage_before.ru_utime)
+            + (usage_after.ru_stime - usage_before.ru_stime)
+        ) * 1000
+        metrics.resources["peak_rss_mib"] = usage_after.ru_maxrss / 1024
+        metrics.track_child_usage()
+        with state.publish_lock:
+            track_cycle_metrics(metrics, sinks=state.sinks)
+    return metrics
 
 
-def estimate_location(auto_location_test_hostinfo: str) -> str:
-    """Returns an IP-Address used to communicate to external endpoints."""
+def load_collection_manifest(ref: str, settings: urlcheck_settings) -> list:
+    """Settings of every collection listed in the manifest at ref.
 
-    logging.info(
-        f"Determining location from test connection to [{auto_location_test_hostinfo}]"
-    )
-    host_info_parts = auto_location_test_hostinfo.split(":")
-    host, port, *_ = tuple(host_info_parts)
-    proto = "TCP"
-    if len(host_info_parts) > 2:
-        proto = host_info_parts[2].upper()
-    port = int(port)
-    ip = ipaddress.ip_address(host)
+    The manifest is a json list of collection references, or of objects with
+    a pm_collection_url and the settings of collection_setting_names to use
+    for this collection instead of the command line ones.
+    """
+    manifest = load_pm_collection(ref)
+    if isinstance(manifest, dict):
+        manifest = manifest.get("collections", [])
+    collection_settings = []
+    for entry in manifest:
+        if isinstance(entry, str):
+            entry = dict(pm_collection_url=entry)
+        unknown = set(entry) - set(collection_setting_names)
+        if unknown or not entry.get("pm_collection_url"):
+            typer.echo(f"Invalid collection manifest entry {entry}, unknown settings: {sorted(unknown)}")
+            raise typer.Exit(RC.BASIC)
+        entry_settings = dataclasses.replace(settings, **entry)
+        entry_settings.engine = Engine(entry_settings.engine)
+        entry_settings.shard_mode = ShardMode(entry_settings.shard_mode)
+        entry_settings.rc_range = tuple(entry_settings.rc_range)
+        collection_settings.append(entry_settings)
+    return collection_settings
 
-    if isinstance(ip, ipaddress.IPv4Address):
-        sock_fam = socket.AF_INET
-    elif isinstance(ip, ipaddress.IPv6Address):
-        sock_fam = socket.AF_INET6
-    else:
-        raise ValueError("Require valid IP address in test hostinfo.")
 
-    if proto in ["UDP", "TCP"]:
-        sock_proto = socket.IPPROTO_UDP if proto == "UDP" else socket.IPPROTO_TCP
-        sock_type = socket.SOCK_DGRAM if proto == "UDP" else socket.SOCK_STREAM
-    else:
-        raise ValueError("Required protocol not found in test hostinfo.")
+def run_check_cycles(states: list, concurrency: int = 4) -> list:
+    """Run one check cycle of several collections concurrently.
 
-    s = socket.socket(sock_fam, sock_type, sock_proto)
-    s.connect((str(ip), port))
-    socket_source_ip = ipaddress.ip_address(s.getsockname()[0])
-    return str(socket_source_ip)
+    Certificates of the hosts of all collections are retrieved once up front,
+    so hosts shared between collections only get one TLS handshake. A failing
+    collection does not stop the others.
+    """
+    shared_state = states[0]
+    shared_metrics = cycle_metrics(collection="all", location=shared_state.location)
+    pool = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(states))))
+    try:
+        errors = []
 
+        def load(state: monitor_state):
+            try:
+                return state.take_due(state.collection_loader.load(state.settings.pm_collection_url))
+            except (Exception, typer.Exit) as ex:
+                logging.error(f"Loading collection [{state.settings.pm_collection_url}] failed: {ex!r}")
+                errors.append(ex)
+                return None
 
-def sanitize_appinsights(payload: dict) -> dict:
-    """
-    Mitigate AppInsights submission restrictions:
-    name: 1-64, 0-1A-Za-z, hyphen, space, needs to start with char
+        with shared_metrics.stage("collection_load"):
+            collection_data = list(pool.map(load, states))
+        loaded = [
+            (state, data) for state, data in zip(states, collection_data) if data is not None
+        ]
+
+        pm_url_list = []
+        for state, data in loaded:
+            if state.settings.certificate_validation_check:
+                pm_url_list.extend(state.get_item_table(data).get_urls())
+        sslcert_report_data = {}
+        if pm_url_list:
+            crl_fetches_before = (shared_state.crl_index.fetches, shared_state.crl_index.fetch_seconds)
+            queue_stats = shared_state.limiter.open_window()
+            try:
+                with shared_metrics.stage("certificates"):
+                    sslcert_report_data = retrieve_server_certificates(
+                        pm_url_list,
+                        concurrency=shared_state.settings.certificate_concurrency,
+                        deadline=shared_state.settings.certificate_stage_deadline,
+                        cache=shared_state.cert_cache,
+                        crl_index=shared_state.crl_index,
+                        limiter=shared_state.limiter,
+                        executor=shared_state.cert_executor,
+                    )
+            finally:
+                shared_state.limiter.close_window(queue_stats)
+            shared_metrics.counts["hosts"] = len(sslcert_report_data)
+            shared_metrics.counts["crl_fetches"] = shared_state.crl_index.fetches - crl_fetches_before[0]
+            shared_metrics.stages["crl_fetch"] = shared_state.crl_index.fetch_seconds - crl_fetches_before[1]
+            if shared_state.limiter.is_enabled():
+                track_host_queue_stats(shared_metrics, queue_stats)
+        shared_metrics.counts["collections"] = len(loaded)
+        with shared_state.publish_lock:
+            track_cycle_metrics(shared_metrics, sinks=shared_state.sinks)
+
+        def run(state_data: Tuple):
+            state, data = state_data
+            try:
+                return run_check_cycle(state, data=data, sslcert_report_data=sslcert_report_data)
+            except (Exception, typer.Exit) as ex:
+                logging.error(f"Checking collection [{state.settings.pm_collection_url}] failed: {ex!r}")
+                errors.append(ex)
+                return None
+
+        results = [metrics for metrics in pool.map(run, loaded) if metrics]
+    finally:
+        pool.shutdown(wait=True)
+    if errors:
+        logging.error(f"[{len(errors)}] of [{len(states)}] collections failed")
+        raise typer.Exit(RC.OTHER)
+    return results
+
+
+def run_scheduled(
+    cycle: Callable[[], Any],
+    interval_seconds: float,
+    on_cycle_done: Callable[[cycle_stats], Any] = None,
+    stop_event: threading.Event = None,
+):
+    """Run cycle at a fixed cadence until stop_event is set.
+
+    Cycle start times are aligned to the first start, so a slow cycle does not
+    shift the whole schedule. A cycle running longer than the interval is an
+    overrun, the missed start slots are skipped instead of being run back to back.
     """
-    name = str(payload.get("name"))
-    name = name.replace("/", "--")
-    name = re.sub(r"(?:[^a-zA-Z\d\ \-])", " ", name)
-    name = re.sub(r"(\ )+", r"\1", name)
-    name = re.sub(r"(\-\-)+", r"\1", name)
-    name = name.strip()
-    if re.match(r"^[^a-zA-Z]", name):
-        name = re.sub(r"^([^\w]+)(.+)", r"\2", name)
-    if len(name) > 64:
-        name = f"{name[:-3]}..."
-    payload.update(dict(name=name))
-    return payload
+    if not stop_event:
+        stop_event = threading.Event()
+    next_start = time.monotonic()
+    cycle_num = 0
+    while not stop_event.is_set():
+        cycle_num += 1
+        started = time.monotonic()
+        stats = cycle_stats(
+            cycle=cycle_num, started=started, schedule_lag=started - next_start
+        )
+        logging.info(
+            f"Starting cycle [{cycle_num}] with scheduling lag [{stats.schedule_lag:.3f}]s"
+        )
+        try:
+            cycle()
+        except typer.Exit as ex:
+            stats.failed = True
+            logging.error(f"Cycle [{cycle_num}] aborted with RC [{ex.exit_code}]")
+        except Exception:
+            stats.failed = True
+            logging.exception(f"Cycle [{cycle_num}] failed")
+        finished = time.monotonic()
+        stats.duration = finished - started
 
+        next_start += interval_seconds
+        if finished > next_start:
+            stats.overrun = True
+            stats.skipped_cycles = int((finished - next_start) // interval_seconds) + 1
+            next_start += stats.skipped_cycles * interval_seconds
+            logging.warning(
+                f"Cycle [{cycle_num}] took [{stats.duration:.3f}]s and overran the interval of [{interval_seconds}]s, skipping [{stats.skipped_cycles}] start slot(s)"
+            )
+        else:
+            logging.info(f"Cycle [{cycle_num}] finished in [{stats.duration:.3f}]s")
+        if on_cycle_done:
+            on_cycle_done(stats)
+        stop_event.wait(max(0.0, next_start - time.monotonic()))
 
-def publish_in_appinsights(data: dict, tc: TelemetryClient, location: str = None, flush_size: int = 100):
-    for counter, report_doc in enumerate(data.values(), start=1):
-        logging.debug(f"Preparing payload for document id: [{report_doc.id}]")
-        tc.context.operation.id = report_doc.id
-        payload = dict(
-            name=report_doc.name,
-            duration=report_doc.response.responseTime if report_doc.response else 0,
-            success=report_doc.test_success,
-            run_location=location,
-            message=" ".join(report_doc.test_messages),
-            properties=report_doc.get_result_properties(),
-        )
-        payload = sanitize_appinsights(payload)
-        logging.debug(f"Payload of document id [{report_doc.id}] follows:")
-        logging.debug(str(payload))
-        # send results
-        tc.track_availability(**payload)
-        logging.info(f"Report for document id [{report_doc.id}] submitted.")
-        if counter > 0 and counter % flush_size == 0:
-            # use a maximum batch size of flush_size items
-            logging.debug("Flush size reached, submitting queue now.")
-            tc.flush()
-            logging.debug("Flush done. Moving on.")
-    logging.debug("Flush app insights tracking queue")
-    tc.flush()
-    logging.debug("Flush done. End of batch submission.")
+
+def track_cycle_stats(
+    stats: cycle_stats,
+    sinks: list,
+    location: str = None,
+    sender: batched_telemetry_sender = None,
+):
+    properties = dict(monitor_type=monitor_type, run_location=location)
+    values = dict(
+        cycle_duration_ms=stats.duration * 1000,
+        cycle_schedule_lag_ms=stats.schedule_lag * 1000,
+        cycle_skipped=stats.skipped_cycles,
+    )
+    if sender:
+        sender_stats = sender.get_stats()
+        values["telemetry_queue_depth"] = sender_stats.get("queue_depth")
+        values["telemetry_send_latency_ms"] = sender_stats.get("last_send_latency_ms")
+        values["telemetry_dropped_items"] = sender_stats.get("dropped_items")
+        if "spool_bytes" in sender_stats:
+            values["telemetry_spool_bytes"] = sender_stats.get("spool_bytes")
+            values["telemetry_spool_dropped_items"] = sender_stats.get("spool_dropped_items")
+        logging.info(f"Telemetry sender stats: {sender_stats}")
+    for sink in sinks:
+        sink.track_metrics(values, properties)
+        sink.flush()
+
+
+def track_cycle_metrics(metrics: cycle_metrics, sinks: list):
+    properties = dict(
+        monitor_type=monitor_type,
+        run_location=metrics.location,
+        collection=metrics.collection,
+    )
+    values = {f"stage_{name}_ms": seconds * 1000 for name, seconds in metrics.stages.items()}
+    values.update(metrics.counts)
+    values.update(metrics.resources)
+    for sink in sinks:
+        sink.track_metrics(values, properties)
+        sink.flush()
+    # one structured line per cycle, independent of the log verbosity
+    typer.echo(json.dumps(dict(event="cycle_metrics", **metrics.to_dict())), err=True)
 
 
 @app.command()
 def urlcheck(
-    ai_instrumentation_key: str = typer.Option(..., envvar="AI_INSTRUMENTATION_KEY"),
-    pm_collection_url: str = typer.Option(..., envvar="PM_COLLECTION_URL"),
+    ai_instrumentation_key: str = typer.Option(default=None, envvar="AI_INSTRUMENTATION_KEY", help="Application Insights instrumentation key, required by the appinsights sink."),
+    pm_collection_url: str = typer.Option(default=None, envvar="PM_COLLECTION_URL"),
     nm_timeout_collection: int = typer.Option(
         default=300000, envvar="NM_TIMEOUT_COLLECTION"
     ),
@@ -733,6 +4712,50 @@ def urlcheck(
     verbosity: int = typer.Option(None, "-v", count=True),
     rc_range: Tuple[int, int] = typer.Option((None, None), help="Start (inclusive) End (exclusive) range of acceptable response codes for successful tests."),
     rc_list: List[int] = typer.Option([200], "-r", help="Acceptable response code. Multiple uses."),
+    daemon: bool = typer.Option(False, "--daemon", envvar="DAEMON", help="Keep running and repeat the test every TEST_FREQUENCY_MINUTES."),
+    test_frequency_minutes: int = typer.Option(default=5, envvar="TEST_FREQUENCY_MINUTES"),
+    shards: int = typer.Option(default=1, envvar="NM_SHARDS", help="Number of concurrent newman runs the collection is split into."),
+    shard_mode: ShardMode = typer.Option(default=ShardMode.folder, envvar="NM_SHARD_MODE", help="Split the collection by top level folder or by single request item."),
+    engine: Engine = typer.Option(default=Engine.newman, envvar="ENGINE", help="Run requests with newman, natively where possible (auto) or only natively (native), failing on items with scripts, auth settings or unresolved variables."),
+    native_concurrency: int = typer.Option(default=20, envvar="NATIVE_CONCURRENCY", help="Maximum concurrent requests of the native engine."),
+    certificate_concurrency: int = typer.Option(default=16, envvar="CERTIFICATE_CONCURRENCY", help="Maximum concurrent certificate retrievals."),
+    certificate_stage_deadline: float = typer.Option(default=120.0, envvar="CERTIFICATE_STAGE_DEADLINE", help="Seconds after which pending certificate retrievals are reported as timed out."),
+    certificate_cache_file: Path = typer.Option(default=None, envvar="CERTIFICATE_CACHE_FILE", help="File keeping certificate check results between runs."),
+    certificate_cache_ttl_minutes: float = typer.Option(default=0, envvar="CERTIFICATE_CACHE_TTL_MINUTES", help="Minutes certificate check results are reused. 0 disables the cache."),
+    certificate_cache_error_ttl_minutes: float = typer.Option(default=5, envvar="CERTIFICATE_CACHE_ERROR_TTL_MINUTES", help="Minutes failed certificate retrievals are reused."),
+    crl_cache_dir: Path = typer.Option(default=None, envvar="CRL_CACHE_DIR", help="Directory keeping downloaded CRLs until their next update."),
+    collection_cache_dir: Path = typer.Option(default=None, envvar="COLLECTION_CACHE_DIR", help="Directory keeping the last good copy of the collection."),
+    incremental: bool = typer.Option(False, "--incremental", envvar="INCREMENTAL", help="Evaluate and publish every result as soon as its request finished. Requires the ndjson newman reporter."),
+    ai_ingestion_endpoint: str = typer.Option(default=ai_ingestion_endpoint, envvar="AI_INGESTION_ENDPOINT", help="Application Insights ingestion endpoint."),
+    telemetry_drain_timeout: float = typer.Option(default=60.0, envvar="TELEMETRY_DRAIN_TIMEOUT", help="Seconds to wait for queued telemetry to be sent before exiting."),
+    telemetry_spool_dir: Path = typer.Option(default=None, envvar="TELEMETRY_SPOOL_DIR", help="Directory spooling telemetry to disk until it is sent."),
+    telemetry_spool_max_mb: int = typer.Option(default=256, envvar="TELEMETRY_SPOOL_MAX_MB", help="Size cap of the telemetry spool, the oldest items are dropped beyond it."),
+    telemetry_replay_rate: float = typer.Option(default=500.0, envvar="TELEMETRY_REPLAY_RATE", help="Maximum items per second sent from the telemetry spool."),
+    profile: Path = typer.Option(default=None, envvar="PROFILE_FILE", help="Write a cProfile/pstats dump of the run to this file."),
+    collection_manifest: str = typer.Option(default=None, envvar="PM_COLLECTION_MANIFEST", help="File or url of a json list of collections to check concurrently, with optional per-collection settings."),
+    collection_concurrency: int = typer.Option(default=4, envvar="COLLECTION_CONCURRENCY", help="Maximum collections of the manifest checked concurrently."),
+    schedule_tick_seconds: float = typer.Option(default=0, envvar="SCHEDULE_TICK_SECONDS", help="Check only the items due every this many seconds in daemon mode, using per-item intervals. 0 checks all items every TEST_FREQUENCY_MINUTES."),
+    schedule_jitter: float = typer.Option(default=0.1, envvar="SCHEDULE_JITTER", help="Fraction item intervals are randomly varied by to spread the load."),
+    item_intervals_file: Path = typer.Option(default=None, envvar="ITEM_INTERVALS_FILE", help="Json file of check intervals in seconds by item id, item name or folder name."),
+    timing_phases: bool = typer.Option(default=False, envvar="TIMING_PHASES", help="Record DNS, connect, TLS and first byte times of newman requests and submit them as metrics."),
+    confirm_retries: int = typer.Option(default=0, envvar="CONFIRM_RETRIES", help="Run failed items again up to this many times in the same cycle before their failure is published."),
+    confirm_delay_seconds: float = typer.Option(default=5.0, envvar="CONFIRM_DELAY_SECONDS", help="Seconds to wait before every confirmation run of failed items."),
+    history_file: Path = typer.Option(default=None, envvar="HISTORY_FILE", help="File keeping the recent results of every item for percentiles and latency regression checks."),
+    history_window: int = typer.Option(default=100, envvar="HISTORY_WINDOW", help="Number of recent results kept per item in the history file."),
+    history_max_items: int = typer.Option(default=10000, envvar="HISTORY_MAX_ITEMS", help="Number of items the history file has room for."),
+    latency_regression_factor: float = typer.Option(default=0, envvar="LATENCY_REGRESSION_FACTOR", help="Fail items responding slower than this factor times the p95 response time of their history. 0 disables the check."),
+    newman_worker: bool = typer.Option(default=False, envvar="NEWMAN_WORKER", help="Run newman as a library in a long-running node worker instead of a newman process per run."),
+    newman_worker_max_runs: int = typer.Option(default=50, envvar="NEWMAN_WORKER_MAX_RUNS", help="Replace the newman worker after this many runs."),
+    host_max_in_flight: int = typer.Option(default=0, envvar="HOST_MAX_IN_FLIGHT", help="Maximum concurrent native engine requests, TLS handshakes and CRL/OCSP fetches per host, 0 for no limit. Requests run by newman are not limited."),
+    host_rate_limit: float = typer.Option(default=0.0, envvar="HOST_RATE_LIMIT", help="Maximum requests per second started per host, 0 for no limit."),
+    host_rate_burst: int = typer.Option(default=1, envvar="HOST_RATE_BURST", help="Requests per host that may start at once before HOST_RATE_LIMIT applies."),
+    sink: str = typer.Option(default="appinsights", envvar="SINK", help="Comma separated destinations of the results: appinsights, ndjson, openmetrics."),
+    ndjson_file: Path = typer.Option(default=None, envvar="NDJSON_FILE", help="File the ndjson sink writes to, stdout when not set."),
+    ndjson_max_mb: int = typer.Option(default=100, envvar="NDJSON_MAX_MB", help="Size in MiB the ndjson file is rotated at."),
+    ndjson_backups: int = typer.Option(default=5, envvar="NDJSON_BACKUPS", help="Number of rotated ndjson files kept."),
+    openmetrics_address: str = typer.Option(default="0.0.0.0", envvar="OPENMETRICS_ADDRESS", help="Address the openmetrics sink serves /metrics on."),
+    openmetrics_port: int = typer.Option(default=9464, envvar="OPENMETRICS_PORT", help="Port the openmetrics sink serves /metrics on."),
+    openmetrics_max_age_seconds: float = typer.Option(default=0, envvar="OPENMETRICS_MAX_AGE_SECONDS", help="Seconds the openmetrics sink serves the last result of an item, 0 for three times TEST_FREQUENCY_MINUTES."),
 ):
     call_args = locals()
 
@@ -746,62 +4769,79 @@ def urlcheck(
     elif verbosity >= 3:
         logger.setLevel(logging.DEBUG)
 
-    logging.info(f"Starting test run for collection url: [{pm_collection_url}]")
     logging.debug(f"Startup state: {call_args}")
+    if not pm_collection_url and not collection_manifest:
+        typer.echo("Missing option '--pm-collection-url' or '--collection-manifest'.")
+        raise typer.Exit(RC.BASIC)
+    settings = urlcheck_settings(**call_args)
+    unknown_sinks = set(settings.get_sink_names()) - set(result_sink_names)
+    if unknown_sinks or not settings.get_sink_names():
+        typer.echo(f"Invalid option '--sink' [{sink}], choose from: {', '.join(result_sink_names)}.")
+        raise typer.Exit(RC.BASIC)
+    if "appinsights" in settings.get_sink_names() and not ai_instrumentation_key:
+        typer.echo("Missing option '--ai-instrumentation-key', required by the appinsights sink.")
+        raise typer.Exit(RC.BASIC)
+    profiler = cProfile.Profile() if profile else None
+    if profiler:
+        profiler.enable()
+    state = monitor_state(settings=settings)
+    states = None
+    if collection_manifest:
+        collection_settings = load_collection_manifest(collection_manifest, settings)
+        if pm_collection_url:
+            collection_settings.insert(0, settings)
+        if not collection_settings:
+            typer.echo(f"No collections found in manifest [{collection_manifest}].")
+            raise typer.Exit(RC.BASIC)
+        states = [state.for_collection(entry) for entry in collection_settings]
 
-    data = load_pm_collection(pm_collection_url)
-    pm_test_results, error_rc, _ = run_pm_collection_test(
-        data,
-        nm_timeout_collection=nm_timeout_collection,
-        nm_timeout_request=nm_timeout_request,
-        nm_timeout_script=nm_timeout_script,
-    )
-    pm_report_data = process_pm_collection_report(pm_test_results, error_rc)
-
-    if certificate_validation_check:
-        pm_url_list = pm_collection_extract_urls(data)
-        sslcert_report_data = retrieve_server_certificates(pm_url_list)
-        # consolidate report data
-        for report_item in pm_report_data.values():
-            if report_item.request.url.hostinfo_hashed in sslcert_report_data:
-                update_check_item_doc(
-                    check_item_doc=report_item,
-                    sslcert_doc=sslcert_report_data.get(
-                        report_item.request.url.hostinfo_hashed
-                    ),
-                )
+    def run_cycle():
+        if states:
+            run_check_cycles(states, concurrency=collection_concurrency)
+        else:
+            run_check_cycle(state)
 
-    # evaluate report data
-    for test_report_doc in pm_report_data.values():
-        if certificate_validation_check:
-            test_report_doc.validate_certificate(
-                self_signed_invalid=not certificate_ignore_self_signed,
-                check_expiration=certificate_check_expiration,
-                expiration_gracetime_days=certificate_expiration_gracetime_days,
-            )
+    def dump_profile():
+        if profiler:
+            profiler.dump_stats(profile)
+            logging.info(f"Profile written to [{profile}]")
 
-        rc_accept_list = []
-        (rc_range_start, rc_range_end) = rc_range
-        if rc_range_start and rc_range_end:
-            rc_accept_list = list(range(rc_range_start, rc_range_end))
-        if rc_list:
-            rc_accept_list.extend(rc_list)
-        rc_accept_list = list(set(rc_accept_list))
+    if not daemon or test_frequency_minutes <= 0:
+        try:
+            run_cycle()
+        finally:
+            state.close(telemetry_drain_timeout)
+            if profiler:
+                profiler.disable()
+            dump_profile()
+        return
 
-        test_report_doc.validate_test_report(
-            acceptable_response_codes=rc_accept_list,
-            include_ssl_test_results=certificate_validation_check,
-        )
+    stop_event = threading.Event()
+
+    def handle_stop_signal(signum, frame):
+        logging.info(f"Received signal [{signum}], stopping after current cycle.")
+        stop_event.set()
 
-    if not location:
-        location = estimate_location(auto_location_test_hostinfo)
+    signal.signal(signal.SIGTERM, handle_stop_signal)
+    signal.signal(signal.SIGINT, handle_stop_signal)
+
+    def on_cycle_done(stats: cycle_stats):
+        track_cycle_stats(
+            stats, sinks=state.sinks, location=state.location, sender=state.telemetry_sender
+        )
+        # keep the dump current, a daemon is usually stopped from outside
+        dump_profile()
 
-    # publish report data
-    appinsights_client = TelemetryClient(ai_instrumentation_key)
-    publish_in_appinsights(
-        data=pm_report_data, tc=appinsights_client, location=location
+    run_scheduled(
+        cycle=run_cycle,
+        interval_seconds=schedule_tick_seconds or test_frequency_minutes * 60,
+        on_cycle_done=on_cycle_done,
+        stop_event=stop_event,
     )
-    logging.info(f"Reached end of run for collection url: [{pm_collection_url}]")
+    state.close(telemetry_drain_timeout)
+    if profiler:
+        profiler.disable()
+    dump_profile()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,181 @@
+/**
+ * Newman reporter writing one JSON record per finished request.
+ *
+ * Every record is written on its own line as soon as the request item is done,
+ * so results can be processed while the collection is still running. Records
+ * use the layout of the executions and failures of the newman JSON report,
+ * response bodies are left out. Runs with --verbose add the request timing
+ * phases to the response.
+ *
+ * Reporter options:
+ *   --reporter-ndjson-export <path>  write records to path instead of stdout
+ */
+
+const fs = require('fs');
+
+function folderPath (item) {
+    const names = [];
+    let parent = item.parent();
+    // the collection itself has no parent and is not part of the path
+    while (parent && typeof parent.parent === 'function' && parent.parent()) {
+        names.unshift(parent.name);
+        parent = parent.parent();
+    }
+    return names;
+}
+
+function itemJSON (item) {
+    return {
+        id: item.id,
+        name: item.name,
+        request: item.request ? item.request.toJSON() : {},
+        event: item.events ? item.events.toJSON() : [],
+        response: []
+    };
+}
+
+// same phases as sdk.Response.timingPhases
+function timingPhases (timings) {
+    if (!(timings && timings.offset)) {
+        return undefined;
+    }
+    const offset = timings.offset;
+    const phases = {
+        prepare: offset.request,
+        wait: offset.socket - offset.request,
+        dns: offset.lookup - offset.socket,
+        tcp: offset.connect - offset.lookup,
+        firstByte: offset.response - offset.connect,
+        download: offset.end - offset.response,
+        process: offset.done - offset.end,
+        total: offset.done
+    };
+    if (offset.secureConnect) {
+        phases.secureHandshake = offset.secureConnect - offset.connect;
+        phases.firstByte = offset.response - offset.secureConnect;
+    }
+    return phases;
+}
+
+function requestTimings (o) {
+    if (o.response && o.response.timings) {
+        return o.response.timings;
+    }
+    // the request history holds the timings of the last request sent
+    const data = o.history && o.history.execution && o.history.execution.data;
+    return data && data.length ? data[data.length - 1].timings : undefined;
+}
+
+function responseJSON (response, timings) {
+    if (!response) {
+        return undefined;
+    }
+    return {
+        id: response.id,
+        status: response.status,
+        code: response.code,
+        responseTime: response.responseTime,
+        responseSize: response.responseSize,
+        header: response.headers ? response.headers.toJSON() : [],
+        cookie: response.cookies ? response.cookies.toJSON() : [],
+        timingPhases: timingPhases(timings)
+    };
+}
+
+function errorJSON (err) {
+    return {
+        name: err.name,
+        message: err.message,
+        stack: err.stack,
+        index: err.index,
+        test: err.test,
+        timestamp: err.timestamp || Date.now()
+    };
+}
+
+module.exports = function (newman, reporterOptions, collectionRunOptions) {
+    const output = reporterOptions.export ?
+        fs.createWriteStream(reporterOptions.export, { flags: 'a' }) :
+        process.stdout;
+    const pending = {};
+
+    function write (record) {
+        if (reporterOptions.job !== undefined) {
+            record.job = reporterOptions.job;
+        }
+        output.write(JSON.stringify(record) + '\n');
+    }
+
+    function track (o) {
+        const ref = o.cursor && o.cursor.ref;
+        if (!pending[ref]) {
+            pending[ref] = { execution: { cursor: o.cursor, assertions: [] }, failures: [] };
+        }
+        return pending[ref];
+    }
+
+    function failure (o, err, at) {
+        track(o).failures.push({
+            error: errorJSON(err),
+            at: at,
+            source: itemJSON(o.item),
+            parent: {},
+            cursor: o.cursor
+        });
+    }
+
+    newman.on('beforeItem', function (err, o) {
+        track(o);
+    });
+
+    newman.on('request', function (err, o) {
+        const entry = track(o);
+        entry.execution.request = o.request ? o.request.toJSON() : undefined;
+        entry.execution.response = responseJSON(o.response, requestTimings(o));
+        if (err) {
+            entry.execution.requestError = errorJSON(err);
+            failure(o, err, 'request');
+        }
+    });
+
+    newman.on('assertion', function (err, o) {
+        const entry = track(o);
+        const assertion = { assertion: o.assertion, skipped: o.skipped };
+        if (err) {
+            assertion.error = errorJSON(err);
+            failure(o, err, 'assertion:' + entry.execution.assertions.length);
+        }
+        entry.execution.assertions.push(assertion);
+    });
+
+    newman.on('script', function (err, o) {
+        if (err) {
+            failure(o, err, o.event ? o.event.listen + '-script' : 'script');
+        }
+    });
+
+    newman.on('item', function (err, o) {
+        const ref = o.cursor && o.cursor.ref;
+        const entry = track(o);
+        delete pending[ref];
+        entry.execution.id = o.item.id;
+        entry.execution.item = itemJSON(o.item);
+        write({
+            type: 'execution',
+            path: folderPath(o.item),
+            execution: entry.execution,
+            failures: entry.failures
+        });
+    });
+
+    newman.on('done', function (err, summary) {
+        write({
+            type: 'done',
+            error: err ? errorJSON(err) : null,
+            stats: summary && summary.run ? summary.run.stats : {}
+        });
+        if (output !== process.stdout) {
+            output.end();
+        }
+    });
+};
@@ -0,0 +1,151 @@
+#!/usr/bin/env node
+/**
+ * Long-running worker running collections with newman as a library.
+ *
+ * Saves starting node and loading newman for every run. Jobs are read from
+ * stdin, one JSON object per line:
+ *
+ *   {"job": "1", "report": "ndjson", "collection": {...}, "options": {...}}
+ *
+ * options are passed to newman.run, e.g. timeout, timeoutRequest,
+ * timeoutScript and verbose. Jobs run concurrently and every record written
+ * to stdout carries the id of its job:
+ *
+ *   report "ndjson"  records of the ndjson reporter, one per finished item,
+ *                    ending with a "done" record
+ *   report "json"    a single "report" record holding the newman JSON report,
+ *                    without the response bodies
+ *
+ * A running job is stopped with an abort line, its last record is written
+ * right away with an "AbortError" and later records of the job are dropped:
+ *
+ *   {"type": "abort", "job": "1"}
+ *
+ * newman.run has no documented way to stop a run, it is only stopped if the
+ * returned emitter has an abort function. Otherwise the last record has
+ * "recycle": true, the aborted run keeps going and the worker should get no
+ * new jobs.
+ *
+ * The worker exits once stdin is closed and all jobs that were not aborted
+ * are done.
+ */
+
+const readline = require('readline');
+const newman = require('newman');
+
+let running = 0;
+let closed = false;
+const runs = {};
+const aborted = new Set();
+
+// response bodies are not needed and make up most of a report
+function withoutStreams (key, value) {
+    return key === 'stream' ? undefined : value;
+}
+
+function write (record) {
+    if (aborted.has(record.job)) {
+        return;
+    }
+    process.stdout.write(JSON.stringify(record, withoutStreams) + '\n');
+}
+
+function errorJSON (err) {
+    return err ? { name: err.name, message: err.message, stack: err.stack } : null;
+}
+
+function exitWhenIdle () {
+    // aborted runs that could not be stopped do not keep the worker alive
+    if (closed && running === aborted.size) {
+        process.exit(0);
+    }
+}
+
+function endJob (job) {
+    delete runs[job];
+    aborted.delete(job);
+    running -= 1;
+    exitWhenIdle();
+}
+
+function abortJob (job) {
+    const run = runs[job.job];
+    if (!run || aborted.has(job.job)) {
+        return;
+    }
+    const abortable = typeof run.emitter.abort === 'function';
+    write({
+        type: run.streaming ? 'done' : 'report',
+        job: job.job,
+        error: { name: 'AbortError', message: 'Run aborted' },
+        stats: {},
+        report: null,
+        recycle: !abortable
+    });
+    aborted.add(job.job);
+    if (abortable) {
+        // the run ends at its next step, requests already sent end with their timeout
+        run.emitter.abort();
+    }
+}
+
+function runJob (job) {
+    const streaming = job.report !== 'json';
+    let doneWritten = false;
+    running += 1;
+    try {
+        const emitter = newman.run(Object.assign({}, job.options, {
+            collection: job.collection,
+            insecure: true,
+            reporters: streaming ? ['ndjson'] : [],
+            reporter: { ndjson: { job: job.job } }
+        }), function (err, summary) {
+            if (streaming && !doneWritten) {
+                // runs failing before they started end without reporter records
+                write({ type: 'done', job: job.job, error: errorJSON(err), stats: {} });
+            }
+            if (!streaming) {
+                let report = null;
+                if (summary) {
+                    // same content as the newman JSON reporter
+                    report = Object.assign({}, summary);
+                    delete report.exports;
+                }
+                write({ type: 'report', job: job.job, error: errorJSON(err), report: report });
+            }
+            endJob(job.job);
+        }).on('done', function () {
+            doneWritten = true;
+        });
+        runs[job.job] = { emitter: emitter, streaming: streaming };
+    }
+    catch (err) {
+        write({ type: streaming ? 'done' : 'report', job: job.job, error: errorJSON(err), report: null });
+        endJob(job.job);
+    }
+}
+
+readline.createInterface({ input: process.stdin, terminal: false })
+    .on('line', function (line) {
+        if (!line.trim()) {
+            return;
+        }
+        let job;
+        try {
+            job = JSON.parse(line);
+        }
+        catch (err) {
+            process.stderr.write('Ignoring invalid job: ' + err.message + '\n');
+            return;
+        }
+        if (job.type === 'abort') {
+            abortJob(job);
+        }
+        else {
+            runJob(job);
+        }
+    })
+    .on('close', function () {
+        closed = true;
+        exitWhenIdle();
+    });
@@ -0,0 +1,9 @@
+import sys
+import logging
+
+from pathlib import Path
+
+# monitor.py is a single module at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+logging.getLogger().setLevel(logging.ERROR)
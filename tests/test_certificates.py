@@ -0,0 +1,117 @@
+import datetime
+import socket
+import ssl
+import sys
+import threading
+import time
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+import monitor
+
+
+def make_cert(subject, issuer, key, issuer_key):
+    now = datetime.datetime.utcnow()
+    return (
+        x509.CertificateBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, subject)]))
+        .issuer_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, issuer)]))
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=30))
+        .sign(issuer_key, hashes.SHA256())
+    )
+
+
+def wait_until_idle(executor, timeout=10):
+    deadline = time.monotonic() + timeout
+    while executor.running and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return not executor.running
+
+
+def test_executor_does_not_retrieve_running_hosts_again():
+    executor = monitor.sslcert_executor(max_workers=2)
+    release = threading.Event()
+    calls = []
+
+    def retrieve(name):
+        calls.append(name)
+        release.wait(10)
+        return name
+
+    first = executor.submit("a", retrieve, "a")
+    assert executor.submit("a", retrieve, "a") is first
+    other = executor.submit("b", retrieve, "b")
+    release.set()
+    assert first.result(10) == "a"
+    assert other.result(10) == "b"
+    assert sorted(calls) == ["a", "b"]
+    # finished retrievals leave running and are started again
+    assert wait_until_idle(executor)
+    assert executor.submit("a", retrieve, "a").result(10) == "a"
+    assert sorted(calls) == ["a", "a", "b"]
+    executor.close()
+
+
+def test_hanging_hosts_are_submitted_once():
+    executor = monitor.sslcert_executor(max_workers=4)
+    release = threading.Event()
+    # every cycle gives up on the same hanging host
+    futures = {executor.submit("hanging", release.wait, 10) for _ in range(5)}
+    assert len(futures) == 1
+    assert list(executor.running) == ["hanging"]
+    release.set()
+    assert wait_until_idle(executor)
+    executor.close()
+
+
+def test_chain_of_presented_certificates(tmp_path):
+    ca_key, key = ec.generate_private_key(ec.SECP256R1()), ec.generate_private_key(ec.SECP256R1())
+    chain = [make_cert("localhost", "test ca", key, ca_key), make_cert("test ca", "test ca", ca_key, ca_key)]
+    (tmp_path / "chain.pem").write_bytes(b"".join(cert.public_bytes(serialization.Encoding.PEM) for cert in chain))
+    (tmp_path / "key.pem").write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        )
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(tmp_path / "chain.pem", tmp_path / "key.pem")
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def serve():
+        conn, _ = listener.accept()
+        try:
+            with context.wrap_socket(conn, server_side=True) as tls_conn:
+                tls_conn.recv(1)
+        except (OSError, ssl.SSLError):
+            pass
+
+    server = threading.Thread(target=serve, daemon=True)
+    server.start()
+    # before Python 3.13, e.g. in the 3.10 image, the chain comes from the private ssl object
+    if sys.version_info < (3, 13):
+        assert hasattr(ssl._ssl._SSLSocket, "get_unverified_chain")
+    presented = monitor.get_server_certificate_chain(listener.getsockname(), timeout=5)
+    server.join(5)
+    listener.close()
+    assert [cert.subject for cert in presented] == [cert.subject for cert in chain]
+
+
+def test_cached_results_have_no_handshake_latency(tmp_path):
+    key = ec.generate_private_key(ec.SECP256R1())
+    url = monitor.pm_request_url(raw="https://127.0.0.1:8443/")
+    doc = monitor.sslcert_result_document(
+        url=url, host_cert=make_cert("localhost", "localhost", key, key), handshake_latency_ms=12.5
+    )
+    cache = monitor.sslcert_cache(path=tmp_path / "certs.json", ttl_seconds=60)
+    cache.put(url.hostinfo_hashed, doc)
+    cache.save()
+    cached = monitor.sslcert_cache(path=tmp_path / "certs.json", ttl_seconds=60).get(url)
+    assert cached.cached
+    assert cached.host_cert == doc.host_cert
+    assert cached.handshake_latency_ms is None
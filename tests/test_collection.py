@@ -0,0 +1,100 @@
+import http.server
+import json
+import logging
+import threading
+
+import pytest
+import typer
+
+import monitor
+
+
+def make_item(name, **kwargs):
+    return dict(name=name, request=dict(method="GET", url=f"http://127.0.0.1:1/{name}"), **kwargs)
+
+
+def get_leaf_names(data):
+    return [leaf["name"] for leaf in monitor.pm_collection_iter_leaves(data)]
+
+
+def make_script(*lines, listen="test"):
+    return [dict(listen=listen, script=dict(type="text/javascript", exec=list(lines)))]
+
+
+def make_scripted_collection():
+    return dict(
+        info=dict(name="test"),
+        item=[
+            make_item("plain"),
+            make_item("empty", event=make_script("", " ")),
+            make_item("tested", event=make_script("pm.test('ok', () => {});")),
+            dict(name="folder", event=make_script("console.log(1)", listen="prerequest"), item=[make_item("inherited")]),
+        ],
+    )
+
+
+def test_items_with_scripts_run_on_newman():
+    data = make_scripted_collection()
+    native_items, newman_collection = monitor.split_pm_collection_engines(data, monitor.Engine.auto)
+    assert [item["name"] for item, _ in native_items] == ["plain", "empty"]
+    assert get_leaf_names(newman_collection) == ["tested", "inherited"]
+
+
+def test_native_engine_refuses_items_with_scripts():
+    with pytest.raises(typer.Exit):
+        monitor.split_pm_collection_engines(make_scripted_collection(), monitor.Engine.native)
+
+
+def test_native_engine_runs_everything_natively():
+    data = dict(info=dict(name="test"), item=[make_item("plain"), make_item("empty", event=make_script(""))])
+    native_items, newman_collection = monitor.split_pm_collection_engines(data, monitor.Engine.native)
+    assert [item["name"] for item, _ in native_items] == ["plain", "empty"]
+    assert newman_collection is None
+
+
+def test_newman_engine_runs_everything_on_newman():
+    data = dict(info=dict(name="test"), item=[make_item("plain")])
+    assert monitor.split_pm_collection_engines(data, monitor.Engine.newman) == ([], data)
+
+
+class collection_handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        status, body = self.server.response
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def collection_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), collection_handler)
+    server.url = f"http://127.0.0.1:{server.server_port}/collection.json"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_loader_falls_back_to_last_good_copy_without_printing(collection_server, capsys, caplog):
+    data = dict(info=dict(name="test"), item=[make_item("plain")])
+    collection_server.response = (200, json.dumps(data).encode("utf-8"))
+    loader = monitor.pm_collection_loader()
+    assert loader.load(collection_server.url) == data
+    for response in [(500, b"{}"), (200, b"not json")]:
+        collection_server.response = response
+        with caplog.at_level(logging.WARNING):
+            assert loader.load(collection_server.url) == data
+    assert capsys.readouterr().out == ""
+    assert "500" in caplog.text
+    assert "not valid json" in caplog.text
+
+
+def test_loader_without_copy_prints_error(collection_server, capsys):
+    collection_server.response = (500, b"{}")
+    with pytest.raises(typer.Exit):
+        monitor.pm_collection_loader().load(collection_server.url)
+    assert "500" in capsys.readouterr().out
@@ -0,0 +1,285 @@
+import datetime
+import http.server
+import threading
+
+import crl_checker
+import pytest
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509 import ocsp
+from cryptography.x509.oid import AuthorityInformationAccessOID, ExtendedKeyUsageOID, NameOID
+
+import monitor
+
+
+class crl_handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pkix-crl")
+        self.end_headers()
+        self.wfile.write(self.server.crl)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "application/ocsp-response")
+        self.end_headers()
+        self.wfile.write(self.server.ocsp_response())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def ca_key():
+    return ec.generate_private_key(ec.SECP256R1())
+
+
+@pytest.fixture
+def crl_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), crl_handler)
+    server.requests = 0
+    server.crl = b""
+    server.url = f"http://127.0.0.1:{server.server_port}/ca.crl"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_name(common_name):
+    return x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+
+
+def make_cert(ca_key, serial, crl_url, ocsp_url=None):
+    now = datetime.datetime.utcnow()
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(get_name(f"host-{serial}"))
+        .issuer_name(get_name("test ca"))
+        .public_key(ec.generate_private_key(ec.SECP256R1()).public_key())
+        .serial_number(serial)
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=30))
+        .add_extension(
+            x509.CRLDistributionPoints(
+                [x509.DistributionPoint([x509.UniformResourceIdentifier(crl_url)], None, None, None)]
+            ),
+            critical=False,
+        )
+    )
+    if ocsp_url:
+        builder = builder.add_extension(
+            x509.AuthorityInformationAccess(
+                [
+                    x509.AccessDescription(
+                        AuthorityInformationAccessOID.OCSP, x509.UniformResourceIdentifier(ocsp_url)
+                    )
+                ]
+            ),
+            critical=False,
+        )
+    return builder.sign(ca_key, hashes.SHA256())
+
+
+def make_ca_cert(ca_key):
+    now = datetime.datetime.utcnow()
+    return (
+        x509.CertificateBuilder()
+        .subject_name(get_name("test ca"))
+        .issuer_name(get_name("test ca"))
+        .public_key(ca_key.public_key())
+        .serial_number(1)
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=30))
+        .sign(ca_key, hashes.SHA256())
+    )
+
+
+def make_ocsp_response(
+    signer_key, ca_cert, cert, status=ocsp.OCSPCertStatus.GOOD, responder_cert=None, include_responder=True
+):
+    now = datetime.datetime.utcnow()
+    builder = ocsp.OCSPResponseBuilder()
+    if responder_cert and include_responder:
+        builder = builder.certificates([responder_cert])
+    return (
+        builder
+        .add_response(
+            cert=cert,
+            issuer=ca_cert,
+            algorithm=hashes.SHA1(),
+            cert_status=status,
+            this_update=now - datetime.timedelta(minutes=1),
+            next_update=now + datetime.timedelta(hours=1),
+            revocation_time=now - datetime.timedelta(minutes=1)
+            if status == ocsp.OCSPCertStatus.REVOKED
+            else None,
+            revocation_reason=None,
+        )
+        .responder_id(ocsp.OCSPResponderEncoding.HASH, responder_cert or ca_cert)
+        .sign(signer_key, hashes.SHA256())
+        .public_bytes(serialization.Encoding.DER)
+    )
+
+
+def make_crl(ca_key, revoked_serials, next_update):
+    now = datetime.datetime.utcnow()
+    builder = (
+        x509.CertificateRevocationListBuilder()
+        .issuer_name(get_name("test ca"))
+        .last_update(now - datetime.timedelta(minutes=1))
+        .next_update(now + next_update)
+    )
+    for serial in revoked_serials:
+        builder = builder.add_revoked_certificate(
+            x509.RevokedCertificateBuilder()
+            .serial_number(serial)
+            .revocation_date(now - datetime.timedelta(minutes=1))
+            .build()
+        )
+    return builder.sign(ca_key, hashes.SHA256()).public_bytes(serialization.Encoding.DER)
+
+
+def test_revoked_serial_is_found(ca_key, crl_server):
+    crl_server.crl = make_crl(ca_key, [1001], datetime.timedelta(hours=1))
+    index = monitor.crl_revocation_index()
+    with pytest.raises(crl_checker.Revoked) as revoked:
+        index.check_revoked(make_cert(ca_key, 1001, crl_server.url))
+    assert revoked.value.source == "crl"
+    assert index.check_revoked(make_cert(ca_key, 1002, crl_server.url)) == "crl"
+    assert crl_server.requests == 1
+
+
+def test_fresh_crl_is_not_downloaded_again(ca_key, crl_server):
+    crl_server.crl = make_crl(ca_key, [], datetime.timedelta(hours=1))
+    index = monitor.crl_revocation_index()
+    for _ in range(3):
+        index.check_revoked(make_cert(ca_key, 1003, crl_server.url))
+    assert crl_server.requests == 1
+    assert index.fetches == 1
+
+
+def test_expired_crl_is_refreshed(ca_key, crl_server):
+    cert = make_cert(ca_key, 1004, crl_server.url)
+    crl_server.crl = make_crl(ca_key, [], datetime.timedelta(seconds=-1))
+    index = monitor.crl_revocation_index()
+    assert index.check_revoked(cert) == "crl"
+    # the new CRL revokes the certificate and is kept until its nextUpdate
+    crl_server.crl = make_crl(ca_key, [1004], datetime.timedelta(hours=1))
+    with pytest.raises(crl_checker.Revoked):
+        index.check_revoked(cert)
+    with pytest.raises(crl_checker.Revoked):
+        index.check_revoked(cert)
+    assert crl_server.requests == 2
+
+
+def test_cache_dir_survives_restarts(ca_key, crl_server, tmp_path):
+    crl_server.crl = make_crl(ca_key, [1005], datetime.timedelta(hours=1))
+    cert = make_cert(ca_key, 1005, crl_server.url)
+    for _ in range(2):
+        index = monitor.crl_revocation_index(cache_dir=tmp_path / "crl")
+        with pytest.raises(crl_checker.Revoked):
+            index.check_revoked(cert)
+    assert crl_server.requests == 1
+
+
+def test_unavailable_crl_raises_fetch_failure(ca_key, crl_server):
+    index = monitor.crl_revocation_index(fetch_timeout=1)
+    url = crl_server.url
+    crl_server.shutdown()
+    crl_server.server_close()
+    with pytest.raises(crl_checker.CrlFetchFailure):
+        index.check_revoked(make_cert(ca_key, 1006, url))
+
+
+def test_ocsp_status_is_preferred(ca_key, crl_server):
+    ca_cert = make_ca_cert(ca_key)
+    cert = make_cert(ca_key, 1007, crl_server.url, ocsp_url=crl_server.url)
+    crl_server.ocsp_response = lambda: make_ocsp_response(
+        ca_key, ca_cert, cert, ocsp.OCSPCertStatus.REVOKED
+    )
+    with pytest.raises(crl_checker.Revoked) as revoked:
+        monitor.crl_revocation_index().check_revoked(cert, ca_cert)
+    assert revoked.value.source == "ocsp"
+
+
+def test_ocsp_response_for_another_certificate_falls_back_to_crl(ca_key, crl_server):
+    ca_cert = make_ca_cert(ca_key)
+    cert = make_cert(ca_key, 1008, crl_server.url, ocsp_url=crl_server.url)
+    other_cert = make_cert(ca_key, 1009, crl_server.url)
+    crl_server.ocsp_response = lambda: make_ocsp_response(ca_key, ca_cert, other_cert)
+    crl_server.crl = make_crl(ca_key, [1008], datetime.timedelta(hours=1))
+    with pytest.raises(crl_checker.Revoked) as revoked:
+        monitor.crl_revocation_index().check_revoked(cert, ca_cert)
+    assert revoked.value.source == "crl"
+
+
+def test_ocsp_response_of_another_issuer_falls_back_to_crl(ca_key, crl_server):
+    ca_cert = make_ca_cert(ca_key)
+    cert = make_cert(ca_key, 1010, crl_server.url, ocsp_url=crl_server.url)
+    other_key = ec.generate_private_key(ec.SECP256R1())
+    other_ca_cert = make_ca_cert(other_key)
+    crl_server.ocsp_response = lambda: make_ocsp_response(other_key, other_ca_cert, cert)
+    crl_server.crl = make_crl(ca_key, [], datetime.timedelta(hours=1))
+    assert monitor.crl_revocation_index().check_revoked(cert, ca_cert) == "crl"
+
+
+def make_responder_cert(ca_key, responder_key, usage=(ExtendedKeyUsageOID.OCSP_SIGNING,)):
+    now = datetime.datetime.utcnow()
+    return (
+        x509.CertificateBuilder()
+        .subject_name(get_name("test responder"))
+        .issuer_name(get_name("test ca"))
+        .public_key(responder_key.public_key())
+        .serial_number(2)
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=30))
+        .add_extension(x509.ExtendedKeyUsage(list(usage)), critical=False)
+        .sign(ca_key, hashes.SHA256())
+    )
+
+
+def test_forged_ocsp_response_falls_back_to_crl(ca_key, crl_server):
+    ca_cert = make_ca_cert(ca_key)
+    cert = make_cert(ca_key, 1011, crl_server.url, ocsp_url=crl_server.url)
+    # right certificate and issuer hashes, signed by someone else using the issuer name
+    forger_key = ec.generate_private_key(ec.SECP256R1())
+    crl_server.ocsp_response = lambda: make_ocsp_response(
+        forger_key, ca_cert, cert, responder_cert=make_ca_cert(forger_key), include_responder=False
+    )
+    crl_server.crl = make_crl(ca_key, [1011], datetime.timedelta(hours=1))
+    with pytest.raises(crl_checker.Revoked) as revoked:
+        monitor.crl_revocation_index().check_revoked(cert, ca_cert)
+    assert revoked.value.source == "crl"
+
+
+def test_ocsp_response_of_delegated_responder_is_trusted(ca_key, crl_server):
+    ca_cert = make_ca_cert(ca_key)
+    cert = make_cert(ca_key, 1012, crl_server.url, ocsp_url=crl_server.url)
+    responder_key = ec.generate_private_key(ec.SECP256R1())
+    responder_cert = make_responder_cert(ca_key, responder_key)
+    crl_server.ocsp_response = lambda: make_ocsp_response(
+        responder_key, ca_cert, cert, ocsp.OCSPCertStatus.REVOKED, responder_cert
+    )
+    with pytest.raises(crl_checker.Revoked) as revoked:
+        monitor.crl_revocation_index().check_revoked(cert, ca_cert)
+    assert revoked.value.source == "ocsp"
+
+
+def test_ocsp_responder_without_signing_usage_falls_back_to_crl(ca_key, crl_server):
+    ca_cert = make_ca_cert(ca_key)
+    cert = make_cert(ca_key, 1013, crl_server.url, ocsp_url=crl_server.url)
+    responder_key = ec.generate_private_key(ec.SECP256R1())
+    responder_cert = make_responder_cert(ca_key, responder_key, usage=[ExtendedKeyUsageOID.SERVER_AUTH])
+    crl_server.ocsp_response = lambda: make_ocsp_response(
+        responder_key, ca_cert, cert, responder_cert=responder_cert
+    )
+    crl_server.crl = make_crl(ca_key, [1013], datetime.timedelta(hours=1))
+    with pytest.raises(crl_checker.Revoked) as revoked:
+        monitor.crl_revocation_index().check_revoked(cert, ca_cert)
+    assert revoked.value.source == "crl"
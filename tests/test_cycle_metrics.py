@@ -0,0 +1,39 @@
+import subprocess
+import sys
+
+import pytest
+
+import monitor
+
+
+def start_python(code):
+    return subprocess.Popen([sys.executable, "-c", code])
+
+
+def test_usage_counts_waited_processes_only():
+    usage = monitor.child_process_usage()
+    other = start_python("sum(range(30_000_000))")
+    proc = start_python("import sys; sys.exit(3)")
+    assert monitor.wait_child_process(proc, usage=usage) == 3
+    other.wait()
+    assert usage.processes == 1
+    assert usage.cpu_seconds < 0.5
+    assert usage.peak_rss_kib > 0
+
+
+def test_wait_kills_process_after_timeout():
+    usage = monitor.child_process_usage()
+    proc = start_python("import time; time.sleep(30)")
+    with pytest.raises(subprocess.TimeoutExpired):
+        monitor.wait_child_process(proc, timeout=0.2, usage=usage)
+    assert proc.returncode < 0
+    assert usage.processes == 1
+
+
+def test_metrics_without_subprocesses_have_no_newman_usage():
+    metrics = monitor.cycle_metrics()
+    metrics.track_child_usage()
+    assert not any(name.startswith("newman_") for name in metrics.resources)
+    metrics.usage.wait(start_python("pass"))
+    metrics.track_child_usage()
+    assert metrics.resources["newman_processes"] == 1
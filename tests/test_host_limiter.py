@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import monitor
+
+
+def test_token_bucket_allows_bursts_then_spaces_requests():
+    limiter = monitor.host_limiter(rate=10, burst=2)
+    limit = limiter.get_limit("host")
+    assert limiter.reserve(limit) == 0
+    assert limiter.reserve(limit) == 0
+    # later requests queue up behind each other
+    assert limiter.reserve(limit) == pytest.approx(0.1, abs=0.01)
+    assert limiter.reserve(limit) == pytest.approx(0.2, abs=0.01)
+    assert limiter.reserve(limiter.get_limit("other")) == 0
+
+
+def test_token_bucket_refills():
+    limiter = monitor.host_limiter(rate=50, burst=1)
+    limit = limiter.get_limit("host")
+    assert limiter.reserve(limit) == 0
+    time.sleep(0.05)
+    assert limiter.reserve(limit) == 0
+
+
+def test_semaphore_limits_requests_in_flight():
+    limiter = monitor.host_limiter(max_in_flight=1)
+    window = limiter.open_window()
+    in_flight = []
+    max_in_flight = []
+    lock = threading.Lock()
+
+    def request():
+        with limiter.acquire("host"):
+            with lock:
+                in_flight.append(1)
+                max_in_flight.append(len(in_flight))
+            time.sleep(0.05)
+            with lock:
+                in_flight.pop()
+
+    threads = [threading.Thread(target=request) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    limiter.close_window(window)
+    assert max(max_in_flight) == 1
+    assert limiter.acquired == 3
+    assert window.queued == 2
+    # the waits of concurrent requests add up
+    assert window.wait_seconds >= 0.1
+    assert window.max_seconds >= 0.09
+    assert window.max_seconds < window.wait_seconds
+    assert limiter.totals.queued == 2
+    assert not limiter.windows
+
+
+def test_acquire_async_waits_without_blocking_the_loop():
+    limiter = monitor.host_limiter(max_in_flight=1)
+    window = limiter.open_window()
+    ticks = []
+
+    async def request():
+        async with limiter.acquire_async("host") as queued_seconds:
+            await asyncio.sleep(0.05)
+            return queued_seconds
+
+    async def ticker():
+        for _ in range(5):
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.01)
+
+    async def main():
+        return await asyncio.gather(request(), request(), ticker())
+
+    first, second, _ = asyncio.run(main())
+    limiter.close_window(window)
+    assert sorted([first, second])[0] < 0.01
+    assert sorted([first, second])[1] >= 0.04
+    assert len(ticks) == 5
+    assert window.queued == 1
+
+
+def test_disabled_limiter_does_not_wait():
+    limiter = monitor.host_limiter()
+    with limiter.acquire("host") as queued_seconds:
+        assert queued_seconds == 0
+    assert limiter.acquired == 0
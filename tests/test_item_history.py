@@ -0,0 +1,87 @@
+import monitor
+
+
+def test_stats_of_recorded_results(tmp_path):
+    history = monitor.item_history(tmp_path / "history.bin", window=10, max_items=4)
+    for response_time in range(1, 11):
+        history.record("a", 200, response_time, True)
+    history.record("a", 0, None, False)
+    stats = history.get_stats("a")
+    assert stats["samples"] == 10
+    assert stats["latency_samples"] == 9
+    assert stats["success_ratio"] == 0.9
+    assert stats["p50"] is not None
+    assert stats["p99"] <= 10
+    assert history.get_stats("b") is None
+    history.close()
+
+
+def test_results_survive_reopening(tmp_path):
+    history = monitor.item_history(tmp_path / "history.bin", window=5, max_items=4)
+    history.record("a", 200, 10, True)
+    history.record("b", 500, 20, False)
+    history.close()
+    history = monitor.item_history(tmp_path / "history.bin", window=5, max_items=4)
+    assert history.get_stats("a")["success_ratio"] == 1
+    assert history.get_stats("b")["success_ratio"] == 0
+    history.close()
+
+
+def test_other_dimensions_start_over(tmp_path):
+    history = monitor.item_history(tmp_path / "history.bin", window=5, max_items=4)
+    history.record("a", 200, 10, True)
+    history.close()
+    history = monitor.item_history(tmp_path / "history.bin", window=6, max_items=4)
+    assert history.get_stats("a") is None
+    history.close()
+
+
+def test_collections_keep_items_apart(tmp_path):
+    history = monitor.item_history(tmp_path / "history.bin", window=5, max_items=4)
+    history.record("a", 200, 10, True, collection="one")
+    history.record("a", 500, 20, False, collection="two")
+    assert history.get_stats("a", collection="one")["success_ratio"] == 1
+    assert history.get_stats("a", collection="two")["success_ratio"] == 0
+    assert history.get_stats("a") is None
+    history.close()
+
+
+def test_full_history_reuses_slot_recorded_longest_ago(tmp_path):
+    history = monitor.item_history(tmp_path / "history.bin", window=5, max_items=2)
+    history.record("a", 200, 10, True, timestamp=100)
+    history.record("b", 200, 10, True, timestamp=200)
+    history.record("a", 200, 10, True, timestamp=300)
+    history.record("c", 500, 10, False, timestamp=400)
+    assert history.get_stats("b") is None
+    assert history.get_stats("a")["samples"] == 2
+    assert history.get_stats("c") == dict(
+        samples=1, latency_samples=1, success_ratio=0, p50=10, p95=10, p99=10
+    )
+    history.close()
+
+    # the last seen times are read back from the file
+    history = monitor.item_history(tmp_path / "history.bin", window=5, max_items=2)
+    history.record("d", 200, 10, True, timestamp=500)
+    assert history.get_stats("a") is None
+    assert history.get_stats("c")["samples"] == 1
+    assert history.get_stats("d")["samples"] == 1
+    history.close()
+
+
+def test_full_history_evicts_in_recording_order(tmp_path):
+    history = monitor.item_history(tmp_path / "history.bin", window=3, max_items=3)
+    for timestamp, item_id in enumerate(["a", "b", "c", "a", "b"], start=1):
+        history.record(item_id, 200, 10, True, timestamp=timestamp)
+    slot_c = history.slots[history.get_key("c")]
+    history.record("d", 200, 10, True, timestamp=6)
+    # c was recorded longest ago and its slot is reused
+    assert history.slots[history.get_key("d")] == slot_c
+    assert list(history.slots) == [history.get_key(item_id) for item_id in ["a", "b", "d"]]
+    history.close()
+
+    history = monitor.item_history(tmp_path / "history.bin", window=3, max_items=3)
+    assert list(history.slots) == [history.get_key(item_id) for item_id in ["a", "b", "d"]]
+    history.record("e", 200, 10, True, timestamp=7)
+    assert history.get_stats("a") is None
+    assert history.get_stats("e")["samples"] == 1
+    history.close()
@@ -0,0 +1,71 @@
+import monitor
+
+
+def make_item(name, **kwargs):
+    return dict(name=name, request=dict(method="GET", url=f"http://127.0.0.1:1/{name}"), **kwargs)
+
+
+def get_leaf_names(data):
+    return [leaf["name"] for leaf in monitor.pm_collection_iter_leaves(data)]
+
+
+def make_scheduled_collection():
+    return dict(
+        info=dict(name="test"),
+        variable=[dict(key=monitor.pm_interval_variable, value="60")],
+        item=[
+            dict(name="fast", variable=[dict(key=monitor.pm_interval_variable, value="10")], item=[make_item("f")]),
+            dict(name="slow", item=[make_item("s"), make_item("o")]),
+        ],
+    )
+
+
+def test_schedule_takes_intervals_from_variables_and_overrides():
+    schedule = monitor.pm_item_schedule(300, overrides=dict(o=30))
+    schedule.prepare(make_scheduled_collection())
+    names = {leaf["id"]: leaf["name"] for leaf in monitor.pm_collection_iter_leaves(schedule.data)}
+    assert {names[item_id]: interval for item_id, interval in schedule.intervals.items()} == dict(f=10, s=60, o=30)
+
+
+def test_schedule_returns_due_items():
+    data = make_scheduled_collection()
+    schedule = monitor.pm_item_schedule(300, jitter=0)
+    assert get_leaf_names(schedule.take_due(data, now=0)) == ["f", "s", "o"]
+    assert schedule.take_due(data, now=5) is None
+    assert get_leaf_names(schedule.take_due(data, now=10)) == ["f"]
+    assert get_leaf_names(schedule.take_due(data, now=60)) == ["f", "s", "o"]
+
+
+def test_schedule_restarts_overdue_items_at_now():
+    data = make_scheduled_collection()
+    schedule = monitor.pm_item_schedule(300, jitter=0)
+    schedule.take_due(data, now=0)
+    assert get_leaf_names(schedule.take_due(data, now=100)) == ["f", "s", "o"]
+    assert get_leaf_names(schedule.take_due(data, now=110)) == ["f"]
+
+
+def test_schedule_forgets_removed_items():
+    data = make_scheduled_collection()
+    schedule = monitor.pm_item_schedule(300, jitter=0)
+    schedule.take_due(data, now=0)
+    data = make_scheduled_collection()
+    del data["item"][1]
+    schedule.take_due(data, now=0)
+    assert len(schedule.next_due) == 1
+
+
+def test_due_items_are_looked_up_in_the_collection_table(monkeypatch):
+    data = make_scheduled_collection()
+    schedule = monitor.pm_item_schedule(300, jitter=0)
+    schedule.take_due(data, now=0)
+    compiled = []
+    monkeypatch.setattr(monitor, "compile_pm_item_table", lambda *args, **kwargs: compiled.append(args))
+    # the table of the schedule is cached until the schedule drops it
+    table = monitor.get_pm_item_table(data)
+    assert table is schedule.table
+    due = schedule.take_due(data, now=10)
+    subset = table.subset(due, schedule.due)
+    assert subset.data is due
+    assert [entry.item["name"] for entry in subset.items.values()] == ["f"]
+    assert len(subset.get_urls()) == 1
+    assert not compiled
@@ -0,0 +1,97 @@
+import monitor
+
+
+def make_collection(*items):
+    return dict(
+        info=dict(name="test"),
+        item=[dict(name="folder", item=list(items))],
+    )
+
+
+def test_compile_assigns_stable_ids_and_names():
+    data = make_collection(dict(name="a", request=dict(method="GET", url="http://127.0.0.1:1/a")))
+    table = monitor.compile_pm_item_table(data)
+    again = monitor.compile_pm_item_table(data)
+    assert list(table.items) == list(again.items)
+    entry = next(iter(table.items.values()))
+    assert entry.display_name == "[folder] / a"
+    assert entry.appinsights_name == "folder -- a"
+    assert "id" not in data["item"][0]["item"][0]
+    assert table.data["item"][0]["item"][0]["id"] == entry.id
+
+
+def test_compile_keeps_given_ids():
+    data = make_collection(dict(id="given", name="a", request=dict(method="GET", url="http://127.0.0.1:1/a")))
+    assert list(monitor.compile_pm_item_table(data).items) == ["given"]
+
+
+def test_request_without_method_defaults_to_get():
+    data = make_collection(dict(name="a", request=dict(url="http://127.0.0.1:1/a")))
+    table = monitor.compile_pm_item_table(data)
+    doc = next(iter(table.items.values())).new_result_document()
+    assert doc.request.method == "GET"
+    assert doc.request.url.raw == "http://127.0.0.1:1/a"
+
+
+def test_plain_url_request_becomes_get_request():
+    data = make_collection(dict(name="a", request="http://127.0.0.1:1/a"))
+    table = monitor.compile_pm_item_table(data)
+    entry = next(iter(table.items.values()))
+    doc = entry.new_result_document()
+    assert doc.request.method == "GET"
+    assert doc.request.url.raw == "http://127.0.0.1:1/a"
+    assert entry.host_key == monitor.get_host_key("http://127.0.0.1:1/other")
+
+
+def test_hosts_are_indexed_once():
+    data = make_collection(
+        dict(name="a", request="https://127.0.0.1:8443/a"),
+        dict(name="b", request="https://127.0.0.1:8443/b"),
+        dict(name="c", request="https://127.0.0.2/c"),
+    )
+    table = monitor.compile_pm_item_table(data)
+    assert len(table.items) == 3
+    assert len(table.get_urls()) == 2
+
+
+def test_report_processing_uses_table_entries():
+    data = make_collection(dict(name="a", request="http://127.0.0.1:1/a"))
+    table = monitor.get_pm_item_table(data)
+    item_id = next(iter(table.items))
+    report = dict(
+        collection=table.data,
+        run=dict(
+            executions=[
+                dict(
+                    id=item_id,
+                    item={},
+                    cursor={},
+                    response=dict(id="r", status="OK", code=200, responseTime=5, responseSize=2, header=[]),
+                )
+            ],
+            failures=[],
+        ),
+    )
+    datastore = monitor.process_pm_collection_report(report, 0, item_table=table)
+    assert datastore[item_id].response.code == 200
+    assert datastore[item_id].name == "[folder] / a"
+    assert monitor.get_pm_item_table(data) is table
+
+
+def test_items_without_result_fail_after_timeout():
+    data = monitor.compile_pm_item_table(
+        make_collection(
+            dict(name="a", request="http://127.0.0.1:1/a"),
+            dict(name="b", request="http://127.0.0.1:1/b"),
+        )
+    ).data
+    table = monitor.get_pm_item_table(data)
+    finished_id, left_id = list(table.items)
+    datastore = {finished_id: table.get(finished_id).new_result_document()}
+    handed_over = []
+    monitor.process_pm_timed_out_items(data, datastore, handed_over.append, 30)
+    assert [doc.id for doc in handed_over] == [left_id]
+    assert datastore[left_id] is handed_over[0]
+    assert handed_over[0].name == "[folder] / b"
+    assert handed_over[0].failure.error["name"] == "TimeoutError"
+    assert "30" in str(handed_over[0].failure)
@@ -0,0 +1,109 @@
+import shutil
+import subprocess
+import threading
+
+import pytest
+
+import monitor
+
+pytestmark = pytest.mark.skipif(not shutil.which("node"), reason="node is not installed")
+
+# newman stand-in, the collection name selects how a run behaves
+STUB_NEWMAN = """
+const EventEmitter = require('events');
+
+exports.run = function (options, callback) {
+    const emitter = new EventEmitter();
+    const behaviour = options.collection.info.name;
+    const finish = function () {
+        callback(null, { run: { stats: {}, executions: [] } });
+    };
+    if (behaviour === 'exit') {
+        process.exit(3);
+    }
+    else if (behaviour === 'slow') {
+        setTimeout(finish, 500);
+    }
+    else if (behaviour === 'abortable') {
+        emitter.abort = function () {
+            setImmediate(callback, new Error('aborted'));
+        };
+    }
+    else if (behaviour !== 'hang') {
+        setImmediate(finish);
+    }
+    return emitter;
+};
+"""
+
+
+@pytest.fixture
+def worker(tmp_path, monkeypatch):
+    (tmp_path / "newman").mkdir()
+    (tmp_path / "newman" / "index.js").write_text(STUB_NEWMAN)
+    monkeypatch.setenv("NODE_PATH", str(tmp_path))
+    worker = monitor.newman_worker(abort_timeout=5)
+    yield worker
+    worker.close()
+
+
+def run_job(worker, behaviour, timeout=10):
+    data = dict(info=dict(name=behaviour), item=[])
+    return list(worker.run(data, report="json", options={}, timeout=timeout))
+
+
+def test_jobs_run_on_one_worker(worker):
+    assert run_job(worker, "ok")[-1]["type"] == "report"
+    proc = worker.proc
+    assert run_job(worker, "ok")[-1]["error"] is None
+    assert worker.proc is proc
+
+
+def test_died_worker_is_restarted(worker):
+    run_job(worker, "ok")
+    proc = worker.proc
+    # jobs of a dead worker end without records
+    assert run_job(worker, "exit") == [None]
+    assert proc.wait(timeout=5) == 3
+    assert run_job(worker, "ok")[-1]["type"] == "report"
+    assert worker.proc is not proc
+
+
+def test_worker_is_replaced_after_max_runs(worker):
+    worker.max_runs = 2
+    run_job(worker, "ok")
+    proc = worker.proc
+    run_job(worker, "ok")
+    run_job(worker, "ok")
+    assert worker.proc is not proc
+    assert proc.wait(timeout=5) == 0
+
+
+def test_timed_out_job_is_aborted(worker):
+    run_job(worker, "ok")
+    proc = worker.proc
+    with pytest.raises(subprocess.TimeoutExpired):
+        run_job(worker, "abortable", timeout=0.2)
+    # the run was stopped, the worker keeps running
+    assert worker.proc is proc
+    assert proc.poll() is None
+    assert not worker.jobs
+    assert run_job(worker, "ok")[-1]["type"] == "report"
+
+
+def test_worker_that_cannot_abort_is_recycled(worker):
+    run_job(worker, "ok")
+    proc = worker.proc
+    slow_records = []
+    slow = threading.Thread(target=lambda: slow_records.extend(run_job(worker, "slow")))
+    slow.start()
+    with pytest.raises(subprocess.TimeoutExpired):
+        run_job(worker, "hang", timeout=0.2)
+    # no new jobs for the worker, it exits once the slow job is done
+    assert worker.proc is None
+    slow.join(timeout=10)
+    assert slow_records[-1]["error"] is None
+    assert proc.wait(timeout=5) == 0
+    assert not worker.jobs
+    assert run_job(worker, "ok")[-1]["type"] == "report"
+    assert worker.proc is not proc
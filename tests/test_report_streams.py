@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+import monitor
+
+
+def strip_streams(text, chunk_size):
+    chunks = (text[pos : pos + chunk_size] for pos in range(0, len(text), chunk_size))
+    return json.loads("".join(monitor.strip_pm_report_streams(chunks)))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 16])
+def test_strip_report_streams(chunk_size):
+    report = dict(
+        run=dict(
+            executions=[
+                dict(
+                    id="a",
+                    response=dict(code=200, stream=dict(type="Buffer", data=list(range(300)))),
+                    note='a "stream": [1] in a string',
+                ),
+                dict(id="b", response=dict(code=500, stream=[[1, {"x": "]"}], "}"]), size=2),
+                dict(id="c", response=dict(code=204, stream=None)),
+            ]
+        )
+    )
+    stripped = strip_streams(json.dumps(report, indent=1), chunk_size)
+    executions = stripped["run"]["executions"]
+    assert [execution["response"]["stream"] for execution in executions] == [None] * 3
+    assert [execution["response"]["code"] for execution in executions] == [200, 500, 204]
+    assert executions[0]["note"] == report["run"]["executions"][0]["note"]
+    assert executions[1]["size"] == 2
+
+
+def test_strip_report_streams_keeps_escaped_keys():
+    text = json.dumps(dict(body='{"stream": [1, 2]}', stream=[1, 2]))
+    assert strip_streams(text, 3) == dict(body='{"stream": [1, 2]}', stream=None)
@@ -0,0 +1,51 @@
+import json
+import time
+
+import pytest
+
+import monitor
+
+
+def test_sinks_must_implement_publish():
+    with pytest.raises(TypeError):
+        monitor.result_sink()
+
+    class incomplete_sink(monitor.result_sink):
+        pass
+
+    with pytest.raises(TypeError):
+        incomplete_sink()
+
+
+def test_ndjson_sink_writes_results(tmp_path):
+    table = monitor.compile_pm_item_table(
+        dict(info=dict(name="test"), item=[dict(name="a", request="http://127.0.0.1:1/a")])
+    )
+    doc = next(iter(table.items.values())).new_result_document()
+    sink = monitor.ndjson_sink(path=str(tmp_path / "results.ndjson"))
+    sink.publish(doc, location="test", collection="c")
+    sink.close()
+    records = [json.loads(line) for line in (tmp_path / "results.ndjson").read_text().splitlines()]
+    assert [record["type"] for record in records] == ["result"]
+    assert records[0]["name"] == "a"
+    assert records[0]["run_location"] == "test"
+
+
+def test_openmetrics_sink_drops_expired_results():
+    table = monitor.compile_pm_item_table(
+        dict(
+            info=dict(name="test"),
+            item=[dict(name="a", request="http://127.0.0.1:1/a"), dict(name="b", request="http://127.0.0.1:1/b")],
+        )
+    )
+    first, second = [entry.new_result_document() for entry in table.items.values()]
+    sink = monitor.openmetrics_sink(address="127.0.0.1", port=0, max_age_seconds=0.2)
+    try:
+        sink.publish(first, location="test", collection="c")
+        time.sleep(0.3)
+        sink.publish(second, location="test", collection="c")
+        text = sink.render()
+        assert f'item_id="{first.id}"' not in text
+        assert f'item_id="{second.id}"' in text
+    finally:
+        sink.close()
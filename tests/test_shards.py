@@ -0,0 +1,67 @@
+import monitor
+
+
+def make_item(name, **kwargs):
+    return dict(name=name, request=dict(method="GET", url=f"http://127.0.0.1:1/{name}"), **kwargs)
+
+
+def make_collection(folders):
+    return dict(
+        info=dict(name="test"),
+        item=[dict(name=folder, item=[make_item(f"{folder}{n}") for n in range(size)]) for folder, size in folders],
+    )
+
+
+def get_leaf_names(data):
+    return [leaf["name"] for leaf in monitor.pm_collection_iter_leaves(data)]
+
+
+def test_split_by_folder_keeps_folders_together():
+    data = make_collection([("a", 4), ("b", 3), ("c", 1), ("d", 1)])
+    shards = monitor.split_pm_collection(data, 2)
+    assert len(shards) == 2
+    for shard in shards:
+        folders = {name[0] for name in get_leaf_names(shard)}
+        for folder in folders:
+            assert [name for name in get_leaf_names(shard) if name[0] == folder] == [
+                name for name in get_leaf_names(data) if name[0] == folder
+            ]
+    assert sorted(len(get_leaf_names(shard)) for shard in shards) == [4, 5]
+
+
+def test_split_by_item_spreads_items():
+    data = make_collection([("a", 5)])
+    shards = monitor.split_pm_collection(data, 2, monitor.ShardMode.item)
+    assert [get_leaf_names(shard) for shard in shards] == [["a0", "a2", "a4"], ["a1", "a3"]]
+
+
+def test_split_into_more_shards_than_items():
+    data = make_collection([("a", 2)])
+    assert len(monitor.split_pm_collection(data, 5, monitor.ShardMode.item)) == 2
+
+
+def make_report(shard, started, completed):
+    return dict(
+        collection=dict(info=dict(name="test"), item=shard["item"]),
+        run=dict(
+            executions=[dict(id=leaf["name"]) for leaf in monitor.pm_collection_iter_leaves(shard)],
+            failures=[dict(at=leaf["name"]) for leaf in monitor.pm_collection_iter_leaves(shard)][:1],
+            stats=dict(requests=dict(total=len(get_leaf_names(shard)), failed=1)),
+            timings=dict(started=started, completed=completed),
+        ),
+    )
+
+
+def test_merge_shard_reports():
+    data = make_collection([("a", 2), ("b", 3)])
+    shards = monitor.split_pm_collection(data, 2)
+    merged = monitor.merge_pm_collection_reports(
+        [make_report(shards[0], 10, 20), make_report(shards[1], 5, 15)]
+    )
+    assert sorted(get_leaf_names(merged["collection"])) == sorted(get_leaf_names(data))
+    assert sorted(execution["id"] for execution in merged["run"]["executions"]) == sorted(get_leaf_names(data))
+    assert len(merged["run"]["failures"]) == 2
+    assert merged["run"]["stats"]["requests"] == dict(total=5, failed=2)
+    assert merged["run"]["timings"]["started"] == 5
+    assert merged["run"]["timings"]["completed"] == 20
+    assert merged["collection"]["info"] == dict(name="test")
@@ -0,0 +1,156 @@
+import gzip
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+import monitor
+
+
+class ingestion_handler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        status, headers = self.server.responses.pop(0) if self.server.responses else (200, {})
+        self.server.attempts.append(json.loads(body))
+        if status == 200:
+            self.server.batches.append(json.loads(body))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def ingestion():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ingestion_handler)
+    server.responses = []
+    server.attempts = []
+    server.batches = []
+    server.url = f"http://127.0.0.1:{server.server_port}/v2/track"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class envelope:
+    def __init__(self, number):
+        self.number = number
+
+    def write(self):
+        return dict(name="test", number=self.number)
+
+
+def get_numbers(batches):
+    return [item["number"] for batch in batches for item in batch]
+
+
+def test_items_are_sent_in_batches(ingestion):
+    sender = monitor.batched_telemetry_sender(endpoint=ingestion.url, max_batch_items=10)
+    for number in range(25):
+        sender.put(envelope(number))
+    assert sender.close(timeout=10)
+    assert [len(batch) for batch in ingestion.batches] == [10, 10, 5]
+    assert get_numbers(ingestion.batches) == list(range(25))
+    stats = sender.get_stats()
+    assert stats["sent_items"] == 25
+    assert stats["sent_batches"] == 3
+    assert stats["queue_depth"] == 0
+
+
+def test_batches_are_limited_by_bytes(ingestion):
+    sender = monitor.batched_telemetry_sender(endpoint=ingestion.url, max_batch_bytes=100)
+    for number in range(10):
+        sender.put(envelope(number))
+    assert sender.close(timeout=10)
+    assert len(ingestion.batches) > 1
+    assert get_numbers(ingestion.batches) == list(range(10))
+
+
+def test_throttled_batch_is_retried(ingestion):
+    ingestion.responses = [(429, {"Retry-After": "0"}), (503, {})]
+    sender = monitor.batched_telemetry_sender(endpoint=ingestion.url, backoff_seconds=0.01)
+    sender.put(envelope(1))
+    assert sender.close(timeout=10)
+    assert len(ingestion.attempts) == 3
+    assert get_numbers(ingestion.batches) == [1]
+    assert sender.get_stats()["retries"] == 2
+
+
+def test_rejected_batch_is_dropped(ingestion):
+    ingestion.responses = [(400, {})]
+    sender = monitor.batched_telemetry_sender(endpoint=ingestion.url, backoff_seconds=0.01)
+    sender.put(envelope(1))
+    assert sender.close(timeout=10)
+    assert len(ingestion.attempts) == 1
+    stats = sender.get_stats()
+    assert stats["dropped_items"] == 1
+    assert stats["retries"] == 0
+
+
+def test_failed_batches_are_replayed_from_spool(ingestion, tmp_path):
+    ingestion.responses = [(500, {})]
+    spool = monitor.telemetry_spool(tmp_path / "spool")
+    sender = monitor.batched_telemetry_sender(
+        endpoint=ingestion.url, spool=spool, max_retries=0, backoff_seconds=10
+    )
+    for number in range(5):
+        sender.put(envelope(number))
+    assert not sender.close(timeout=0.5)
+    sender.thread.join(timeout=10)
+    assert len(ingestion.attempts) == 1
+    assert not ingestion.batches
+
+    # a restarted sender replays the spooled items in order
+    spool = monitor.telemetry_spool(tmp_path / "spool")
+    assert spool.pending_items == 5
+    sender = monitor.batched_telemetry_sender(endpoint=ingestion.url, spool=spool)
+    assert sender.close(timeout=10)
+    assert get_numbers(ingestion.batches) == list(range(5))
+    assert monitor.telemetry_spool(tmp_path / "spool").pending_items == 0
+
+
+def test_queue_depth_counts_spooled_items_once(ingestion, tmp_path):
+    ingestion.responses = [(503, {})]
+    spool = monitor.telemetry_spool(tmp_path / "spool")
+    sender = monitor.batched_telemetry_sender(
+        endpoint=ingestion.url, spool=spool, max_batch_items=10, backoff_seconds=1
+    )
+    for number in range(50):
+        sender.put(envelope(number))
+    # the first batch waits for its retry
+    deadline = time.monotonic() + 10
+    while not ingestion.attempts and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert ingestion.attempts
+    assert sender.in_flight == 10
+    assert sender.get_stats()["queue_depth"] == 50
+    assert sender.close(timeout=10)
+    assert sender.get_stats()["queue_depth"] == 0
+
+
+def test_replay_rate_only_applies_to_a_backlog(ingestion, tmp_path):
+    spool = monitor.telemetry_spool(tmp_path / "spool")
+    sender = monitor.batched_telemetry_sender(
+        endpoint=ingestion.url, spool=spool, max_linger_seconds=0.05, max_replay_items_per_second=1
+    )
+    for number in range(5):
+        sender.put(envelope(number))
+    deadline = time.monotonic() + 10
+    while not ingestion.batches and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert ingestion.batches
+    # live items sent in one batch are not held back for the next batch
+    for number in range(5, 10):
+        sender.put(envelope(number))
+    assert sender.close(timeout=2)
+    assert get_numbers(ingestion.batches) == list(range(10))